@@ -8,8 +8,33 @@ import pandas as pd
 import gspread
 import unicodedata
 import tempfile
+import asyncio
+import weakref
+import sqlite3
+import hashlib
+import threading
+import time
+import argparse
+import math
+import functools
+import importlib
+import zipfile
+import contextlib
+import contextvars
+import heapq
+import itertools
+import random
+import io
+import multiprocessing
+import numpy as np
+import httpx
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from openai import AsyncOpenAI
 from google.oauth2.service_account import Credentials
-from difflib import get_close_matches
+from difflib import get_close_matches, SequenceMatcher
+from collections import Counter, OrderedDict, deque, namedtuple
+from xml.etree import ElementTree
+from types import SimpleNamespace
 
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
@@ -29,15 +54,23 @@ except Exception as e:
 
 # Función para obtener las credenciales de Google desde los secretos de Streamlit
 def get_google_credentials():
-    """Obtiene las credenciales de Google desde los secretos de Streamlit o desde un archivo local"""
+    """
+    Obtiene las credenciales de Google desde los secretos de Streamlit o desde un archivo local.
+    Se llama al importar el módulo, también en cada proceso del pool: el archivo temporal tiene
+    un nombre fijo según su contenido y solo se escribe si no existe.
+    """
     try:
         import streamlit as st
         if "gcp_service_account" in st.secrets:
-            # Crear un archivo temporal con las credenciales
-            creds_dict = dict(st.secrets["gcp_service_account"])
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as f:
-                json.dump(creds_dict, f)
-                temp_file = f.name
+            # Guardar las credenciales en un archivo temporal
+            creds_json = json.dumps(dict(st.secrets["gcp_service_account"]), sort_keys=True)
+            digest = hashlib.sha256(creds_json.encode('utf-8')).hexdigest()[:16]
+            temp_file = os.path.join(tempfile.gettempdir(), f"gcp_credentials_{digest}.json")
+            if not os.path.exists(temp_file):
+                fd, tmp_path = tempfile.mkstemp(prefix=".gcp_credentials_", suffix=".json")
+                with os.fdopen(fd, 'w') as f:
+                    f.write(creds_json)
+                os.replace(tmp_path, temp_file)
             print(f"Credenciales de Google cargadas desde secrets.toml y guardadas en {temp_file}")
             return temp_file
     except Exception as e:
@@ -56,81 +89,617 @@ FOLDER_CVS = "BDCandidatos"  # Carpeta donde están los CV
 OUTPUT_CSV = "resultados.csv"
 GOOGLE_DRIVE_FOLDER_ID = "1cdASLNMmbJ2zyRzy4D9c_eY4yrQ_wns7"  # ID de la carpeta en Drive
 GOOGLE_DRIVE_PROCESSED_FOLDER_ID = "1Yd-Yd-Yd-Yd-Yd-Yd-Yd-Yd-Yd-Yd"  # ID de la carpeta en Drive para CVs procesados
+MAX_WORKERS = 8  # Número de CVs que se procesan en paralelo (1 = secuencial)
+PIPELINE_MODE = "threads"  # "threads" (pool de hilos) o "async" (un solo event loop)
+ASYNC_OPENAI_MAX_CONNECTIONS = 50  # Conexiones simultáneas del cliente AsyncOpenAI compartido
+PROCESS_POOL_WORKERS = os.cpu_count() or 2  # Procesos del pool compartido para trabajo de CPU
+# Los procesos del pool no se crean con fork: el proceso principal tiene hilos (workers, descargas)
+PROCESS_POOL_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+DOWNLOAD_WORKERS = MAX_WORKERS  # Descargas simultáneas desde Drive
+DOWNLOAD_AHEAD = 2 * MAX_WORKERS  # Descargas que pueden ir por delante de los CVs que se están procesando
+DOWNLOAD_SPILL_BYTES = 20 * 1024 * 1024  # Los archivos más grandes se escriben en disco en lugar de quedarse en memoria
+DRIVE_INDEX_MAX_AGE = 600  # Segundos antes de resincronizar el índice de una carpeta de destino con el feed de cambios
+DRIVE_BATCH_SIZE = 100  # Operaciones de Drive (movimientos, permisos) por petición batch (máximo de la API: 100)
+DRIVE_BATCH_MAX_RETRIES = 3  # Reintentos de las operaciones de un batch que fallan por límite de cuota o error del servidor
+
+# Extracción de texto de PDF en el procesamiento de CVs (extract_cv_text): solo se leen las páginas
+# necesarias para llenar el presupuesto (a GPT se envía un extracto de CV_PROMPT_CHAR_BUDGET
+# caracteres; el resto queda para los fallbacks por regex). extract_text_from_pdf y
+# extract_text_from_docx, que usan también las apps, extraen por defecto el documento completo.
+PDF_TEXT_CHAR_BUDGET = 20000  # None = extraer el documento completo
+DOCX_TEXT_CHAR_BUDGET = 20000  # Igual para DOCX (cabeceras, cuerpo, tablas y cuadros de texto)
+
+# Extracto del CV que se envía en cada prompt (se priorizan contacto, grados y educación)
+CV_PROMPT_CHAR_BUDGET = 6000
+CV_HEADER_LINES = 15  # Líneas iniciales que se consideran cabecera del CV
+CV_EDUCATION_SECTION_LINES = 12  # Líneas que se consideran parte de una sección de educación
+
+# Presupuesto de tokens de entrada por petición (prompt + extracto del CV o filas QS) y precios
+MODEL_PROMPT_TOKEN_BUDGETS = {"gpt-3.5-turbo": 2500, "gpt-4o": 2500}
+DEFAULT_PROMPT_TOKEN_BUDGET = 2500
+MODEL_PRICES_PER_MTOK = {"gpt-3.5-turbo": (0.50, 1.50), "gpt-4o": (2.50, 10.00), "text-embedding-3-small": (0.02, 0)}  # USD por millón (entrada, salida)
+MODEL_AVG_LATENCY_SECONDS = {"gpt-3.5-turbo": 2.0, "gpt-4o": 5.0}  # Para la estimación previa de duración
+
+# Empaquetado de CVs cortos: varios CVs en una sola petición de datos básicos (modo two-pass)
+PACK_SHORT_CVS = True
+PACK_MAX_CV_TOKENS = 1500  # Solo se empaquetan los CVs que caben completos en este número de tokens
+PACK_MAX_CVS = 6  # CVs por petición empaquetada
+PACK_PROMPT_TOKEN_BUDGET = 9000  # Tokens de CVs por petición empaquetada
+PACK_COMPLETION_TOKENS_PER_CV = 300
+
+# Límites por minuto de cada modelo (peticiones, tokens) y reintentos de errores temporales
+MODEL_RATE_LIMITS = {"gpt-3.5-turbo": (3500, 160000), "gpt-4o": (500, 30000)}
+DEFAULT_RATE_LIMITS = (500, 30000)
+LLM_MAX_RETRIES = 5
+LLM_RETRY_BASE_DELAY = 1.0  # Segundos del primer backoff (se duplica en cada intento)
+LLM_RETRY_MAX_DELAY = 60.0
+
+# Modo batch (--batch): las llamadas a GPT se envían a la Batch API y se guardan en la caché
+OPENAI_BATCH_BASE_URL = None  # URL de un servidor compatible para pruebas (None = API de OpenAI)
+BATCH_WORK_DIR = "batches"  # Carpeta donde se guardan los JSONL enviados
+BATCH_MAX_REQUESTS = 50000  # Límite de peticiones por batch de la API
+BATCH_COMPLETION_WINDOW = "24h"
+BATCH_POLL_SECONDS = 60
+BATCH_RETRY_ROUNDS = 1  # Batches adicionales con las peticiones que fallaron (el resto queda para el procesamiento normal)
+BATCH_PRICE_FACTOR = 0.5  # La Batch API cobra la mitad del precio normal
+BATCH_USAGE_SUFFIX = "@batch"  # Sufijo del modelo en el resumen de tokens para el consumo de la Batch API
+PDF_PARALLEL_MIN_PAGES = 40  # A partir de este número de páginas se extrae en el pool de procesos (None = nunca)
+PDF_PAGES_PER_TASK = 8  # Páginas por tarea enviada al pool de procesos
+PDF_CLASSIFY_SAMPLE_PAGES = 3  # Páginas que se inspeccionan para decidir si el PDF está escaneado
+PDF_SCANNED_MIN_IMAGE_COVERAGE = 0.5  # Fracción de la página cubierta por imágenes para considerarla escaneada
+
+# OCR local (Tesseract) para CVs escaneados; requiere pytesseract y el binario tesseract instalado
+OCR_ENABLED = True
+OCR_LANGUAGES = "spa+eng"
+OCR_MAX_PAGES = 5  # Páginas sin texto que se pasan por OCR como máximo en cada documento
+OCR_TARGET_LONG_SIDE_PX = 3300  # Resolución objetivo del lado mayor de la página rasterizada
+OCR_MIN_DPI = 150
+OCR_MAX_DPI = 400
+
+# Modelos usados en cada etapa
+BASIC_DATA_MODEL = "gpt-3.5-turbo"
+AREA_MODEL = "gpt-4o"
+QS_MODEL = "gpt-4o"
+QS_CHUNK_MODEL = "gpt-3.5-turbo"
+SINGLE_PASS_MODEL = "gpt-4o"
+
+# Modo de extracción: "two-pass" (campos con GPT-3.5 + área con GPT-4o) o
+# "single-pass" (campos y área en una sola llamada, la mitad de tokens de entrada)
+EXTRACTION_MODE = "two-pass"
+
+# Caché en disco de los resultados de GPT y de las resoluciones QS
+# (se invalida al cambiar PROMPT_VERSION, el modelo o el contenido de la pestaña QS)
+LLM_CACHE_PATH = "cache_llm.sqlite3"
+LLM_CACHE_MAX_BYTES = 50 * 1024 * 1024  # Tamaño máximo antes de expulsar las entradas menos usadas
+LLM_CACHE_ENABLED = True
+PROMPT_VERSION = "3"  # Incrementar al modificar cualquier prompt
+
+# Tabla de alias de universidades (nombre canónico -> alias), curada a mano y de solo lectura. Las
+# coincidencias confirmadas por GPT se guardan aparte (fuera de git) y se combinan al cargar; para
+# hacerlas permanentes se revisan y se pasan a mano a la tabla curada.
+ALIASES_PATH = "aliases_universidades.json"
+LEARNED_ALIASES_PATH = "aliases_aprendidos.json"
+ALIASES_FILE_VERSION = 1
+ALIASES_LEARNING_ENABLED = True
+
+# Manifiesto local de las carpetas de Drive (id, nombre, md5Checksum, modifiedTime, tamaño); en las
+# ejecuciones siguientes solo se piden a Drive los cambios desde la anterior
+DRIVE_MANIFEST_PATH = "drive_manifest.json"
+DRIVE_MANIFEST_VERSION = 2
+DRIVE_MANIFEST_ENABLED = True
+CV_MIME_TYPES = ['application/pdf', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document']
+
+QS_FUZZY_CANDIDATES = 30  # Candidatos del índice de trigramas que se comparan con difflib
+LOCAL_MATCH_MIN_SCORE = 0.9  # Similitud mínima del motor local de universidades para evitar GPT
+LOCAL_MATCH_MIN_MARGIN = 0.1  # Ventaja mínima sobre el segundo candidato (si no, el nombre es ambiguo)
+QS_CHUNK_CONCURRENCY = 8  # Bloques de 40 universidades consultados a la vez en el fallback de GPT-3.5
+
+# Recuperación de candidatos QS por embeddings para el prompt de GPT-4o
+QS_EMBEDDING_MODEL = "text-embedding-3-small"
+QS_EMBEDDINGS_PATH = "qs_embeddings.npz"  # Matriz de embeddings de los nombres QS (se recalcula si cambian)
+QS_PROMPT_CANDIDATES = 20  # Universidades candidatas que se envían a GPT-4o
 
 openai.api_key = OPENAI_API_KEY
 
 def log(msg):
     print(f"[LOG] {msg}")
 
+# Contadores de la ejecución (aciertos de caché, etc.), compartidos entre hilos
+RUN_STATS = Counter()
+_run_stats_lock = threading.Lock()
+
+def count_stat(name, n=1):
+    with _run_stats_lock:
+        RUN_STATS[name] += n
+
+def log_run_summary():
+    """Muestra los contadores acumulados durante la ejecución"""
+    with _run_stats_lock:
+        stats = sorted(RUN_STATS.items())
+    if not stats:
+        return
+    log("Resumen de la ejecución:")
+    for name, value in stats:
+        log(f"  {name}: {value}")
+    usage = Counter()
+    for name, value in stats:
+        for kind in ("prompt", "completion"):
+            if name.startswith(f"tokens_{kind}_"):
+                usage[(name[len(f"tokens_{kind}_"):], kind)] += value
+    if usage:
+        log(f"  Coste estimado de GPT: {usage_cost(usage):.4f} USD")
+
+# === Credenciales y clientes de Google compartidos ===
+DRIVE_SCOPES = ['https://www.googleapis.com/auth/drive']
+SHEETS_SCOPES = [
+    'https://spreadsheets.google.com/feeds',
+    'https://www.googleapis.com/auth/drive'
+]
+
+_google_credentials = {}
+_google_credentials_lock = threading.Lock()
+_gspread_clients = {}
+# httplib2 no es seguro entre hilos: cada hilo tiene su propio servicio de Drive
+_drive_services = threading.local()
+
+def get_google_service_credentials(creds_path, scopes):
+    """
+    Credenciales de la cuenta de servicio, leídas del archivo una sola vez por ruta y scopes
+    y compartidas por todos los hilos. El token se renueva aquí (con un solo hilo a la vez)
+    cuando falta o está a punto de caducar.
+    """
+    key = (os.path.abspath(creds_path), tuple(scopes))
+    with _google_credentials_lock:
+        creds = _google_credentials.get(key)
+        if creds is None:
+            creds = Credentials.from_service_account_file(creds_path, scopes=scopes)
+            _google_credentials[key] = creds
+        if not creds.valid:
+            from google.auth.transport.requests import Request
+            creds.refresh(Request())
+    return creds
+
+def get_drive_service(creds_path):
+    """Servicio de Drive v3 del hilo actual (se construye una vez por hilo, sin caché de discovery)"""
+    creds = get_google_service_credentials(creds_path, DRIVE_SCOPES)
+    services = getattr(_drive_services, "services", None)
+    if services is None:
+        services = _drive_services.services = {}
+    service = services.get(creds_path)
+    if service is None:
+        service = build('drive', 'v3', credentials=creds, cache_discovery=False)
+        services[creds_path] = service
+    return service
+
+def get_gspread_client(service_account_file):
+    """Cliente de gspread compartido (se autoriza una sola vez por archivo de credenciales)"""
+    creds = get_google_service_credentials(service_account_file, SHEETS_SCOPES)
+    with _google_credentials_lock:
+        gc = _gspread_clients.get(service_account_file)
+        if gc is None:
+            gc = gspread.authorize(creds)
+            _gspread_clients[service_account_file] = gc
+    return gc
+
 def get_qs_list_from_google_sheets(sheet_id, sheet_name, service_json):
-    scope = [
-        'https://spreadsheets.google.com/feeds',
-        'https://www.googleapis.com/auth/drive'
-    ]
-    creds = Credentials.from_service_account_file(service_json, scopes=scope)
-    gc = gspread.authorize(creds)
+    gc = get_gspread_client(service_json)
     sh = gc.open_by_key(sheet_id)
     ws = sh.worksheet(sheet_name)
     data = ws.get_all_values()
     qs_list = data[1:]
     return qs_list
 
-def extract_text_from_pdf(path):
+# === Pool de procesos compartido para el trabajo de CPU (extracción de páginas) ===
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+def get_process_pool():
+    """
+    Devuelve el ProcessPoolExecutor compartido. process_all_cvs_in_folder lo crea en el hilo
+    principal antes de lanzar los workers; sus procesos arrancan con PROCESS_POOL_START_METHOD.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(max_workers=PROCESS_POOL_WORKERS,
+                                                mp_context=multiprocessing.get_context(PROCESS_POOL_START_METHOD))
+        return _process_pool
+
+def collect_text(pages, char_budget=None):
+    """
+    Une el texto de las páginas hasta alcanzar char_budget caracteres (None = sin límite).
+    Deja de consumir el generador en cuanto se alcanza, de modo que no se leen más páginas.
+    """
+    parts = []
+    total = 0
+    try:
+        for page_text in pages:
+            parts.append(page_text)
+            total += len(page_text)
+            if char_budget and total >= char_budget:
+                break
+    finally:
+        close = getattr(pages, "close", None)
+        if close:
+            close()
+    text = "".join(parts)
+    return text[:char_budget] if char_budget else text
+
+def open_pdf(source):
+    """Abre un PDF con PyMuPDF desde su ruta o desde los bytes descargados en memoria"""
+    if isinstance(source, bytes):
+        return fitz.open(stream=source, filetype="pdf")
+    return fitz.open(source)
+
+def file_source(source):
+    """La ruta tal cual o los bytes como archivo en memoria (para librerías que aceptan ambos)"""
+    return io.BytesIO(source) if isinstance(source, bytes) else source
+
+def iter_pdf_pages(doc):
+    """Genera el texto de cada página de un documento PyMuPDF abierto, una página cada vez"""
+    for page in doc:
+        yield page.get_text()
+
+@contextlib.contextmanager
+def pdf_path_for_pool(source):
+    """
+    Ruta del PDF para las tareas del pool de procesos: un PDF en memoria se escribe en un archivo
+    temporal (que se borra al salir) para no enviar sus bytes completos en cada tarea
+    """
+    if not isinstance(source, bytes):
+        yield source
+        return
+    fd, path = tempfile.mkstemp(prefix=".cv_", suffix=".pdf")
     try:
-        text = ""
-        with fitz.open(path) as doc:
-            for page in doc:
-                text += page.get_text()
+        with os.fdopen(fd, 'wb') as f:
+            f.write(source)
+        yield path
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def extract_pdf_page_range(source, start, stop):
+    """Texto de las páginas [start, stop) de un PDF (se ejecuta en un proceso del pool)"""
+    with open_pdf(source) as doc:
+        return [doc[i].get_text() for i in range(start, min(stop, doc.page_count))]
+
+def iter_pdf_pages_parallel(source, page_count):
+    """
+    Como iter_pdf_pages, pero extrae bloques de PDF_PAGES_PER_TASK páginas en el pool de procesos.
+    Las páginas se generan en orden y solo hay unos pocos bloques en vuelo, así que al cerrar el
+    generador (presupuesto alcanzado) no se extraen las páginas restantes.
+    """
+    pool = get_process_pool()
+    ranges = iter(range(0, page_count, PDF_PAGES_PER_TASK))
+    in_flight = deque()
+    
+    with pdf_path_for_pool(source) as path:
+        def submit_next():
+            start = next(ranges, None)
+            if start is not None:
+                in_flight.append(pool.submit(extract_pdf_page_range, path, start, start + PDF_PAGES_PER_TASK))
         
-        # Verificar si se extrajo texto
-        if not text.strip():
-            log(f"No se pudo extraer texto del PDF {os.path.basename(path)}, intentando método alternativo...")
-            
-            # Método alternativo: usar PyPDF2
+        try:
+            for _ in range(PROCESS_POOL_WORKERS):
+                submit_next()
+            while in_flight:
+                pages = in_flight.popleft().result()
+                submit_next()
+                yield from pages
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+# === Motores de extracción de texto de PDF ===
+# Cada motor recibe (ruta o bytes del PDF, documento PyMuPDF abierto, presupuesto de caracteres) y
+# devuelve el texto.
+# "text" se usa con PDFs con fuentes; "scanned" con PDFs que solo contienen imágenes de páginas y
+# "empty" con los que no tienen ni fuentes ni imágenes grandes en las primeras páginas.
+PDF_ENGINES = {"text": [], "scanned": [], "empty": []}
+
+def register_pdf_engine(name, func, kind="text"):
+    """Añade un motor de extracción al final de la cascada del tipo de PDF indicado"""
+    PDF_ENGINES[kind] = [engine for engine in PDF_ENGINES[kind] if engine[0] != name]
+    PDF_ENGINES[kind].append((name, func))
+
+@functools.lru_cache(maxsize=None)
+def optional_import(module_name):
+    """Importa un módulo opcional una sola vez; devuelve None si no está instalado"""
+    try:
+        return importlib.import_module(module_name)
+    except ImportError:
+        return None
+
+def classify_pdf(doc, sample_pages=PDF_CLASSIFY_SAMPLE_PAGES):
+    """
+    Clasifica el PDF antes de extraer nada: "text" si alguna página usa fuentes (solo se leen
+    los recursos, sin extraer texto), "scanned" si en las primeras páginas hay imágenes que cubren
+    la mayor parte de la página y "empty" si no hay ni fuentes ni imágenes.
+    """
+    has_images = False
+    for i, page in enumerate(doc):
+        if page.get_fonts():
+            return "text"
+        if i >= sample_pages or has_images:
+            continue
+        page_area = abs(page.rect) or 1
+        image_area = sum(abs(fitz.Rect(info["bbox"]) & page.rect) for info in page.get_image_info())
+        if image_area / page_area >= PDF_SCANNED_MIN_IMAGE_COVERAGE:
+            has_images = True
+    return "scanned" if has_images else "empty"
+
+def pymupdf_engine(source, doc, char_budget):
+    """
+    Motor principal: PyMuPDF página a página (en el pool de procesos para PDFs muy largos).
+    Las páginas sin texto (escaneadas dentro de un PDF con texto, o con fuentes que no dan
+    texto) se pasan por OCR.
+    """
+    if PDF_PARALLEL_MIN_PAGES and doc.page_count >= PDF_PARALLEL_MIN_PAGES:
+        return collect_text(iter_pages_with_ocr(source, iter_pdf_pages_parallel(source, doc.page_count)), char_budget)
+    return collect_text(iter_pages_with_ocr(source, iter_pdf_pages(doc)), char_budget)
+
+def pypdf2_engine(source, doc, char_budget):
+    """Motor alternativo para PDFs con codificaciones de fuentes que PyMuPDF no interpreta"""
+    PyPDF2 = optional_import("PyPDF2")
+    if PyPDF2 is None:
+        return ""
+    reader = PyPDF2.PdfReader(file_source(source))
+    return collect_text((page.extract_text() + "\n" for page in reader.pages), char_budget)
+
+def pdfplumber_engine(source, doc, char_budget):
+    """Último motor para PDFs con texto: pdfplumber (el más lento)"""
+    pdfplumber = optional_import("pdfplumber")
+    if pdfplumber is None:
+        return ""
+    with pdfplumber.open(file_source(source)) as pdf:
+        return collect_text((page.extract_text() or "" for page in pdf.pages), char_budget)
+
+register_pdf_engine("pymupdf", pymupdf_engine)
+register_pdf_engine("pypdf2", pypdf2_engine)
+register_pdf_engine("pdfplumber", pdfplumber_engine)
+
+@functools.lru_cache(maxsize=None)
+def get_tesseract():
+    """Devuelve pytesseract si la librería y el binario de Tesseract están disponibles; si no, None"""
+    pytesseract = optional_import("pytesseract")
+    if pytesseract is None:
+        log("OCR desactivado: pytesseract no está instalado")
+        return None
+    try:
+        pytesseract.get_tesseract_version()
+    except Exception as e:
+        log(f"OCR desactivado: no se encontró el binario de Tesseract ({e})")
+        return None
+    return pytesseract
+
+def ocr_dpi(page):
+    """DPI adaptativo: el lado mayor de la página se rasteriza a unos OCR_TARGET_LONG_SIDE_PX píxeles"""
+    long_side_inches = max(page.rect.width, page.rect.height) / 72 or 1
+    return int(min(OCR_MAX_DPI, max(OCR_MIN_DPI, OCR_TARGET_LONG_SIDE_PX / long_side_inches)))
+
+def ocr_pdf_page(source, page_number):
+    """Rasteriza una página sin texto y la pasa por Tesseract (se ejecuta en un proceso del pool)"""
+    from PIL import Image
+    pytesseract = get_tesseract()
+    if pytesseract is None:
+        return ""
+    with open_pdf(source) as doc:
+        page = doc[page_number]
+        pix = page.get_pixmap(dpi=ocr_dpi(page), colorspace=fitz.csGRAY, alpha=False)
+        image = Image.frombytes("L", (pix.width, pix.height), pix.samples)
+    return pytesseract.image_to_string(image, lang=OCR_LANGUAGES) + "\n"
+
+def iter_pages_with_ocr(source, pages):
+    """
+    Genera el texto de las páginas y sustituye las que no tienen texto por su OCR (como máximo
+    OCR_MAX_PAGES por documento). El OCR corre en el pool de procesos con hasta
+    PROCESS_POOL_WORKERS páginas por delante de la que se está generando.
+    """
+    if not OCR_ENABLED or get_tesseract() is None:
+        yield from pages
+        return
+    pool = get_process_pool()
+    ocr_left = OCR_MAX_PAGES
+    window = deque()
+    # El PDF en memoria se escribe en disco solo si alguna página necesita OCR
+    stack = contextlib.ExitStack()
+    path = None
+    try:
+        for page_number, page_text in enumerate(pages):
+            if not page_text.strip() and ocr_left:
+                ocr_left -= 1
+                count_stat("ocr_pages")
+                if path is None:
+                    path = stack.enter_context(pdf_path_for_pool(source))
+                window.append(pool.submit(ocr_pdf_page, path, page_number))
+            else:
+                window.append(page_text)
+            if len(window) > PROCESS_POOL_WORKERS:
+                item = window.popleft()
+                yield item if isinstance(item, str) else item.result()
+        while window:
+            item = window.popleft()
+            yield item if isinstance(item, str) else item.result()
+    finally:
+        for item in window:
+            if not isinstance(item, str):
+                item.cancel()
+        close = getattr(pages, "close", None)
+        if close:
+            close()
+        stack.close()
+
+def tesseract_engine(source, doc, char_budget):
+    """
+    Motor OCR para PDFs escaneados: solo las páginas en las que PyMuPDF no encuentra texto
+    (como máximo OCR_MAX_PAGES por documento), repartidas en el pool de procesos.
+    """
+    if not OCR_ENABLED or get_tesseract() is None:
+        return ""
+    pages = [page.number for page in doc if not page.get_text().strip()][:OCR_MAX_PAGES]
+    if not pages:
+        return ""
+    pool = get_process_pool()
+    with pdf_path_for_pool(source) as path:
+        futures = [pool.submit(ocr_pdf_page, path, page_number) for page_number in pages]
+        try:
+            text = collect_text((future.result() for future in futures), char_budget)
+        finally:
+            for future in futures:
+                future.cancel()
+    count_stat("ocr_pages", len(pages))
+    return text
+
+register_pdf_engine("tesseract", tesseract_engine, kind="scanned")
+# Sin fuentes ni imágenes en las páginas de muestra: puede haber páginas escaneadas más adelante
+register_pdf_engine("tesseract", tesseract_engine, kind="empty")
+
+def extract_pdf_text_with_engine(path, char_budget=None, data=None):
+    """
+    Clasifica el PDF y lo envía directamente a la cascada de motores de su tipo. Si se pasan
+    los bytes del archivo (data), se leen de memoria y path solo identifica el archivo.
+    Devuelve (texto, nombre del motor que lo produjo o None, tipo de PDF).
+    """
+    source = path if data is None else data
+    with open_pdf(source) as doc:
+        kind = classify_pdf(doc)
+        for name, engine in PDF_ENGINES.get(kind, []):
             try:
-                import PyPDF2
-                with open(path, 'rb') as file:
-                    reader = PyPDF2.PdfReader(file)
-                    for page_num in range(len(reader.pages)):
-                        text += reader.pages[page_num].extract_text() + "\n"
-            except Exception as e2:
-                log(f"Error con PyPDF2: {e2}")
-                
-                # Si PyPDF2 falla, intentar con pdfplumber
-                try:
-                    import pdfplumber
-                    with pdfplumber.open(path) as pdf:
-                        for page in pdf.pages:
-                            text += page.extract_text() or ""
-                except Exception as e3:
-                    log(f"Error con pdfplumber: {e3}")
-        
-        log(f"Texto extraído de PDF {os.path.basename(path)} ({len(text)} caracteres)")
+                text = engine(source, doc, char_budget)
+            except Exception as e:
+                log(f"Error con el motor {name} en {os.path.basename(path)}: {e}")
+                continue
+            if text.strip():
+                return text, name, kind
+    return "", None, kind
+
+def extract_text_from_pdf(path, char_budget=None, data=None):
+    try:
+        text, engine, kind = extract_pdf_text_with_engine(path, char_budget, data)
+        if engine:
+            count_stat(f"pdf_engine_{engine}")
+            log(f"Texto extraído de PDF {os.path.basename(path)} con {engine} ({len(text)} caracteres)")
+        else:
+            count_stat(f"pdf_no_text_{kind}")
+            log(f"No se pudo extraer texto del PDF {os.path.basename(path)} (tipo: {kind})")
         return text
     except Exception as e:
         log(f"Error al leer el PDF '{path}': {e}")
         return ""
 
-def extract_text_from_docx(path):
+# === Extracción de texto de DOCX leyendo el XML directamente ===
+WORD_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+MC_NS = "{http://schemas.openxmlformats.org/markup-compatibility/2006}"
+
+def docx_header_footer_parts(archive):
+    """Partes XML de las cabeceras y de los pies de página, según las relaciones del documento"""
+    names = set(archive.namelist())
+    rels_name = "word/_rels/document.xml.rels"
+    headers, footers = [], []
+    if rels_name not in names:
+        return headers, footers
+    for _, elem in ElementTree.iterparse(archive.open(rels_name)):
+        rel_type = elem.get("Type", "")
+        target = "word/" + elem.get("Target", "").lstrip("/").replace("word/", "", 1)
+        if target not in names:
+            continue
+        if rel_type.endswith("/header"):
+            headers.append(target)
+        elif rel_type.endswith("/footer"):
+            footers.append(target)
+    return sorted(headers), sorted(footers)
+
+def iter_docx_part_lines(archive, part_name):
+    """
+    Genera las líneas de una parte XML en orden de lectura: un párrafo por línea, una fila de
+    tabla por línea ("celda 1 | celda 2") y los cuadros de texto junto al párrafo que los ancla.
+    Se ignora mc:Fallback, que repite el contenido de los cuadros de texto para Word antiguo.
+    """
+    paragraphs = []  # Pila de párrafos abiertos (los cuadros de texto anidan párrafos)
+    tables = []  # Pila de tablas abiertas: (celdas de la fila actual, párrafos de la celda actual)
+    fallback_depth = 0
+    for event, elem in ElementTree.iterparse(archive.open(part_name), events=("start", "end")):
+        tag = elem.tag
+        if tag == MC_NS + "Fallback":
+            fallback_depth += 1 if event == "start" else -1
+            continue
+        if fallback_depth:
+            continue
+        
+        if event == "start":
+            if tag == WORD_NS + "p":
+                paragraphs.append([])
+            elif tag == WORD_NS + "tbl":
+                tables.append(([], []))
+            continue
+        
+        if tag == WORD_NS + "t":
+            if paragraphs:
+                paragraphs[-1].append(elem.text or "")
+        elif tag == WORD_NS + "tab":
+            if paragraphs:
+                paragraphs[-1].append("\t")
+        elif tag in (WORD_NS + "br", WORD_NS + "cr"):
+            if paragraphs:
+                paragraphs[-1].append("\n")
+        elif tag == WORD_NS + "p" and paragraphs:
+            text = "".join(paragraphs.pop())
+            if tables:
+                tables[-1][1].append(text)
+            else:
+                yield text + "\n"
+            elem.clear()
+        elif tag == WORD_NS + "tc" and tables:
+            cells, cell_paragraphs = tables[-1]
+            cells.append(" ".join(p.strip() for p in cell_paragraphs if p.strip()))
+            cell_paragraphs.clear()
+        elif tag == WORD_NS + "tr" and tables:
+            cells = tables[-1][0]
+            line = " | ".join(c for c in cells if c)
+            cells.clear()
+            if len(tables) > 1:
+                # Tabla anidada: la fila pasa a ser un párrafo de la celda que la contiene
+                tables[-2][1].append(line)
+            elif line:
+                yield line + "\n"
+            elem.clear()
+        elif tag == WORD_NS + "tbl" and tables:
+            tables.pop()
+
+def extract_docx_xml_text(source, char_budget=None):
+    """Texto de cabeceras, cuerpo (con tablas y cuadros de texto) y pies de página de un DOCX (ruta o bytes)"""
+    with zipfile.ZipFile(file_source(source)) as archive:
+        headers, footers = docx_header_footer_parts(archive)
+        parts = headers + ["word/document.xml"] + footers
+        lines = (line for part_name in parts for line in iter_docx_part_lines(archive, part_name))
+        return collect_text(lines, char_budget)
+
+def extract_text_from_docx(path, char_budget=None, data=None):
+    source = path if data is None else data
     try:
-        docf = docx.Document(path)
-        text = "\n".join([p.text for p in docf.paragraphs])
+        text = extract_docx_xml_text(source, char_budget)
         log(f"Texto extraído de DOCX {os.path.basename(path)} ({len(text)} caracteres)")
         return text
+    except Exception as e:
+        log(f"Error al leer el XML del DOCX '{path}': {e}, intentando con python-docx...")
+    
+    try:
+        docf = docx.Document(file_source(source))
+        text = "\n".join([p.text for p in docf.paragraphs])
+        log(f"Texto extraído de DOCX {os.path.basename(path)} ({len(text)} caracteres)")
+        return text[:char_budget] if char_budget else text
     except Exception as e:
         log(f"Error al leer el DOCX '{path}': {e}")
         return ""
 
 def clean_phone(phone):
     # Eliminar caracteres no numéricos excepto el signo +
-    cleaned = re.sub(r'[^\d\+]', '', phone)
-    
-    # Verificar si parece un rango de años (como 20072015)
-    if re.match(r'^(19|20)\d{2}(19|20)\d{2}$', cleaned):
-        return "No encontrado"
+    cleaned = NON_PHONE_CHARS_RE.sub('', phone)
     
-    # Verificar si es solo un año (como 2007)
-    if re.match(r'^(19|20)\d{2}$', cleaned):
+    # Verificar si parece un rango de años (como 20072015) o es solo un año (como 2007)
+    if YEAR_RANGE_RE.match(cleaned) or YEAR_RE.match(cleaned):
         return "No encontrado"
     
     return cleaned
@@ -138,110 +707,1279 @@ def clean_phone(phone):
 def normalize_str(s):
     return unicodedata.normalize('NFKD', s.lower()).encode('ascii', 'ignore').decode('ascii')
 
-def get_aliases_for_univ(univ):
-    d = {
-        "tecnologico de monterrey": ["itesm", "tec de monterrey", "monterrey tech", "instituto tecnologico y de estudios superiores de monterrey"],
-        "universidad nacional autonoma de mexico": ["unam", "national autonomous university of mexico"],
-        "universidad de buenos aires": ["uba", "university of buenos aires"],
-        "pontificia universidad catolica de chile": ["puc", "catolica de chile"],
-        "universitat de barcelona": ["ub", "university of barcelona"],
-        "universidad de los andes": ["uniandes", "univ de los andes"],
+# === Escáner de datos de contacto (una sola pasada con patrones precompilados) ===
+NON_PHONE_CHARS_RE = re.compile(r'[^\d\+]')
+NON_DIGITS_RE = re.compile(r'\D')
+YEAR_RANGE_RE = re.compile(r'^(19|20)\d{2}(19|20)\d{2}$')
+YEAR_RE = re.compile(r'^(19|20)\d{2}$')
+
+EMAIL_RE = re.compile(r"[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+")
+EMAIL_LOCAL_CHARS = frozenset("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_.+-")
+EMAIL_KEYWORD_RE = re.compile(r"e-?mail|correo|contact")  # Se aplica sobre el texto en minúsculas
+LINKEDIN_RE = re.compile(r"https?://(www\.)?linkedin\.com/in/[A-Za-z0-9\-_/]+")
+# Palabras clave de teléfono seguidas del número; se aplica sobre el texto en minúsculas
+PHONE_KEYWORD_RE = re.compile(r"tel[eé]fono\s*(?:m[oó]vil)?|phone\s*(?:number)?|contacto?|m[oó]vil|celular|tel")
+PHONE_AFTER_KEYWORD_RE = re.compile(r"[\s:]*(\+?[\d\s\-\(\)\.]{8,})")
+# Prioridad de las palabras clave de teléfono (menor = más fiable)
+PHONE_KEYWORD_RANKS = ["telefono", "phone", "contact", "movil", "celular", "tel"]
+# Sin palabra clave, por prioridad: internacional, con paréntesis o más de 8 dígitos (para evitar años)
+BARE_PHONE_PATTERNS = [
+    re.compile(r"(?<!\d)(\+\d{1,3}[\s\-]?\d{1,3}[\s\-]?\d{3,}[\s\-]?\d{3,}(?!\d))"),
+    re.compile(r"(?<!\d)(\(\d{2,5}\)[\s\-]?\d{3,}[\s\-]?\d{3,}(?!\d))"),
+    re.compile(r"(?<!\d)(\d{3,}[\s\-]?\d{3,}[\s\-]?\d{3,}(?!\d))"),
+]
+NAME_PATTERNS = [
+    re.compile(r"(?i)curriculum\s+vitae\s+(?:de\s+)?([A-ZÁÉÍÓÚÑa-záéíóúñ\s]{2,50})"),
+    re.compile(r"(?i)(?:nombre|name)[:]\s*([A-ZÁÉÍÓÚÑa-záéíóúñ\s]{2,50})"),
+    re.compile(r"(?i)^([A-ZÁÉÍÓÚÑa-záéíóúñ\s]{2,50})$"),  # Línea que solo contiene un nombre
+    re.compile(r"(?i)(?:cv|resume|curriculum)\s+(?:of|de)\s+([A-ZÁÉÍÓÚÑa-záéíóúñ\s]{2,50})"),
+    re.compile(r"(?i)(?:dr\.|ing\.|lic\.|mtro\.)\s+([A-ZÁÉÍÓÚÑa-záéíóúñ\s]{2,50})"),
+]
+MULTISPACE_RE = re.compile(r'\s+')
+NAME_SPECIAL_CHARS_RE = re.compile(r'[^\w\sáéíóúÁÉÍÓÚñÑ]')
+
+def valid_phone(raw_phone):
+    """Teléfono limpio si tiene al menos 8 dígitos (y no es un año ni un rango de años); si no, None"""
+    phone = clean_phone(raw_phone)
+    if len(NON_DIGITS_RE.sub('', phone)) >= 8:
+        return phone
+    return None
+
+def phone_keyword_rank(keyword):
+    """Prioridad de una palabra clave de teléfono (menor = más fiable)"""
+    keyword = normalize_str(keyword)
+    return next(i for i, prefix in enumerate(PHONE_KEYWORD_RANKS) if keyword.startswith(prefix))
+
+def scan_emails(text, lowered):
+    """Candidatos de email (sin palabra clave cercana, posición, email) a partir de cada "@" del texto"""
+    candidates = []
+    at = text.find("@")
+    while at != -1:
+        start = at
+        while start > 0 and text[start - 1] in EMAIL_LOCAL_CHARS:
+            start -= 1
+        match = EMAIL_RE.match(text, start) if start < at else None
+        if match:
+            near_keyword = EMAIL_KEYWORD_RE.search(lowered, max(0, start - 40), start)
+            candidates.append((near_keyword is None, start, match.group(0)))
+        at = text.find("@", match.end() if match else at + 1)
+    return candidates
+
+def scan_phones(text, lowered):
+    """
+    Candidatos de teléfono (prioridad, posición, teléfono). Primero los que siguen a una palabra
+    clave, ordenados por la fiabilidad de la palabra; si no hay ninguno, el primer número suelto
+    válido de cada patrón.
+    """
+    candidates = []
+    for keyword in PHONE_KEYWORD_RE.finditer(lowered):
+        match = PHONE_AFTER_KEYWORD_RE.match(text, keyword.end())
+        phone = valid_phone(match.group(1)) if match else None
+        if phone:
+            candidates.append((phone_keyword_rank(keyword.group(0)), keyword.start(), phone))
+    if candidates:
+        return candidates
+    
+    for rank, pattern in enumerate(BARE_PHONE_PATTERNS):
+        for match in pattern.finditer(text):
+            phone = valid_phone(match.group(1))
+            if phone:
+                candidates.append((len(PHONE_KEYWORD_RANKS) + rank, match.start(), phone))
+                break
+    return candidates
+
+@functools.lru_cache(maxsize=32)
+def scan_contacts(text):
+    """
+    Extrae de una sola vez el email, teléfono, LinkedIn y nombre del CV con patrones
+    precompilados. Se recogen todos los candidatos con su posición y gana el mejor puntuado:
+    los teléfonos tras una palabra clave (por fiabilidad de la palabra y luego por posición) y
+    los emails precedidos de "email"/"correo"/"contacto". Las búsquedas caras solo se lanzan
+    donde pueden coincidir ("@", "linkedin.com/in/"), y el resultado se memoriza por texto, así
+    que todos los fallbacks de un CV comparten la misma pasada.
+    """
+    lowered = text.lower()
+    if len(lowered) != len(text):  # Algunos caracteres cambian de longitud al pasar a minúsculas
+        lowered = "".join(c.lower()[0] for c in text)
+    
+    emails = scan_emails(text, lowered) if "@" in text else []
+    phones = scan_phones(text, lowered)
+    linkedin_at = text.find("linkedin.com/in/")
+    linkedin = LINKEDIN_RE.search(text, max(0, linkedin_at - 12)) if linkedin_at != -1 else None
+    return {
+        "email": min(emails)[2] if emails else "No encontrado",
+        "phone": min(phones)[2] if phones else "No encontrado",
+        "linkedin": linkedin.group(0) if linkedin else "No encontrado",
+        "name": scan_name(text),
     }
-    n = normalize_str(univ)
-    for key, aliases in d.items():
-        if n == key or n in aliases:
-            return [key] + aliases
-    return [n]
 
 def fallback_regex_email(text):
-    match = re.search(r"[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+", text)
-    return match.group(0) if match else "No encontrado"
+    return scan_contacts(text)["email"]
 
 def fallback_regex_phone(text):
-    # Buscar números de teléfono cerca de palabras clave
-    phone_keywords = [
-        r"(?i)tel[eé]fono\s*(?:m[oó]vil)?[\s:]*(\+?[\d\s\-\(\)\.]{8,})",
-        r"(?i)phone\s*(?:number)?[\s:]*(\+?[\d\s\-\(\)\.]{8,})",
-        r"(?i)contact(?:o)?[\s:]*(\+?[\d\s\-\(\)\.]{8,})",
-        r"(?i)m[oó]vil[\s:]*(\+?[\d\s\-\(\)\.]{8,})",
-        r"(?i)celular[\s:]*(\+?[\d\s\-\(\)\.]{8,})",
-        r"(?i)tel[\s:]*(\+?[\d\s\-\(\)\.]{8,})",
-        r"(?i)phone[\s:]*(\+?[\d\s\-\(\)\.]{8,})"
-    ]
-    
-    # Buscar números de teléfono cerca de palabras clave
-    for pattern in phone_keywords:
-        match = re.search(pattern, text)
-        if match:
-            phone = clean_phone(match.group(1))
-            # Verificar que sea un número de teléfono válido (al menos 8 dígitos)
-            if len(re.sub(r'\D', '', phone)) >= 8:
-                return phone
-    
-    # Si no se encuentra con palabras clave, buscar patrones de teléfono comunes
-    # pero evitando rangos de años (que suelen tener 4 dígitos - 4 dígitos)
-    phone_patterns = [
-        # Número internacional con código de país
-        r"(?<!\d)(\+\d{1,3}[\s\-]?\d{1,3}[\s\-]?\d{3,}[\s\-]?\d{3,}(?!\d))",
-        # Número con paréntesis para código de área
-        r"(?<!\d)(\(\d{2,5}\)[\s\-]?\d{3,}[\s\-]?\d{3,}(?!\d))",
-        # Número con más de 8 dígitos (para evitar años)
-        r"(?<!\d)(\d{3,}[\s\-]?\d{3,}[\s\-]?\d{3,}(?!\d))"
-    ]
-    
-    for pattern in phone_patterns:
-        match = re.search(pattern, text)
-        if match:
-            phone = clean_phone(match.group(1))
-            # Verificar que sea un número de teléfono válido (al menos 8 dígitos)
-            if len(re.sub(r'\D', '', phone)) >= 8:
-                return phone
-    
-    # Si no se encuentra ningún patrón, devolver "No encontrado"
-    return "No encontrado"
+    return scan_contacts(text)["phone"]
 
 def fallback_regex_linkedin(text):
-    match = re.search(r"https?://(www\.)?linkedin\.com/in/[A-Za-z0-9\-_/]+", text)
-    return match.group(0) if match else "No encontrado"
+    return scan_contacts(text)["linkedin"]
 
-def fallback_regex_name(text):
-    """Intenta extraer el nombre del CV usando patrones comunes"""
-    # Patrones comunes para nombres en CVs
-    patterns = [
-        r"(?i)curriculum\s+vitae\s+(?:de\s+)?([A-ZÁÉÍÓÚÑa-záéíóúñ\s]{2,50})",
-        r"(?i)(?:nombre|name)[:]\s*([A-ZÁÉÍÓÚÑa-záéíóúñ\s]{2,50})",
-        r"(?i)^([A-ZÁÉÍÓÚÑa-záéíóúñ\s]{2,50})$",  # Línea que solo contiene un nombre
-        r"(?i)(?:cv|resume|curriculum)\s+(?:of|de)\s+([A-ZÁÉÍÓÚÑa-záéíóúñ\s]{2,50})",
-        r"(?i)(?:dr\.|ing\.|lic\.|mtro\.)\s+([A-ZÁÉÍÓÚÑa-záéíóúñ\s]{2,50})"
-    ]
-    
-    # Buscar en las primeras líneas del texto
-    first_lines = "\n".join(text.split("\n")[:20])
-    
-    for pattern in patterns:
-        match = re.search(pattern, first_lines)
+def scan_name(text):
+    """Intenta extraer el nombre de las primeras 20 líneas del CV usando patrones comunes"""
+    first_lines = "\n".join(text.split("\n", 20)[:20])
+    
+    for pattern in NAME_PATTERNS:
+        match = pattern.search(first_lines)
         if match:
             name = match.group(1).strip()
             # Limpiar el nombre
-            name = re.sub(r'\s+', ' ', name)  # Eliminar espacios múltiples
-            name = re.sub(r'[^\w\sáéíóúÁÉÍÓÚñÑ]', '', name)  # Eliminar caracteres especiales
+            name = MULTISPACE_RE.sub(' ', name)  # Eliminar espacios múltiples
+            name = NAME_SPECIAL_CHARS_RE.sub('', name)  # Eliminar caracteres especiales
             if len(name) > 3:  # Asegurarse de que el nombre tenga al menos 3 caracteres
                 return name
     
     # Si no se encuentra un nombre, extraer el nombre del archivo
     return "No encontrado"
 
-def determine_knowledge_area(cv_text, subject="", university=""):
+def fallback_regex_name(text):
+    """Intenta extraer el nombre del CV usando patrones comunes"""
+    return scan_contacts(text)["name"]
+
+# === Resumen del CV para los prompts ===
+# Señales para priorizar líneas cuando el CV no cabe en CV_PROMPT_CHAR_BUDGET caracteres
+CONTACT_LINE_RE = re.compile(
+    r"[\w.+-]+@[\w-]+\.[\w.-]+|linkedin\.com|\+\d[\d\s\-\(\)\.]{7,}\d|\(?\d{2,4}\)?[\s\-\.]\d{3,4}[\s\-\.]\d{4}|"
+    r"(?i:tel[eé]fono|phone|m[oó]vil|celular|e-?mail|correo)"
+)
+DEGREE_LINE_RE = re.compile(
+    r"(?i)\b(?:doctor(?:ado|ate)?|ph\.?\s?d|dr\.|tesis|thesis|dissertation|posdoc|postdoc|"
+    r"maestr[ií]a|m\.?\s?sc|master|licenciatura|bachelor|ingenier[oa]|grado)\b"
+)
+EDUCATION_HEADING_RE = re.compile(
+    r"(?i)^\W*(?:formaci[oó]n(?: acad[eé]mica)?|educaci[oó]n|estudios|education|academic background|"
+    r"t[ií]tulos|grados acad[eé]micos|degrees)\W*$"
+)
+AREA_LINE_RE = re.compile(
+    r"(?i)\b(?:l[ií]neas? de investigaci[oó]n|research interests?|[aá]reas? de (?:inter[eé]s|especializaci[oó]n)|"
+    r"especialidad|keywords|palabras clave|nacionalidad|nationality|residencia|pa[ií]s)\b"
+)
+BOILERPLATE_LINE_RE = re.compile(
+    r"(?i)^\W*(?:p[aá]gina|page)?\s*\d+(?:\s*(?:de|of|/)\s*\d+)?\W*$|\.{5,}\s*\d+\s*$|^\W*$"
+)
+
+def score_cv_line(line, position, in_education):
+    """Puntuación de una línea: contacto, grados y educación primero; las primeras líneas valen más"""
+    score = 0
+    if position < CV_HEADER_LINES:
+        score += 3
+    if CONTACT_LINE_RE.search(line):
+        score += 4
+    if DEGREE_LINE_RE.search(line):
+        score += 3
+    if in_education:
+        score += 2
+    if AREA_LINE_RE.search(line):
+        score += 2
+    # A igualdad de señales, se prefieren las líneas más cercanas al principio
+    return score - position / 10000
+
+def condense_cv_text(cv_text, char_budget=CV_PROMPT_CHAR_BUDGET, token_budget=None, model=None):
     """
-    Determina el área de conocimiento del candidato basado en el contenido del CV,
-    el subject y la universidad de doctorado.
+    Devuelve un extracto del CV de como máximo char_budget caracteres (o token_budget tokens del
+    modelo, si se indica). Si el CV no cabe, se eliminan las líneas repetidas (cabeceras y pies
+    de página), los números de página y las entradas de índice, y se conservan las líneas mejor
+    puntuadas en su orden original.
+    """
+    if token_budget is not None:
+        budget = token_budget
+        measure = lambda text: count_tokens(text, model)
+    else:
+        budget = char_budget
+        measure = len
+    if measure(cv_text) <= budget:
+        return cv_text
     
-    Las áreas posibles son:
-    - Artes y Humanidades
-    - Ingeniería y Tecnología
-    - Medicina y Ciencias de la Vida
-    - Ciencias Naturales
+    lines = []
+    seen = set()
+    in_education = False
+    education_lines_left = 0
+    for raw_line in cv_text.splitlines():
+        line = raw_line.strip()
+        if BOILERPLATE_LINE_RE.search(line):
+            continue
+        key = line.lower()
+        if key in seen:
+            continue
+        seen.add(key)
+        if EDUCATION_HEADING_RE.search(line):
+            in_education = True
+            education_lines_left = CV_EDUCATION_SECTION_LINES
+        elif education_lines_left:
+            education_lines_left -= 1
+            in_education = education_lines_left > 0
+        lines.append([line, score_cv_line(line, len(lines), in_education)])
+    
+    # El nombre y la afiliación suelen estar junto al bloque de contacto
+    contact_positions = [i for i, (line, _) in enumerate(lines) if CONTACT_LINE_RE.search(line)]
+    near_contact = {j for i in contact_positions for j in range(i - 2, i + 3) if 0 <= j < len(lines)}
+    for j in near_contact:
+        lines[j][1] += 2
+    
+    selected = set()
+    used = 0
+    for i in sorted(range(len(lines)), key=lambda i: -lines[i][1]):
+        size = measure(lines[i][0]) + 1
+        if used + size > budget:
+            continue
+        selected.add(i)
+        used += size
+    count_stat("cv_text_condensed")
+    return "\n".join(lines[i][0] for i in sorted(selected))
+
+# === Conteo de tokens y consumo por CV ===
+@functools.lru_cache(maxsize=None)
+def get_token_encoding(model):
+    """Codificación de tiktoken del modelo (None si tiktoken no está instalado)"""
+    tiktoken = optional_import("tiktoken")
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # Sin conexión tiktoken no puede descargar la codificación la primera vez
+        log(f"No se pudo cargar la codificación de tiktoken para {model}: {e}. Se estimarán los tokens")
+        return None
+
+def count_tokens(text, model):
+    """Tokens de un texto para el modelo; sin tiktoken se estima con 4 caracteres por token"""
+    encoding = get_token_encoding(model)
+    if encoding is None:
+        return math.ceil(len(text) / 4)
+    return len(encoding.encode(text, disallowed_special=()))
+
+def prompt_token_budget(model):
+    """Tokens de entrada permitidos por petición para el modelo"""
+    return MODEL_PROMPT_TOKEN_BUDGETS.get(model, DEFAULT_PROMPT_TOKEN_BUDGET)
+
+def fit_cv_text(prompt, cv_text, model):
+    """Extracto del CV que cabe en el presupuesto del modelo después del texto fijo del prompt"""
+    available = max(prompt_token_budget(model) - count_tokens(prompt, model), 0)
+    return condense_cv_text(cv_text, token_budget=available, model=model)
+
+def fit_lines(lines, model, token_budget):
+    """Primeras líneas de la lista que caben en token_budget tokens"""
+    fitted = []
+    used = 0
+    for line in lines:
+        used += count_tokens(line, model) + 1
+        if used > token_budget:
+            break
+        fitted.append(line)
+    return fitted
+
+# Consumo de tokens del CV que se está procesando (cada hilo o tarea tiene el suyo)
+_cv_token_usage = contextvars.ContextVar("cv_token_usage", default=None)
+
+def record_token_usage(model, usage):
+    """Suma los tokens de una respuesta al resumen de la ejecución y al CV en curso (los embeddings no tienen salida)"""
+    if usage is None:
+        return
+    prompt_tokens = usage.prompt_tokens or 0
+    completion_tokens = getattr(usage, "completion_tokens", None) or 0
+    with _run_stats_lock:
+        RUN_STATS[f"tokens_prompt_{model}"] += prompt_tokens
+        RUN_STATS[f"tokens_completion_{model}"] += completion_tokens
+        cv_usage = _cv_token_usage.get()
+        if cv_usage is not None:
+            cv_usage[(model, "prompt")] += prompt_tokens
+            cv_usage[(model, "completion")] += completion_tokens
+
+def token_cost(model, prompt_tokens, completion_tokens):
+    """
+    Coste estimado en USD según MODEL_PRICES_PER_MTOK (0 si el modelo no tiene precio). El consumo
+    de la Batch API (modelo con el sufijo BATCH_USAGE_SUFFIX) se cobra con BATCH_PRICE_FACTOR.
     """
+    factor = 1
+    if model.endswith(BATCH_USAGE_SUFFIX):
+        model, factor = model[:-len(BATCH_USAGE_SUFFIX)], BATCH_PRICE_FACTOR
+    prompt_price, completion_price = MODEL_PRICES_PER_MTOK.get(model, (0, 0))
+    return factor * (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+def usage_cost(usage):
+    """Coste de un contador {(modelo, "prompt"|"completion"): tokens}"""
+    return sum(
+        token_cost(model, tokens, 0) if kind == "prompt" else token_cost(model, 0, tokens)
+        for (model, kind), tokens in usage.items()
+    )
+
+@contextlib.contextmanager
+def cv_token_usage(filename):
+    """Acumula los tokens de las llamadas hechas mientras se procesa un CV y los muestra al terminar"""
+    usage = Counter()
+    token = _cv_token_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _cv_token_usage.reset(token)
+        if usage:
+            prompt_tokens = sum(n for (_, kind), n in usage.items() if kind == "prompt")
+            completion_tokens = sum(n for (_, kind), n in usage.items() if kind == "completion")
+            log(f"Tokens de {filename}: {prompt_tokens} de entrada, {completion_tokens} de salida "
+                f"(~{usage_cost(usage):.4f} USD)")
+
+# === Caché persistente de resultados de GPT (SQLite) ===
+_llm_cache_lock = threading.Lock()
+_llm_cache_conn = None
+
+def get_llm_cache_connection():
+    """Abre (una sola vez) la base SQLite de la caché y crea la tabla si no existe"""
+    global _llm_cache_conn
+    if _llm_cache_conn is None:
+        conn = sqlite3.connect(LLM_CACHE_PATH, check_same_thread=False)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, kind TEXT, model TEXT, value TEXT, size INTEGER, last_used REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache (last_used)")
+        conn.commit()
+        _llm_cache_conn = conn
+    return _llm_cache_conn
+
+def llm_cache_key(kind, model, cv_text, *extra):
+    """Clave de caché: hash del texto extraído, la versión del prompt, el modelo y parámetros extra"""
+    h = hashlib.sha256()
+    for part in (kind, PROMPT_VERSION, model, cv_text) + extra:
+        h.update(str(part).encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+def llm_cache_get(key):
+    """Devuelve el valor guardado para la clave o None si no existe (o la caché está desactivada)"""
+    if not LLM_CACHE_ENABLED:
+        return None
+    try:
+        with _llm_cache_lock:
+            conn = get_llm_cache_connection()
+            row = conn.execute("SELECT value FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+        return json.loads(row[0])
+    except Exception as e:
+        log(f"Error al leer la caché de GPT: {e}")
+        return None
+
+def llm_cache_set(key, kind, model, value):
+    """Guarda un resultado en la caché y expulsa las entradas menos usadas si se supera el tamaño máximo"""
+    if not LLM_CACHE_ENABLED:
+        return
+    try:
+        payload = json.dumps(value, ensure_ascii=False)
+        with _llm_cache_lock:
+            conn = get_llm_cache_connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, kind, model, value, size, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, kind, model, payload, len(payload.encode('utf-8')), time.time())
+            )
+            evict_llm_cache(conn)
+            conn.commit()
+    except Exception as e:
+        log(f"Error al escribir en la caché de GPT: {e}")
+
+def evict_llm_cache(conn):
+    """Elimina las entradas usadas hace más tiempo hasta dejar la caché por debajo del 90% del máximo"""
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+    if total <= LLM_CACHE_MAX_BYTES:
+        return
+    target = LLM_CACHE_MAX_BYTES * 0.9
+    removed = 0
+    for key, size in conn.execute("SELECT key, size FROM llm_cache ORDER BY last_used").fetchall():
+        if total <= target:
+            break
+        conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+        total -= size
+        removed += 1
+    log(f"Caché de GPT: {removed} entradas expulsadas por tamaño")
+
+def clear_llm_cache():
+    """Vacía la caché de resultados de GPT y la de resoluciones QS"""
+    with _llm_cache_lock:
+        conn = get_llm_cache_connection()
+        conn.execute("DELETE FROM llm_cache")
+        conn.execute("DROP TABLE IF EXISTS qs_resolutions")
+        conn.commit()
+        _qs_cache_purged.clear()
+        conn.execute("VACUUM")
+    log(f"Caché de GPT vaciada ({LLM_CACHE_PATH})")
+
+# === Caché persistente de resoluciones universidad -> QS ===
+# Listas QS recordadas en memoria (las apps de Streamlit vuelven a leer la pestaña en cada recarga)
+QS_LIST_CACHE_SIZE = 4
+_qs_fingerprints = OrderedDict()
+_qs_fingerprints_lock = threading.Lock()
+_qs_cache_purged = set()
+
+def qs_list_fingerprint(qs_list):
+    """Hash del contenido de la pestaña QS; cambia cuando se modifica el ranking"""
+    if isinstance(qs_list, QSIndex):
+        return qs_list.fingerprint
+    with _qs_fingerprints_lock:
+        cached = _qs_fingerprints.get(id(qs_list))
+        if cached is not None and cached[0] is qs_list:
+            _qs_fingerprints.move_to_end(id(qs_list))
+            return cached[1]
+    fingerprint = hashlib.sha256(json.dumps(qs_list, ensure_ascii=False).encode('utf-8')).hexdigest()
+    # Se guarda la lista junto al hash para que su id no se reutilice mientras siga en memoria;
+    # solo se recuerdan las QS_LIST_CACHE_SIZE listas usadas más recientemente
+    with _qs_fingerprints_lock:
+        _qs_fingerprints[id(qs_list)] = (qs_list, fingerprint)
+        _qs_fingerprints.move_to_end(id(qs_list))
+        while len(_qs_fingerprints) > QS_LIST_CACHE_SIZE:
+            _qs_fingerprints.popitem(last=False)
+    return fingerprint
+
+def qs_cache_name(univ_name_cv):
+    """Nombre normalizado que se usa como clave en la caché de resoluciones QS"""
+    return " ".join(normalize_str(univ_name_cv).split())
+
+def qs_cache_version(qs_list):
+    """
+    Versión de las resoluciones QS guardadas: contenido de la pestaña QS, PROMPT_VERSION y modelos
+    que las resuelven (se guarda en la columna qs_fingerprint)
+    """
+    parts = (qs_list_fingerprint(qs_list), PROMPT_VERSION, QS_MODEL, QS_CHUNK_MODEL, QS_EMBEDDING_MODEL)
+    return hashlib.sha256("\x00".join(parts).encode('utf-8')).hexdigest()
+
+def get_qs_cache_connection(fingerprint):
+    """Conexión a la caché con la tabla de resoluciones QS, sin entradas de otras versiones (ver qs_cache_version)"""
+    conn = get_llm_cache_connection()
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS qs_resolutions ("
+        "name_norm TEXT, qs_fingerprint TEXT, univ TEXT, rank TEXT, "
+        "PRIMARY KEY (name_norm, qs_fingerprint))"
+    )
+    if fingerprint not in _qs_cache_purged:
+        # La pestaña QS, los prompts o los modelos cambiaron: las resoluciones anteriores ya no son válidas
+        conn.execute("DELETE FROM qs_resolutions WHERE qs_fingerprint != ?", (fingerprint,))
+        conn.commit()
+        _qs_cache_purged.add(fingerprint)
+    return conn
+
+def qs_cache_get(univ_name_cv, qs_list):
+    """Devuelve la resolución guardada (positiva o negativa) o None si no está en la caché"""
+    if not LLM_CACHE_ENABLED:
+        return None
+    try:
+        fingerprint = qs_cache_version(qs_list)
+        with _llm_cache_lock:
+            row = get_qs_cache_connection(fingerprint).execute(
+                "SELECT univ, rank FROM qs_resolutions WHERE name_norm = ? AND qs_fingerprint = ?",
+                (qs_cache_name(univ_name_cv), fingerprint)
+            ).fetchone()
+    except Exception as e:
+        log(f"Error al leer la caché QS: {e}")
+        return None
+    if row is None:
+        count_stat("qs_cache_misses")
+        return None
+    count_stat("qs_cache_hits")
+    return {"Universidad doctorado": row[0], "QS Rank": row[1]}
+
+def qs_cache_set(univ_name_cv, qs_list, result, complete=True):
+    """
+    Guarda una resolución definitiva: si falló alguna llamada a GPT de las que dependía (complete
+    False), ni un "No encontrado" ni la mejor respuesta dudosa de los bloques se guardan
+    """
+    if not LLM_CACHE_ENABLED or not complete:
+        return
+    univ = result.get("Universidad doctorado", "No encontrado")
+    rank = result.get("QS Rank", "No encontrado")
+    try:
+        fingerprint = qs_cache_version(qs_list)
+        with _llm_cache_lock:
+            conn = get_qs_cache_connection(fingerprint)
+            conn.execute(
+                "INSERT OR REPLACE INTO qs_resolutions (name_norm, qs_fingerprint, univ, rank) VALUES (?, ?, ?, ?)",
+                (qs_cache_name(univ_name_cv), fingerprint, str(univ), str(rank))
+            )
+            conn.commit()
+    except Exception as e:
+        log(f"Error al escribir en la caché QS: {e}")
+
+# === Motor local de coincidencia de universidades (sin GPT) ===
+# Palabras frecuentes en nombres de universidades traducidas a una forma canónica en inglés
+UNIV_TOKEN_TRANSLATIONS = {
+    "universidad": "university", "universidade": "university", "universitat": "university",
+    "universita": "university", "universite": "university", "universitaet": "university",
+    "univ": "university", "uni": "university",
+    "instituto": "institute", "institut": "institute", "istituto": "institute",
+    "tecnologico": "technology", "tecnologica": "technology", "tecnologia": "technology",
+    "technological": "technology", "tecnologicas": "technology", "technologique": "technology",
+    "tecnica": "technical", "tecnico": "technical", "technische": "technical", "technique": "technical",
+    "politecnico": "polytechnic", "politecnica": "polytechnic", "polytechnique": "polytechnic",
+    "nacional": "national", "nationale": "national", "nazionale": "national",
+    "autonoma": "autonomous", "autonomo": "autonomous",
+    "catolica": "catholic", "catolico": "catholic", "catholique": "catholic", "cattolica": "catholic",
+    "pontificia": "pontifical", "pontificio": "pontifical",
+    "estatal": "state", "estadual": "state", "estado": "state",
+    "ciencia": "science", "ciencias": "science", "sciences": "science", "scienze": "science",
+    "escuela": "school", "escola": "school", "ecole": "school", "scuola": "school",
+    "colegio": "college",
+    "ingenieria": "engineering", "engenharia": "engineering",
+    "medicina": "medicine", "medical": "medicine",
+    "agraria": "agricultural", "agricola": "agricultural", "agronomia": "agricultural",
+    "libre": "free", "livre": "free", "libera": "free",
+    "abierta": "open", "aberta": "open",
+    "norte": "north", "nord": "north", "sur": "south", "sul": "south", "sud": "south",
+    "oriente": "east", "occidente": "west", "oeste": "west",
+    "estudios": "studies", "estudos": "studies", "studi": "studies",
+    "superiores": "higher", "superior": "higher", "avanzados": "advanced",
+    "investigacion": "research", "pesquisa": "research", "ricerca": "research",
+    # Ciudades y países con nombre distinto según el idioma
+    "milan": "milano", "roma": "rome", "munich": "munchen", "muenchen": "munchen",
+    "londres": "london", "lisboa": "lisbon", "viena": "vienna", "wien": "vienna",
+    "florencia": "florence", "firenze": "florence", "turin": "torino", "napoles": "naples", "napoli": "naples",
+    "colonia": "cologne", "koln": "cologne", "ginebra": "geneva", "geneve": "geneva",
+    "lovaina": "leuven", "louvain": "leuven", "pekin": "beijing", "moscu": "moscow",
+    "varsovia": "warsaw", "praga": "prague", "estocolmo": "stockholm", "copenhague": "copenhagen",
+    "atenas": "athens", "bruselas": "brussels", "edimburgo": "edinburgh",
+    "brasil": "brazil", "espana": "spain",
+}
+
+# Palabras vacías en español, inglés, portugués, catalán, italiano y francés
+UNIV_STOPWORDS = {
+    "de", "del", "la", "las", "los", "el", "y", "e", "en", "a", "al",
+    "of", "the", "and", "at", "in", "for",
+    "da", "do", "dos", "das", "di", "della", "degli", "dei", "per",
+    "du", "des", "le", "les", "et", "i",
+}
+
+def univ_raw_tokens(name):
+    """Palabras del nombre normalizado (sin acentos, minúsculas, sin signos de puntuación)"""
+    return re.sub(r"[^a-z0-9]+", " ", normalize_str(name)).split()
+
+def univ_tokens(name):
+    """Conjunto canónico de palabras del nombre: traducidas y sin palabras vacías"""
+    return frozenset(
+        UNIV_TOKEN_TRANSLATIONS.get(token, token)
+        for token in univ_raw_tokens(name)
+        if token not in UNIV_STOPWORDS
+    )
+
+def univ_acronyms(name):
+    """
+    Acrónimos de un nombre QS: los que aparecen entre paréntesis, p. ej. "(UNAM)", y el
+    generado con las iniciales de las palabras significativas ("instituto tecnologico y de
+    estudios superiores de monterrey" -> "itesm").
+    """
+    acronyms = {normalize_str(a) for a in re.findall(r"\(([A-Za-z][A-Za-z&\-\.]{1,11})\)", name)}
+    acronyms = {re.sub(r"[^a-z]", "", a) for a in acronyms}
+    without_parens = re.sub(r"\([^)]*\)", " ", name)
+    initials = "".join(token[0] for token in univ_raw_tokens(without_parens)
+                       if token not in UNIV_STOPWORDS and token.isalpha())
+    if len(initials) >= 3:
+        acronyms.add(initials)
+    return {a for a in acronyms if len(a) >= 2}
+
+# === Tabla de alias de universidades ===
+_univ_aliases = None  # {"universidades": {canónico: [alias]}, "reverse": {alias: canónico}, "learned": {alias: oficial}}
+_univ_aliases_lock = threading.Lock()
+
+def build_alias_reverse_map(groups):
+    """Alias normalizado (y el propio nombre canónico) -> nombre canónico"""
+    reverse = {}
+    for canonical, aliases in groups.items():
+        reverse.setdefault(canonical, canonical)
+        for alias in aliases:
+            reverse.setdefault(alias, canonical)
+    return reverse
+
+def read_aliases_file(path):
+    """Contenido de un archivo de alias versionado; {} si no existe, está dañado o es de otra versión"""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            stored = json.load(f)
+    except Exception as e:
+        log(f"No se pudo leer la tabla de alias {path}: {e}")
+        return {}
+    if stored.get("version") != ALIASES_FILE_VERSION:
+        log(f"Versión de {path} no soportada: {stored.get('version')}")
+        return {}
+    return stored
+
+def add_alias_to_groups(groups, reverse, alias, official):
+    """
+    Añade alias al grupo de official (o al grupo al que ya pertenece official). Devuelve el
+    nombre canónico del grupo, o None si el alias ya se conocía.
+    """
+    if alias in reverse:
+        return None
+    canonical = reverse.get(official, official)
+    reverse.setdefault(canonical, canonical)
+    groups.setdefault(canonical, []).append(alias)
+    reverse[alias] = canonical
+    return canonical
+
+def load_univ_aliases():
+    """
+    Carga una sola vez la tabla de alias curada (ALIASES_PATH) y le añade los alias aprendidos
+    (LEARNED_ALIASES_PATH); construye el mapa inverso
+    """
+    global _univ_aliases
+    with _univ_aliases_lock:
+        if _univ_aliases is None:
+            groups = {}
+            for canonical, aliases in read_aliases_file(ALIASES_PATH).get("universidades", {}).items():
+                key = qs_cache_name(canonical)
+                groups.setdefault(key, [])
+                for alias in aliases:
+                    alias = qs_cache_name(alias)
+                    if alias and alias != key and alias not in groups[key]:
+                        groups[key].append(alias)
+            reverse = build_alias_reverse_map(groups)
+            # Los alias curados tienen preferencia sobre los aprendidos
+            learned = read_aliases_file(LEARNED_ALIASES_PATH).get("alias", {})
+            for alias, official in learned.items():
+                add_alias_to_groups(groups, reverse, alias, official)
+            _univ_aliases = {"universidades": groups, "reverse": reverse, "learned": learned}
+        return _univ_aliases
+
+def save_learned_aliases(learned):
+    """Escribe los alias aprendidos ({alias: nombre oficial}) de forma atómica (archivo temporal + reemplazo)"""
+    data = {"version": ALIASES_FILE_VERSION, "alias": learned}
+    directory = os.path.dirname(os.path.abspath(LEARNED_ALIASES_PATH))
+    fd, tmp_path = tempfile.mkstemp(prefix=".aliases_", suffix=".json", dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        os.replace(tmp_path, LEARNED_ALIASES_PATH)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def get_aliases_for_univ(univ):
+    """Nombre canónico seguido de sus alias si univ es un alias conocido; si no, [univ normalizado]"""
+    aliases = load_univ_aliases()
+    n = qs_cache_name(univ)
+    canonical = aliases["reverse"].get(n)
+    if canonical is None:
+        return [n]
+    return [canonical] + aliases["universidades"][canonical]
+
+def register_confirmed_alias(univ_name_cv, official_name):
+    """
+    Añade a los alias aprendidos (LEARNED_ALIASES_PATH, no a la tabla curada) un nombre del CV
+    que GPT resolvió a un nombre oficial QS, para que la próxima vez se resuelva sin GPT.
+    Devuelve True si la tabla cambió.
+    """
+    if not ALIASES_LEARNING_ENABLED:
+        return False
+    alias = qs_cache_name(univ_name_cv)
+    official = qs_cache_name(official_name)
+    if not alias or not official or alias == official:
+        return False
+    
+    aliases = load_univ_aliases()
+    with _univ_aliases_lock:
+        # Si el nombre oficial ya pertenece a un grupo, el alias se añade a ese grupo
+        canonical = add_alias_to_groups(aliases["universidades"], aliases["reverse"], alias, official)
+        if canonical is None:
+            return False
+        aliases["learned"][alias] = official
+        try:
+            save_learned_aliases(aliases["learned"])
+        except Exception as e:
+            log(f"No se pudo guardar la tabla de alias aprendidos {LEARNED_ALIASES_PATH}: {e}")
+            return False
+    
+    count_stat("aliases_learned")
+    log(f"Alias aprendido: '{alias}' -> '{canonical}'")
+    return True
+
+def remember_qs_match(univ_name_cv, qs_list, result):
+    """Registra el alias solo si GPT devolvió un nombre que existe literalmente en la lista QS"""
+    name = str(result.get("Universidad doctorado", ""))
+    if get_qs_index(qs_list).lookup(normalize_str(name)) is not None:
+        register_confirmed_alias(univ_name_cv, name)
+
+# === Índice de la lista QS ===
+def char_ngrams(name, n=3):
+    """Trigramas de caracteres de un nombre normalizado (con espacios de relleno en los extremos)"""
+    padded = f" {name} "
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+class QSIndex:
+    """
+    Índice de la lista QS construido una sola vez por ejecución: diccionario de nombres
+    normalizados para búsqueda exacta/alias en O(1) e índice invertido de trigramas para
+    recuperar candidatos difusos sin recorrer toda la lista con difflib.
+    Se comporta como la lista original (len, índices, slices) para el resto del código.
+    """
+    
+    def __init__(self, qs_list):
+        self.qs_list = qs_list
+        self.fingerprint = qs_list_fingerprint(qs_list)
+        self.rows = [row for row in qs_list if len(row) >= 2]
+        self.names_norm = [normalize_str(row[1]) for row in self.rows]
+        
+        # Nombre normalizado -> posición de la primera fila con ese nombre
+        self.by_name = {}
+        for i, name in enumerate(self.names_norm):
+            self.by_name.setdefault(name, i)
+        
+        # Trigrama -> posiciones de los nombres que lo contienen
+        self.ngram_index = {}
+        for i, name in enumerate(self.names_norm):
+            for gram in char_ngrams(name):
+                self.ngram_index.setdefault(gram, []).append(i)
+        # Los trigramas presentes en muchos nombres ("uni", "ver", ...) no discriminan
+        self.max_postings = max(50, len(self.names_norm) // 5)
+        
+        # Motor local: palabras canónicas de cada nombre, índice invertido por palabra y pesos IDF
+        self.token_sets = [univ_tokens(re.sub(r"\([^)]*\)", " ", row[1])) for row in self.rows]
+        self.token_index = {}
+        for i, tokens in enumerate(self.token_sets):
+            for token in tokens:
+                self.token_index.setdefault(token, []).append(i)
+        total_names = len(self.rows) + 1
+        self.token_weights = {token: math.log(total_names / len(postings)) for token, postings in self.token_index.items()}
+        self.unknown_token_weight = math.log(total_names)
+        
+        # Acrónimo -> posición, solo para los acrónimos que identifican una única universidad
+        acronym_rows = {}
+        for i, row in enumerate(self.rows):
+            for acronym in univ_acronyms(row[1]):
+                acronym_rows.setdefault(acronym, set()).add(i)
+        self.acronyms = {acronym: min(rows) for acronym, rows in acronym_rows.items() if len(rows) == 1}
+        
+        # Embeddings de los nombres: se cargan o calculan la primera vez que hacen falta. Las filas
+        # sin nombre (get_all_values rellena la pestaña con filas vacías) no tienen embedding;
+        # embedding_rows da la posición en self.rows de cada fila de la matriz
+        self.embedding_rows = [i for i, row in enumerate(self.rows) if row[1].strip()]
+        self.embeddings = None
+        self.embeddings_failed = False
+        self.embeddings_lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self.qs_list)
+    
+    def __iter__(self):
+        return iter(self.qs_list)
+    
+    def __getitem__(self, item):
+        return self.qs_list[item]
+    
+    def result(self, i):
+        """Resultado en el formato de match_university_qs para la fila i"""
+        row = self.rows[i]
+        return {"Universidad doctorado": row[1], "QS Rank": row[0]}
+    
+    def lookup(self, name_norm):
+        """Búsqueda exacta de un nombre normalizado; devuelve la posición o None"""
+        return self.by_name.get(name_norm)
+    
+    def fuzzy_candidates(self, name_norm, limit=QS_FUZZY_CANDIDATES, cutoff=0.0):
+        """Nombres normalizados que comparten más trigramas con name_norm"""
+        grams = char_ngrams(name_norm)
+        counts = Counter()
+        for gram in grams:
+            postings = self.ngram_index.get(gram)
+            if postings and len(postings) <= self.max_postings:
+                counts.update(postings)
+        if not counts:
+            # Solo comparte trigramas muy frecuentes: usarlos igualmente
+            for gram in grams:
+                counts.update(self.ngram_index.get(gram, ()))
+        
+        # Con ratio >= cutoff, la longitud del candidato está acotada por la del nombre buscado
+        length = len(name_norm)
+        min_len = length * cutoff / (2 - cutoff) if cutoff else 0
+        max_len = length * (2 - cutoff) / cutoff if cutoff else float("inf")
+        candidates = []
+        for i, _ in counts.most_common():
+            if min_len <= len(self.names_norm[i]) <= max_len:
+                candidates.append(self.names_norm[i])
+                if len(candidates) >= limit:
+                    break
+        return candidates
+    
+    def fuzzy_lookup(self, name_norm, cutoff=0.85):
+        """Equivalente a get_close_matches(n=1) sobre los candidatos del índice de trigramas"""
+        close_matches = get_close_matches(name_norm, self.fuzzy_candidates(name_norm, cutoff=cutoff), n=1, cutoff=cutoff)
+        if close_matches:
+            return self.by_name[close_matches[0]]
+        return None
+    
+    def token_match(self, name, min_score=LOCAL_MATCH_MIN_SCORE, min_margin=LOCAL_MATCH_MIN_MARGIN):
+        """
+        Coincidencia por acrónimo o por similitud ponderada (IDF) entre conjuntos de palabras
+        canónicas. Devuelve la posición solo si el mejor candidato supera min_score y aventaja
+        al segundo en min_margin; los nombres ambiguos devuelven None y pasan a GPT.
+        """
+        raw_tokens = univ_raw_tokens(name)
+        if len(raw_tokens) == 1 and raw_tokens[0] in self.acronyms:
+            return self.acronyms[raw_tokens[0]]
+        
+        tokens = univ_tokens(name)
+        if not tokens:
+            return None
+        
+        def weight(token):
+            return self.token_weights.get(token, self.unknown_token_weight)
+        
+        # Candidatos: nombres que comparten alguna palabra discriminante (no "university", "national"...)
+        candidates = set()
+        for token in tokens:
+            postings = self.token_index.get(token)
+            if postings and len(postings) <= self.max_postings:
+                candidates.update(postings)
+        if not candidates:
+            return None
+        
+        query_weight = sum(weight(token) for token in tokens)
+        scored = []
+        for i in candidates:
+            candidate_tokens = self.token_sets[i]
+            shared = sum(weight(token) for token in tokens & candidate_tokens)
+            total = query_weight + sum(weight(token) for token in candidate_tokens)
+            scored.append((2 * shared / total if total else 0, i))
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        best_score, best = scored[0]
+        second_score = scored[1][0] if len(scored) > 1 else 0
+        if best_score >= min_score and best_score - second_score >= min_margin:
+            return best
+        return None
+    
+    def ensure_embeddings(self):
+        """Carga o calcula (una sola vez) la matriz de embeddings; None si no está disponible"""
+        with self.embeddings_lock:
+            if self.embeddings is None and not self.embeddings_failed:
+                try:
+                    self.embeddings = load_or_build_qs_embeddings([self.rows[i][1] for i in self.embedding_rows])
+                except Exception as e:
+                    log(f"No se pudieron obtener los embeddings QS, se usarán las primeras 200 universidades: {e}")
+                    self.embeddings_failed = True
+            return self.embeddings
+    
+    def nearest_rows(self, query_vector, k):
+        """Las k filas cuyo nombre es más parecido (similitud coseno) al vector de consulta"""
+        scores = self.embeddings @ query_vector
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [self.rows[self.embedding_rows[i]] for i in top]
+
+# Índices por huella del contenido: las listas iguales (p. ej. de dos recargas de una app) comparten índice
+_qs_indexes = OrderedDict()
+_qs_indexes_lock = threading.Lock()
+
+def get_qs_index(qs_list):
+    """Devuelve el QSIndex de la lista (construyéndolo solo la primera vez que se ve su contenido)"""
+    if isinstance(qs_list, QSIndex):
+        return qs_list
+    fingerprint = qs_list_fingerprint(qs_list)
+    with _qs_indexes_lock:
+        cached = _qs_indexes.get(fingerprint)
+        if cached is None:
+            cached = QSIndex(qs_list)
+            _qs_indexes[fingerprint] = cached
+        _qs_indexes.move_to_end(fingerprint)
+        while len(_qs_indexes) > QS_LIST_CACHE_SIZE:
+            _qs_indexes.popitem(last=False)
+        return cached
+
+# === Embeddings de los nombres QS para recuperar candidatos ===
+def normalize_vectors(vectors):
+    """Normaliza cada fila a norma 1 para que el producto escalar sea la similitud coseno"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+def embed_texts(texts):
+    """
+    Calcula los embeddings de una lista de textos (en lotes de 500 por petición), por el
+    planificador compartido y con sus reintentos, como las peticiones de chat
+    """
+    vectors = []
+    for batch in chunk_list(list(texts), 500):
+        response = scheduled_openai_call({"model": QS_EMBEDDING_MODEL, "input": batch},
+                                         lambda request: get_openai_client().embeddings.create(**request))
+        record_token_usage(QS_EMBEDDING_MODEL, response.usage)
+        vectors.extend(item.embedding for item in response.data)
+    return normalize_vectors(np.array(vectors, dtype=np.float32))
+
+async def embed_texts_async(texts):
+    """Versión asíncrona de embed_texts sobre el cliente compartido"""
+    vectors = []
+    for batch in chunk_list(list(texts), 500):
+        response = await scheduled_openai_call_async({"model": QS_EMBEDDING_MODEL, "input": batch},
+                                                     lambda request: get_async_openai_client().embeddings.create(**request))
+        record_token_usage(QS_EMBEDDING_MODEL, response.usage)
+        vectors.extend(item.embedding for item in response.data)
+    return normalize_vectors(np.array(vectors, dtype=np.float32))
+
+def load_or_build_qs_embeddings(names):
+    """
+    Devuelve la matriz de embeddings de los nombres QS. Se guarda en QS_EMBEDDINGS_PATH junto
+    con un hash de los nombres y del modelo, y solo se recalcula cuando cambian.
+    """
+    fingerprint = hashlib.sha256(json.dumps([QS_EMBEDDING_MODEL, names], ensure_ascii=False).encode('utf-8')).hexdigest()
+    if os.path.exists(QS_EMBEDDINGS_PATH):
+        try:
+            with np.load(QS_EMBEDDINGS_PATH) as stored:
+                if str(stored["fingerprint"]) == fingerprint:
+                    return stored["vectors"]
+        except Exception as e:
+            log(f"No se pudieron leer los embeddings QS guardados: {e}")
+    
+    log(f"Calculando embeddings de {len(names)} universidades QS...")
+    vectors = embed_texts(names)
+    np.savez(QS_EMBEDDINGS_PATH, vectors=vectors, fingerprint=np.array(fingerprint))
+    log(f"Embeddings QS guardados en {QS_EMBEDDINGS_PATH}")
+    return vectors
+
+def qs_prompt_rows(univ_name_cv, qs_list):
+    """
+    Filas QS que se envían a GPT-4o: los QS_PROMPT_CANDIDATES nombres más cercanos por embeddings
+    (de todo el ranking), o las primeras 200 universidades si no hay embeddings disponibles.
+    """
+    return qs_prompt_rows_many([univ_name_cv], qs_list)[0]
+
+def qs_prompt_rows_many(univ_names, qs_list):
+    """Filas de qs_prompt_rows para varias universidades, con una sola petición de embeddings"""
+    qs_index = get_qs_index(qs_list)
+    if univ_names and qs_index.ensure_embeddings() is not None:
+        try:
+            return [qs_index.nearest_rows(vector, QS_PROMPT_CANDIDATES) for vector in embed_texts(univ_names)]
+        except Exception as e:
+            log(f"Error al calcular los embeddings de {len(univ_names)} universidades: {e}")
+    return [qs_index.qs_list[:200] for _ in univ_names]
+
+async def qs_prompt_rows_async(univ_name_cv, qs_list):
+    """Versión asíncrona de qs_prompt_rows"""
+    qs_index = get_qs_index(qs_list)
+    if await asyncio.to_thread(qs_index.ensure_embeddings) is not None:
+        try:
+            return qs_index.nearest_rows((await embed_texts_async([univ_name_cv]))[0], QS_PROMPT_CANDIDATES)
+        except Exception as e:
+            log(f"Error al calcular el embedding de '{univ_name_cv}': {e}")
+    return qs_index.qs_list[:200]
+
+# === Planificador de peticiones a OpenAI: límites por modelo, reintentos y prioridades ===
+# Las prioridades y los límites son de cada proceso: las apps de Streamlit y el procesamiento por
+# lotes desde la línea de comandos corren en procesos distintos, cada uno con su planificador, y
+# compiten sin coordinarse por el límite de la organización (MODEL_RATE_LIMITS debe repartirse
+# entre los procesos que corran a la vez).
+PRIORITY_INTERACTIVE = 0  # Peticiones directas (p. ej. de los hilos de una app de Streamlit)
+PRIORITY_BACKFILL = 10  # Procesamiento por lotes de la carpeta de Drive
+
+# Prioridad de las peticiones del hilo o tarea actual (menor = antes)
+_request_priority = contextvars.ContextVar("request_priority", default=PRIORITY_INTERACTIVE)
+
+class TokenBucket:
+    """Cubo de tokens que se rellena de forma continua hasta su capacidad por minuto"""
+    
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.available = per_minute
+        self.updated = time.monotonic()
+    
+    def refill(self, now):
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+    
+    def wait_time(self, amount):
+        """Segundos hasta que haya amount disponibles (una petición mayor que la capacidad espera al cubo lleno)"""
+        missing = min(amount, self.capacity) - self.available
+        return max(missing, 0) * 60 / self.capacity
+
+class RequestScheduler:
+    """
+    Planificador compartido de las llamadas a OpenAI: por cada modelo limita las peticiones y los
+    tokens por minuto (MODEL_RATE_LIMITS), detiene el modelo el tiempo que indique un 429 y atiende
+    a los que esperan por orden de prioridad (y de llegada a igual prioridad). Solo coordina los
+    hilos y event loops del proceso actual.
+    """
+    
+    def __init__(self, rate_limits):
+        self.rate_limits = rate_limits
+        self.condition = threading.Condition()
+        self.buckets = {}
+        self.paused_until = {}
+        self.waiting = []
+        self.sequence = 0
+        # (event loop, future) de las esperas asíncronas; se resuelven en cada notify()
+        self.async_waiters = set()
+    
+    def get_buckets(self, model):
+        if model not in self.buckets:
+            rpm, tpm = self.rate_limits.get(model, DEFAULT_RATE_LIMITS)
+            self.buckets[model] = (TokenBucket(rpm), TokenBucket(tpm))
+        return self.buckets[model]
+    
+    def enqueue(self, model, priority):
+        """Añade una petición a la cola de espera (con el lock tomado)"""
+        self.sequence += 1
+        entry = (priority, self.sequence, model)
+        heapq.heappush(self.waiting, entry)
+        return entry
+    
+    def dequeue(self, entry):
+        """Saca la petición de la cola y avisa al resto (con el lock tomado)"""
+        self.waiting.remove(entry)
+        heapq.heapify(self.waiting)
+        self.notify()
+    
+    def try_acquire(self, entry, tokens):
+        """
+        Con el lock tomado: consume del cubo y devuelve 0 si la petición puede enviarse; si no,
+        los segundos que debe esperar (None = hasta que cambie el estado del planificador)
+        """
+        model = entry[2]
+        now = time.monotonic()
+        requests_bucket, tokens_bucket = self.get_buckets(model)
+        requests_bucket.refill(now)
+        tokens_bucket.refill(now)
+        # Solo la primera petición en espera de este modelo puede consumir del cubo
+        first = min(e for e in self.waiting if e[2] == model)
+        if first is not entry:
+            return None
+        wait = max(
+            self.paused_until.get(model, 0) - now,
+            requests_bucket.wait_time(1),
+            tokens_bucket.wait_time(tokens),
+        )
+        if wait <= 0:
+            requests_bucket.available -= 1
+            tokens_bucket.available -= min(tokens, tokens_bucket.capacity)
+            return 0
+        return wait
+    
+    def notify(self):
+        """Despierta a los que esperan, en hilos y en event loops (con el lock tomado)"""
+        self.condition.notify_all()
+        for loop, future in self.async_waiters:
+            loop.call_soon_threadsafe(lambda f=future: f.done() or f.set_result(None))
+        self.async_waiters.clear()
+    
+    def acquire(self, model, tokens, priority=PRIORITY_INTERACTIVE):
+        """Bloquea hasta que la petición puede enviarse sin superar los límites del modelo"""
+        with self.condition:
+            entry = self.enqueue(model, priority)
+            try:
+                while True:
+                    wait = self.try_acquire(entry, tokens)
+                    if wait == 0:
+                        return
+                    self.condition.wait(timeout=wait)
+            finally:
+                self.dequeue(entry)
+    
+    async def acquire_async(self, model, tokens, priority=PRIORITY_INTERACTIVE):
+        """
+        Versión asíncrona de acquire: espera en el event loop a un future que se resuelve cuando
+        cambia el estado del planificador, sin ocupar un hilo del executor por cada espera
+        """
+        loop = asyncio.get_running_loop()
+        with self.condition:
+            entry = self.enqueue(model, priority)
+        try:
+            while True:
+                with self.condition:
+                    wait = self.try_acquire(entry, tokens)
+                    if wait == 0:
+                        return
+                    wakeup = loop.create_future()
+                    self.async_waiters.add((loop, wakeup))
+                try:
+                    await asyncio.wait_for(wakeup, timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    with self.condition:
+                        self.async_waiters.discard((loop, wakeup))
+        finally:
+            with self.condition:
+                self.dequeue(entry)
+    
+    def settle(self, model, reserved, used):
+        """Devuelve al cubo los tokens reservados que la respuesta no llegó a usar"""
+        if used is None or used >= reserved:
+            return
+        with self.condition:
+            tokens_bucket = self.get_buckets(model)[1]
+            tokens_bucket.available = min(tokens_bucket.capacity, tokens_bucket.available + reserved - used)
+            self.notify()
+    
+    def pause(self, model, seconds):
+        """Detiene todas las peticiones del modelo durante seconds segundos (tras un 429)"""
+        with self.condition:
+            until = time.monotonic() + seconds
+            self.paused_until[model] = max(self.paused_until.get(model, 0), until)
+            self.notify()
+
+_request_scheduler = None
+_request_scheduler_lock = threading.Lock()
+
+def get_request_scheduler():
+    """Devuelve el planificador compartido por todos los hilos y event loops del proceso"""
+    global _request_scheduler
+    with _request_scheduler_lock:
+        if _request_scheduler is None:
+            _request_scheduler = RequestScheduler(MODEL_RATE_LIMITS)
+        return _request_scheduler
+
+@contextlib.contextmanager
+def request_priority(priority):
+    """Asigna la prioridad de las peticiones a OpenAI hechas dentro del bloque"""
+    token = _request_priority.set(priority)
+    try:
+        yield
+    finally:
+        _request_priority.reset(token)
+
+def estimate_request_tokens(request):
+    """Tokens que la petición consume del límite por minuto: entrada (mensajes o textos de embeddings) más max_tokens de salida"""
+    if "messages" in request:
+        prompt = "".join(message["content"] for message in request["messages"])
+    else:
+        prompt = "".join(request["input"])
+    return count_tokens(prompt, request["model"]) + request.get("max_tokens", 0)
+
+def retry_delay(error, attempt):
+    """
+    Espera antes del siguiente intento: la cabecera retry-after si existe; si no, backoff exponencial
+    con jitter. Sirve para los errores de OpenAI (error.response) y de Drive (HttpError.resp).
+    """
+    response = getattr(error, "response", None)
+    if response is not None:
+        headers = response.headers
+    else:
+        # HttpError de googleapiclient: resp es un diccionario con las cabeceras en minúsculas
+        headers = getattr(error, "resp", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** attempt))
+
+RETRYABLE_OPENAI_ERRORS = (
+    openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError,
+)
+
+def handle_retryable_error(error, request, attempt):
+    """Registra el error y devuelve la espera antes de reintentar; relanza si no quedan reintentos"""
+    if attempt >= LLM_MAX_RETRIES:
+        raise error
+    delay = retry_delay(error, attempt)
+    if isinstance(error, openai.RateLimitError):
+        get_request_scheduler().pause(request["model"], delay)
+        count_stat("openai_rate_limited")
+    count_stat("openai_retries")
+    log(f"Error temporal de OpenAI ({type(error).__name__}), reintento {attempt + 1} en {delay:.1f}s")
+    return delay
+
+def parse_json_response(raw):
+    """Extrae el primer objeto JSON de la respuesta del modelo"""
+    return json.loads(raw[raw.find('{'):raw.rfind('}')+1])
+
+# Clientes síncronos compartidos por clave de API; sin reintentos propios (los gestiona el planificador)
+_openai_clients = {}
+_openai_clients_lock = threading.Lock()
+
+def get_openai_client():
+    """Devuelve el cliente OpenAI síncrono compartido (seguro entre hilos)"""
+    with _openai_clients_lock:
+        client = _openai_clients.get(openai.api_key)
+        if client is None:
+            client = openai.OpenAI(api_key=openai.api_key, max_retries=0)
+            _openai_clients[openai.api_key] = client
+        return client
+
+def scheduled_openai_call(request, send):
+    """
+    Ejecuta send(request) cuando el planificador compartido lo permite y reintenta los errores
+    temporales (429, timeouts, 5xx). Devuelve la respuesta de la API.
+    """
+    scheduler = get_request_scheduler()
+    reserved = estimate_request_tokens(request)
+    for attempt in itertools.count():
+        scheduler.acquire(request["model"], reserved, _request_priority.get())
+        try:
+            response = send(request)
+        except RETRYABLE_OPENAI_ERRORS as e:
+            time.sleep(handle_retryable_error(e, request, attempt))
+            continue
+        scheduler.settle(request["model"], reserved, getattr(response.usage, "total_tokens", None))
+        return response
+
+async def scheduled_openai_call_async(request, send):
+    """Versión asíncrona de scheduled_openai_call (send devuelve un awaitable)"""
+    scheduler = get_request_scheduler()
+    reserved = estimate_request_tokens(request)
+    for attempt in itertools.count():
+        await scheduler.acquire_async(request["model"], reserved, _request_priority.get())
+        try:
+            response = await send(request)
+        except RETRYABLE_OPENAI_ERRORS as e:
+            await asyncio.sleep(handle_retryable_error(e, request, attempt))
+            continue
+        scheduler.settle(request["model"], reserved, getattr(response.usage, "total_tokens", None))
+        return response
+
+def chat_completion(request):
+    """
+    Ejecuta una petición de chat con el cliente síncrono y devuelve el texto de la respuesta.
+    Pasa por el planificador compartido y reintenta los errores temporales (429, timeouts, 5xx).
+    """
+    response = scheduled_openai_call(request, lambda request: get_openai_client().chat.completions.create(**request))
+    record_token_usage(request["model"], response.usage)
+    return response.choices[0].message.content
+
+# Clientes asíncronos compartidos, uno por event loop (httpx no permite compartir conexiones entre loops)
+_async_openai_clients = weakref.WeakKeyDictionary()
+
+def get_async_openai_client():
+    """Devuelve el cliente AsyncOpenAI compartido del event loop actual, con su pool de conexiones"""
+    loop = asyncio.get_running_loop()
+    client = _async_openai_clients.get(loop)
+    if client is None:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=ASYNC_OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=ASYNC_OPENAI_MAX_CONNECTIONS
+            ),
+            timeout=httpx.Timeout(600.0, connect=5.0)
+        )
+        client = AsyncOpenAI(api_key=openai.api_key, http_client=http_client, max_retries=0)
+        _async_openai_clients[loop] = client
+    return client
+
+async def close_async_openai_client():
+    """Cierra el cliente AsyncOpenAI del event loop actual y su pool de conexiones"""
+    client = _async_openai_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
+
+async def chat_completion_async(request):
+    """Versión asíncrona de chat_completion sobre el cliente compartido del event loop"""
+    response = await scheduled_openai_call_async(
+        request, lambda request: get_async_openai_client().chat.completions.create(**request)
+    )
+    record_token_usage(request["model"], response.usage)
+    return response.choices[0].message.content
+
+def build_area_request(cv_text, subject="", university=""):
+    """Construye la petición para clasificar el área de conocimiento"""
     prompt = f"""
 Analiza este CV académico y determina a cuál de estas CUATRO áreas de conocimiento pertenece el candidato:
 1. Artes y Humanidades
@@ -271,55 +2009,85 @@ Razona paso a paso y luego responde ÚNICAMENTE con una de las cuatro áreas men
 
 CV:
 """
+    # Usar solo el extracto del CV que cabe en el presupuesto de tokens del modelo
+    return {
+        "model": AREA_MODEL,  # Usar GPT-4o para mejor razonamiento
+        "messages": [{"role": "user", "content": prompt + fit_cv_text(prompt, cv_text, AREA_MODEL)}],
+        "max_tokens": 200,
+        "temperature": 0
+    }
 
-    try:
-        # Usar solo los primeros 6000 caracteres del CV para el análisis
-        response = openai.chat.completions.create(
-            model="gpt-4o",  # Usar GPT-4o para mejor razonamiento
-            messages=[{"role": "user", "content": prompt + cv_text[:6000]}],
-            max_tokens=200,
-            temperature=0
-        )
-        area = response.choices[0].message.content.strip()
-        
-        # Normalizar la respuesta para asegurar que sea una de las cuatro áreas
-        area_normalizada = area.lower()
+def normalize_knowledge_area(area, subject=""):
+    """Normaliza la respuesta del modelo para asegurar que sea una de las cuatro áreas"""
+    area_normalizada = area.lower()
+    
+    if "arte" in area_normalizada or "human" in area_normalizada:
+        return "Artes y Humanidades"
+    elif "ingenier" in area_normalizada or "tecnolog" in area_normalizada:
+        return "Ingeniería y Tecnología"
+    elif "medicina" in area_normalizada or "vida" in area_normalizada or "biolog" in area_normalizada:
+        return "Medicina y Ciencias de la Vida"
+    elif "natural" in area_normalizada or "física" in area_normalizada or "química" in area_normalizada or "matemática" in area_normalizada:
+        return "Ciencias Naturales"
+    else:
+        # Si la respuesta no coincide claramente, intentar clasificar basado en el subject
+        if subject and subject != "No encontrado":
+            subject_lower = subject.lower()
+            if any(term in subject_lower for term in ["historia", "filosofía", "literatura", "lingüística", "arte", "diseño", "arquitectura", "arqueología", "teología"]):
+                return "Artes y Humanidades"
+            elif any(term in subject_lower for term in ["ingeniería", "tecnología", "computación", "sistemas", "telecomunicaciones", "informática", "electrónica", "mecánica", "civil"]):
+                return "Ingeniería y Tecnología"
+            elif any(term in subject_lower for term in ["medicina", "enfermería", "farmacia", "biología", "biotecnología", "veterinaria", "agricultura", "psicología", "salud"]):
+                return "Medicina y Ciencias de la Vida"
+            elif any(term in subject_lower for term in ["física", "química", "matemáticas", "estadística", "geología", "ambiental", "astronomía"]):
+                return "Ciencias Naturales"
         
-        if "arte" in area_normalizada or "human" in area_normalizada:
-            return "Artes y Humanidades"
-        elif "ingenier" in area_normalizada or "tecnolog" in area_normalizada:
-            return "Ingeniería y Tecnología"
-        elif "medicina" in area_normalizada or "vida" in area_normalizada or "biolog" in area_normalizada:
-            return "Medicina y Ciencias de la Vida"
-        elif "natural" in area_normalizada or "física" in area_normalizada or "química" in area_normalizada or "matemática" in area_normalizada:
-            return "Ciencias Naturales"
-        else:
-            # Si la respuesta no coincide claramente, intentar clasificar basado en el subject
-            if subject and subject != "No encontrado":
-                subject_lower = subject.lower()
-                if any(term in subject_lower for term in ["historia", "filosofía", "literatura", "lingüística", "arte", "diseño", "arquitectura", "arqueología", "teología"]):
-                    return "Artes y Humanidades"
-                elif any(term in subject_lower for term in ["ingeniería", "tecnología", "computación", "sistemas", "telecomunicaciones", "informática", "electrónica", "mecánica", "civil"]):
-                    return "Ingeniería y Tecnología"
-                elif any(term in subject_lower for term in ["medicina", "enfermería", "farmacia", "biología", "biotecnología", "veterinaria", "agricultura", "psicología", "salud"]):
-                    return "Medicina y Ciencias de la Vida"
-                elif any(term in subject_lower for term in ["física", "química", "matemáticas", "estadística", "geología", "ambiental", "astronomía"]):
-                    return "Ciencias Naturales"
-            
-            # Si aún no se puede determinar, devolver una categoría por defecto
-            return "Ingeniería y Tecnología"  # Categoría por defecto
+        # Si aún no se puede determinar, devolver una categoría por defecto
+        return "Ingeniería y Tecnología"  # Categoría por defecto
+
+def determine_knowledge_area(cv_text, subject="", university=""):
+    """
+    Determina el área de conocimiento del candidato basado en el contenido del CV,
+    el subject y la universidad de doctorado.
+    
+    Las áreas posibles son:
+    - Artes y Humanidades
+    - Ingeniería y Tecnología
+    - Medicina y Ciencias de la Vida
+    - Ciencias Naturales
+    """
+    request = build_area_request(cv_text, subject, university)
+    cache_key = llm_cache_key("area", request["model"], cv_text, subject, university)
+    area = llm_cache_get(cache_key)
+    if area is not None:
+        return area
+    
+    try:
+        area = normalize_knowledge_area(chat_completion(request).strip(), subject)
+        llm_cache_set(cache_key, "area", request["model"], area)
+        return area
+    except Exception as e:
+        log(f"Error al determinar el área de conocimiento: {e}")
+        return "No encontrado"
+
+async def determine_knowledge_area_async(cv_text, subject="", university=""):
+    """Versión asíncrona de determine_knowledge_area"""
+    request = build_area_request(cv_text, subject, university)
+    cache_key = llm_cache_key("area", request["model"], cv_text, subject, university)
+    area = llm_cache_get(cache_key)
+    if area is not None:
+        return area
+    
+    try:
+        area = normalize_knowledge_area((await chat_completion_async(request)).strip(), subject)
+        llm_cache_set(cache_key, "area", request["model"], area)
+        return area
     except Exception as e:
         log(f"Error al determinar el área de conocimiento: {e}")
         return "No encontrado"
 
-def extract_basic_data_gpt(cv_text, filename=""):
-    prompt = """
-Extract ONLY the following fields from this academic CV (English or Spanish).
-If a field is not found, write 'No encontrado'.
-Pay special attention to extracting the full name correctly, it's the most important field.
-Look for the name at the beginning of the CV, in headers, or in signature sections.
-
-For the phone number, look for patterns like:
+# Partes del prompt de datos básicos compartidas por la petición individual y la empaquetada
+BASIC_DATA_PHONE_HINTS = """For the phone number, look for patterns like:
 - +52 55 1234 5678
 - (123) 456-7890
 - 123-456-7890
@@ -327,7 +2095,27 @@ For the phone number, look for patterns like:
 DO NOT confuse year ranges (like 2007-2015) with phone numbers.
 Look for phone numbers near keywords like "teléfono", "phone", "contact", "móvil", "celular".
 
-Return a valid JSON in this format:
+"""
+
+BASIC_DATA_EXAMPLES = """Examples:
+Nombre completo: Juan Pérez Gómez / María Fernanda Díaz / Dr. Carlos Rodríguez Martínez
+Correo electrónico profesional: juan.perez@tec.mx / maria.diaz@unam.mx
+LinkedIn URL: https://linkedin.com/in/juanperez
+Teléfono: +52 5555555555 (NOT year ranges like 2007-2015)
+País de residencia o nacionalidad: México / Spain / Argentina
+Universidad doctorado: Tecnológico de Monterrey / Universidad de Buenos Aires
+Subject: Ingeniería Química / Chemical Engineering
+"""
+
+def build_basic_data_request(cv_text):
+    """Construye la petición para extraer los campos básicos del CV"""
+    prompt = """
+Extract ONLY the following fields from this academic CV (English or Spanish).
+If a field is not found, write 'No encontrado'.
+Pay special attention to extracting the full name correctly, it's the most important field.
+Look for the name at the beginning of the CV, in headers, or in signature sections.
+
+""" + BASIC_DATA_PHONE_HINTS + """Return a valid JSON in this format:
 {
     "Nombre completo": "...",
     "Correo electrónico profesional": "...",
@@ -338,31 +2126,19 @@ Return a valid JSON in this format:
     "Subject": "..."
 }
 
-Examples:
-Nombre completo: Juan Pérez Gómez / María Fernanda Díaz / Dr. Carlos Rodríguez Martínez
-Correo electrónico profesional: juan.perez@tec.mx / maria.diaz@unam.mx
-LinkedIn URL: https://linkedin.com/in/juanperez
-Teléfono: +52 5555555555 (NOT year ranges like 2007-2015)
-País de residencia o nacionalidad: México / Spain / Argentina
-Universidad doctorado: Tecnológico de Monterrey / Universidad de Buenos Aires
-Subject: Ingeniería Química / Chemical Engineering
-
+""" + BASIC_DATA_EXAMPLES + """
 CV:
-""" + cv_text[:6000]
+"""
+    prompt += fit_cv_text(prompt, cv_text, BASIC_DATA_MODEL)
+    return {
+        "model": BASIC_DATA_MODEL,
+        "messages": [{"role": "user", "content": prompt}],
+        "max_tokens": 600,
+        "temperature": 0
+    }
 
-    try:
-        response = openai.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=600,
-            temperature=0
-        )
-        raw = response.choices[0].message.content
-        data = json.loads(raw[raw.find('{'):raw.rfind('}')+1])
-    except Exception as e:
-        log(f"GPT error: {e} / Respuesta: {raw if 'raw' in locals() else 'No raw'}")
-        data = {}
-    
+def apply_basic_data_fallbacks(data, cv_text, filename=""):
+    """Completa con regex y con el nombre del archivo los campos que GPT no encontró"""
     # Fallbacks para casos donde GPT ponga "No encontrado"
     # Nombre: intentar extraer del nombre del archivo si no se encontró
     if not data.get("Nombre completo") or data["Nombre completo"].lower() == "no encontrado":
@@ -402,34 +2178,366 @@ CV:
     
     return data
 
-def match_university_qs(univ_name_cv, qs_list):
-    if not univ_name_cv or univ_name_cv.strip().lower() == 'no encontrado':
-        return {"Universidad doctorado": "No encontrado", "QS Rank": "No encontrado"}
+def extract_basic_data_gpt(cv_text, filename=""):
+    request = build_basic_data_request(cv_text)
+    cache_key = llm_cache_key("basic", request["model"], cv_text)
+    data = llm_cache_get(cache_key)
+    if data is None:
+        # Pre-pasada barata: los fallbacks de apply_basic_data_fallbacks reutilizan el escaneo memorizado
+        scan_contacts(cv_text)
+        raw = None
+        try:
+            raw = chat_completion(request)
+            data = parse_json_response(raw)
+            llm_cache_set(cache_key, "basic", request["model"], data)
+        except Exception as e:
+            log(f"GPT error: {e} / Respuesta: {raw if raw is not None else 'No raw'}")
+            data = {}
+    
+    return apply_basic_data_fallbacks(data, cv_text, filename)
+
+async def extract_basic_data_gpt_async(cv_text, filename=""):
+    """Versión asíncrona de extract_basic_data_gpt"""
+    request = build_basic_data_request(cv_text)
+    cache_key = llm_cache_key("basic", request["model"], cv_text)
+    data = llm_cache_get(cache_key)
+    if data is None:
+        scan_contacts(cv_text)
+        raw = None
+        try:
+            raw = await chat_completion_async(request)
+            data = parse_json_response(raw)
+            llm_cache_set(cache_key, "basic", request["model"], data)
+        except Exception as e:
+            log(f"GPT error: {e} / Respuesta: {raw if raw is not None else 'No raw'}")
+            data = {}
+    
+    return apply_basic_data_fallbacks(data, cv_text, filename)
+
+# === Empaquetado de CVs cortos en una sola petición de datos básicos ===
+BASIC_DATA_FIELDS = [
+    "Nombre completo", "Correo electrónico profesional", "LinkedIn URL", "Teléfono",
+    "País de residencia o nacionalidad", "Universidad doctorado", "Subject",
+]
+
+def build_packed_basic_data_request(cv_texts):
+    """Construye una petición de datos básicos para varios CVs delimitados y numerados"""
+    documents = "\n".join(
+        f"<<<CV {i}>>>\n{cv_text}\n<<<FIN CV {i}>>>" for i, cv_text in enumerate(cv_texts, 1)
+    )
+    prompt = f"""
+Below are {len(cv_texts)} academic CVs (English or Spanish), each between <<<CV n>>> and <<<FIN CV n>>>.
+Extract ONLY the following fields from EACH CV independently; never mix data between CVs.
+If a field is not found, write 'No encontrado'.
+Pay special attention to extracting the full name correctly, it's the most important field.
+
+""" + BASIC_DATA_PHONE_HINTS + """Return a valid JSON array with exactly one object per CV, in this format:
+[
+  {
+    "CV": 1,
+    "Nombre completo": "...",
+    "Correo electrónico profesional": "...",
+    "LinkedIn URL": "...",
+    "Teléfono": "...",
+    "País de residencia o nacionalidad": "...",
+    "Universidad doctorado": "...",
+    "Subject": "..."
+  }
+]
+
+""" + BASIC_DATA_EXAMPLES + """
+CVs:
+""" + documents
+    return {
+        "model": BASIC_DATA_MODEL,
+        "messages": [{"role": "user", "content": prompt}],
+        "max_tokens": PACK_COMPLETION_TOKENS_PER_CV * len(cv_texts),
+        "temperature": 0
+    }
+
+def parse_packed_basic_data_response(raw, count):
+    """
+    Valida la respuesta empaquetada elemento a elemento. Devuelve {número de CV: datos} solo
+    con los elementos válidos (número en rango, sin repetir y con los siete campos como texto).
+    """
+    items = json.loads(raw[raw.find('['):raw.rfind(']')+1])
+    valid = {}
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        try:
+            number = int(item.get("CV"))
+        except (TypeError, ValueError):
+            continue
+        if not 1 <= number <= count or number in valid:
+            continue
+        if not all(isinstance(item.get(field), str) for field in BASIC_DATA_FIELDS):
+            continue
+        valid[number] = {field: item[field] for field in BASIC_DATA_FIELDS}
+    return valid
+
+def plan_cv_packs(cv_texts):
+    """Agrupa los CVs cortos en paquetes de hasta PACK_MAX_CVS que caben en PACK_PROMPT_TOKEN_BUDGET"""
+    packs = []
+    current, used = [], 0
+    for cache_key, cv_text in cv_texts:
+        tokens = count_tokens(cv_text, BASIC_DATA_MODEL)
+        if current and (len(current) >= PACK_MAX_CVS or used + tokens > PACK_PROMPT_TOKEN_BUDGET):
+            packs.append(current)
+            current, used = [], 0
+        current.append((cache_key, cv_text))
+        used += tokens
+    if current:
+        packs.append(current)
+    return [pack for pack in packs if len(pack) > 1]
+
+def extract_packed_basic_data(pack):
+    """
+    Extrae los datos básicos de un paquete de CVs y guarda cada resultado válido en la caché con
+    la misma clave que extract_basic_data_gpt. Los CVs que no obtienen un resultado válido se
+    reintentan después de forma individual (el procesamiento normal no los encuentra en caché).
+    """
+    request = build_packed_basic_data_request([cv_text for _, cv_text in pack])
+    try:
+        valid = parse_packed_basic_data_response(chat_completion(request), len(pack))
+    except Exception as e:
+        log(f"Error en la petición empaquetada de {len(pack)} CVs: {e}")
+        valid = {}
+    for number, data in valid.items():
+        llm_cache_set(pack[number - 1][0], "basic", request["model"], data)
+    count_stat("packed_requests")
+    count_stat("packed_cvs", len(valid))
+    count_stat("packed_retries", len(pack) - len(valid))
+    return len(valid)
+
+class BasicDataPacker:
+    """
+    Empaqueta los CVs cortos a medida que los workers extraen su texto. Un worker con un CV corto
+    cuyos datos básicos no están en caché espera aquí hasta que hay PACK_MAX_CVS esperando o
+    hasta que ningún otro worker está extrayendo texto (nadie más se puede sumar pronto). El
+    worker que completa el paquete envía las peticiones empaquetadas, y después todos siguen con
+    el procesamiento normal, que encuentra sus datos en la caché.
+    """
+    
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.extracting = 0
+        self.waiting = []
+    
+    def extract(self, fetcher, fname):
+        """Extrae el texto y devuelve (texto, clave de caché si el CV debe esperar a un paquete)"""
+        cv_text = fetcher.extract_text(fname)
+        if not cv_text or not cv_text.strip() or count_tokens(cv_text, BASIC_DATA_MODEL) > PACK_MAX_CV_TOKENS:
+            return cv_text, None
+        cache_key = llm_cache_key("basic", BASIC_DATA_MODEL, cv_text)
+        return cv_text, (cache_key if llm_cache_get(cache_key) is None else None)
+    
+    def finish_extraction(self, entry):
+        """Anota el fin de una extracción (y el CV en espera, si lo hay); devuelve el paquete listo o None"""
+        with self.cond:
+            self.extracting -= 1
+            if entry is not None:
+                self.waiting.append(entry)
+            if self.waiting and (len(self.waiting) >= PACK_MAX_CVS or self.extracting == 0):
+                pack, self.waiting = self.waiting, []
+                return pack
+            return None
+    
+    def send(self, pack):
+        """Envía las peticiones del paquete y despierta a los workers que esperan"""
+        try:
+            for cvs in plan_cv_packs([(entry["key"], entry["text"]) for entry in pack]):
+                log(f"Empaquetando {len(cvs)} CVs cortos en una petición...")
+                extract_packed_basic_data(cvs)
+        except Exception as e:
+            log(f"Error en la petición empaquetada: {e}")
+        finally:
+            with self.cond:
+                for entry in pack:
+                    entry["done"] = True
+                self.cond.notify_all()
+    
+    def extract_text(self, fetcher, fname):
+        """Texto del CV; si es corto y sus datos básicos no están en caché, espera a su paquete"""
+        with self.cond:
+            self.extracting += 1
+        entry = None
+        try:
+            cv_text, cache_key = self.extract(fetcher, fname)
+            if cache_key:
+                entry = {"key": cache_key, "text": cv_text, "done": False}
+        finally:
+            pack = self.finish_extraction(entry)
+        if pack:
+            self.send(pack)
+        if entry:
+            with self.cond:
+                self.cond.wait_for(lambda: entry["done"])
+        return cv_text
+    
+    async def extract_text_async(self, fetcher, fname):
+        """Versión asíncrona de extract_text (la extracción y el envío del paquete corren en hilos)"""
+        with self.cond:
+            self.extracting += 1
+        entry = None
+        try:
+            cv_text, cache_key = await asyncio.to_thread(self.extract, fetcher, fname)
+            if cache_key:
+                entry = {"key": cache_key, "text": cv_text, "done": False,
+                         "future": asyncio.get_running_loop().create_future()}
+        finally:
+            pack = self.finish_extraction(entry)
+        if pack:
+            try:
+                await asyncio.to_thread(self.send, pack)
+            finally:
+                for waiting in pack:
+                    if not waiting["future"].done():
+                        waiting["future"].set_result(None)
+        if entry:
+            await entry["future"]
+        return cv_text
+
+def build_single_pass_request(cv_text):
+    """Construye la petición que extrae los campos básicos y el área de conocimiento en una sola llamada"""
+    prompt = """
+Extract ONLY the following fields from this academic CV (English or Spanish) and classify the candidate
+into ONE knowledge area.
+If a field is not found, write 'No encontrado'.
+Pay special attention to extracting the full name correctly, it's the most important field.
+Look for the name at the beginning of the CV, in headers, or in signature sections.
+
+""" + BASIC_DATA_PHONE_HINTS + """For "Area", use the QS Rank by Subject criteria and answer EXACTLY one of:
+- Artes y Humanidades: Historia, Filosofía, Literatura, Lingüística, Artes, Diseño, Arquitectura, Arqueología, Teología, etc.
+- Ingeniería y Tecnología: Ingeniería Civil, Eléctrica, Mecánica, Química, Computación, Sistemas, TI, Telecomunicaciones, etc.
+- Medicina y Ciencias de la Vida: Medicina, Enfermería, Farmacia, Biología, Biotecnología, Veterinaria, Agricultura, Psicología, etc.
+- Ciencias Naturales: Física, Química, Matemáticas, Estadística, Geología, Ciencias Ambientales, Astronomía, etc.
+Base the area on academic degrees, research lines, publications, projects and discipline keywords.
+
+Return a valid JSON in this format:
+{
+    "Nombre completo": "...",
+    "Correo electrónico profesional": "...",
+    "LinkedIn URL": "...",
+    "Teléfono": "...",
+    "País de residencia o nacionalidad": "...",
+    "Universidad doctorado": "...",
+    "Subject": "...",
+    "Area": "..."
+}
+
+""" + BASIC_DATA_EXAMPLES + """Area: Ingeniería y Tecnología
+
+CV:
+"""
+    prompt += fit_cv_text(prompt, cv_text, SINGLE_PASS_MODEL)
+    return {
+        "model": SINGLE_PASS_MODEL,
+        "messages": [{"role": "user", "content": prompt}],
+        "max_tokens": 700,
+        "temperature": 0
+    }
+
+def apply_single_pass_fallbacks(data, cv_text, filename=""):
+    """Aplica los fallbacks de los campos básicos y normaliza el área de la respuesta combinada"""
+    raw_area = data.pop("Area", "")
+    data = apply_basic_data_fallbacks(data, cv_text, filename)
+    if raw_area is None:
+        # La llamada a GPT falló: mismo resultado que determine_knowledge_area ante un error
+        data["Area"] = "No encontrado"
+    else:
+        # Si el área no es reconocible se usa el fallback por palabras clave del subject
+        data["Area"] = normalize_knowledge_area(str(raw_area).strip(), data.get("Subject", ""))
+    return data
+
+def extract_data_and_area_gpt(cv_text, filename=""):
+    """
+    Modo "single-pass": extrae los siete campos básicos y el área de conocimiento con una
+    sola llamada a GPT, en lugar de extract_basic_data_gpt + determine_knowledge_area.
+    """
+    request = build_single_pass_request(cv_text)
+    cache_key = llm_cache_key("single-pass", request["model"], cv_text)
+    data = llm_cache_get(cache_key)
+    if data is None:
+        raw = None
+        try:
+            raw = chat_completion(request)
+            data = parse_json_response(raw)
+            data["Area"] = data.get("Area") or ""
+            llm_cache_set(cache_key, "single-pass", request["model"], data)
+        except Exception as e:
+            log(f"GPT error: {e} / Respuesta: {raw if raw is not None else 'No raw'}")
+            data = {"Area": None}
+    
+    return apply_single_pass_fallbacks(data, cv_text, filename)
+
+async def extract_data_and_area_gpt_async(cv_text, filename=""):
+    """Versión asíncrona de extract_data_and_area_gpt"""
+    request = build_single_pass_request(cv_text)
+    cache_key = llm_cache_key("single-pass", request["model"], cv_text)
+    data = llm_cache_get(cache_key)
+    if data is None:
+        raw = None
+        try:
+            raw = await chat_completion_async(request)
+            data = parse_json_response(raw)
+            data["Area"] = data.get("Area") or ""
+            llm_cache_set(cache_key, "single-pass", request["model"], data)
+        except Exception as e:
+            log(f"GPT error: {e} / Respuesta: {raw if raw is not None else 'No raw'}")
+            data = {"Area": None}
+    
+    return apply_single_pass_fallbacks(data, cv_text, filename)
+
+def match_university_qs_local(univ_name_cv, qs_list):
+    """Busca la universidad en la lista QS por alias y por similitud de texto, sin usar GPT"""
+    qs_index = get_qs_index(qs_list)
     
     # Normalizar el nombre de la universidad
     univ_norm = normalize_str(univ_name_cv)
     
     # Buscar aliases conocidos
     aliases = get_aliases_for_univ(univ_norm)
-    qs_names_norm = [normalize_str(row[1]) for row in qs_list if len(row) >= 2]
     
     # Método 1: Búsqueda directa por alias
     for alias in aliases:
-        if alias in qs_names_norm:
-            idx = qs_names_norm.index(alias)
-            return {"Universidad doctorado": qs_list[idx][1], "QS Rank": qs_list[idx][0]}
+        idx = qs_index.lookup(alias)
+        if idx is not None:
+            if len(aliases) > 1:
+                count_stat("qs_alias_hits")
+            return qs_index.result(idx)
     
-    # Método 2: Búsqueda por similitud de texto
-    close_matches = get_close_matches(univ_norm, qs_names_norm, n=1, cutoff=0.85)
-    if close_matches:
-        idx = qs_names_norm.index(close_matches[0])
-        return {"Universidad doctorado": qs_list[idx][1], "QS Rank": qs_list[idx][0]}
+    # Método 2: Búsqueda por similitud de texto (candidatos del índice de trigramas)
+    idx = qs_index.fuzzy_lookup(univ_norm, cutoff=0.85)
+    if idx is not None:
+        return qs_index.result(idx)
     
-    # Método 3: Usar GPT para razonar sobre la universidad
-    # Enviar toda la lista QS para que GPT pueda razonar mejor
-    qs_universities = "\n".join([f"{row[1]} ({row[0]})" for row in qs_list[:200] if len(row) >= 2 and row[0] and row[1]])
+    # Método 2b: motor local por palabras (traducciones, palabras vacías y acrónimos)
+    idx = qs_index.token_match(univ_name_cv)
+    if idx is not None:
+        count_stat("qs_local_token_matches")
+        return qs_index.result(idx)
     
-    prompt = f"""
+    return None
+
+def build_qs_request(univ_name_cv, candidate_rows):
+    """
+    Construye la petición a GPT-4o para razonar sobre la universidad entre las filas candidatas
+    (solo las que caben en el presupuesto de tokens del modelo, en orden)
+    """
+    qs_lines = [f"{row[1]} ({row[0]})" for row in candidate_rows if len(row) >= 2 and row[0] and row[1]]
+    template_tokens = count_tokens(build_qs_prompt(univ_name_cv, ""), QS_MODEL)
+    qs_universities = "\n".join(fit_lines(qs_lines, QS_MODEL, prompt_token_budget(QS_MODEL) - template_tokens))
+    return {
+        "model": QS_MODEL,  # Usar GPT-4o para mejor razonamiento
+        "messages": [{"role": "user", "content": build_qs_prompt(univ_name_cv, qs_universities)}],
+        "max_tokens": 800,
+        "temperature": 0
+    }
+
+def build_qs_prompt(univ_name_cv, qs_universities):
+    """Texto del prompt de GPT-4o para la lista de universidades candidatas ya formateada"""
+    return f"""
 Necesito encontrar la universidad "{univ_name_cv}" en el ranking QS mundial de universidades.
 
 Usa razonamiento paso a paso para identificar la universidad correcta:
@@ -439,7 +2547,7 @@ Usa razonamiento paso a paso para identificar la universidad correcta:
 4. Considera fusiones o cambios de nombre (ej: "Paris-Saclay" antes era varias universidades separadas)
 5. Considera campus específicos vs. sistema universitario completo
 
-Aquí están las primeras 200 universidades del ranking QS (formato: Nombre (Ranking)):
+Aquí están las universidades candidatas del ranking QS (formato: Nombre (Ranking)):
 {qs_universities}
 
 Razona paso a paso para encontrar la universidad "{univ_name_cv}" en esta lista.
@@ -453,31 +2561,25 @@ Responde SOLO en este formato JSON:
   "QS Rank": "Número de ranking"
 }}
 """
-    try:
-        response = openai.chat.completions.create(
-            model="gpt-4o",  # Usar GPT-4o para mejor razonamiento
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=800,
-            temperature=0
-        )
-        raw = response.choices[0].message.content
-        data = json.loads(raw[raw.find('{'):raw.rfind('}')+1])
-        log(f"Razonamiento para encontrar '{univ_name_cv}': {data.get('Razonamiento', 'No proporcionado')}")
-        
-        if data.get("Universidad doctorado", "").strip().lower() != "no encontrado":
-            return {
-                "Universidad doctorado": data.get("Universidad doctorado", "No encontrado"),
-                "QS Rank": data.get("QS Rank", "No encontrado")
-            }
-    except Exception as e:
-        log(f"Error en GPT para encontrar universidad: {e}")
+
+def parse_qs_response(univ_name_cv, raw):
+    """Interpreta la respuesta de GPT-4o; devuelve None si no encontró la universidad"""
+    data = parse_json_response(raw)
+    log(f"Razonamiento para encontrar '{univ_name_cv}': {data.get('Razonamiento', 'No proporcionado')}")
     
-    # Si GPT-4o falla, intentar con GPT-3.5 y chunks más pequeños como fallback
-    for chunk in chunk_list(qs_list, 40):
-        qs_chunk = "\n".join([f"{row[1]} ({row[0]})" for row in chunk if len(row) >= 2 and row[0] and row[1]])
-        prompt = f"""
+    if data.get("Universidad doctorado", "").strip().lower() != "no encontrado":
+        return {
+            "Universidad doctorado": data.get("Universidad doctorado", "No encontrado"),
+            "QS Rank": data.get("QS Rank", "No encontrado")
+        }
+    return None
+
+def build_qs_chunk_request(univ_name_cv, chunk):
+    """Construye la petición a GPT-3.5 para buscar la universidad en un bloque de la lista QS"""
+    qs_chunk = "\n".join([f"{row[1]} ({row[0]})" for row in chunk if len(row) >= 2 and row[0] and row[1]])
+    prompt = f"""
 Lista: Nombres oficiales de universidades con su ranking QS (entre paréntesis).
-Dada la universidad extraída de un CV: "{univ_name_cv}", identifica el nombre oficial y el QS Rank. 
+Dada la universidad extraída de un CV: "{univ_name_cv}", identifica el nombre oficial y el QS Rank.
 Usa razonamiento para encontrar coincidencias incluso si el nombre no es exacto.
 Considera traducciones, acrónimos, y variaciones regionales.
 Si no hay match, pon "No encontrado".
@@ -494,36 +2596,527 @@ Responde SOLO este JSON:
   "QS Rank": "..."
 }}
 """
+    return {
+        "model": QS_CHUNK_MODEL,
+        "messages": [{"role": "user", "content": prompt}],
+        "max_tokens": 200,
+        "temperature": 0
+    }
+
+def evaluate_qs_chunk_answer(univ_name_cv, chunk, raw):
+    """
+    Interpreta la respuesta de GPT-3.5 para un bloque de la lista QS.
+    Devuelve (seguro, datos): seguro=True si el nombre devuelto está literalmente en el bloque
+    (se usan entonces el nombre y el ranking de la fila); (False, datos) si es un candidato
+    dudoso; None si el modelo no encontró la universidad.
+    """
+    data = parse_json_response(raw)
+    name = str(data.get("Universidad doctorado", "")).strip()
+    if not name or name.lower() == "no encontrado":
+        return None
+    name_norm = normalize_str(name)
+    for row in chunk:
+        if len(row) >= 2 and normalize_str(row[1]) == name_norm:
+            return True, {"Universidad doctorado": row[1], "QS Rank": row[0]}
+    return False, data
+
+def pick_best_qs_candidate(univ_name_cv, candidates):
+    """Entre las respuestas dudosas de varios bloques elige la más parecida al nombre del CV"""
+    univ_norm = normalize_str(univ_name_cv)
+    best = max(
+        candidates,
+        key=lambda c: (SequenceMatcher(None, univ_norm, normalize_str(str(c[1].get("Universidad doctorado", "")))).ratio(), -c[0])
+    )
+    return best[1]
+
+def resolve_qs_chunks(univ_name_cv, qs_list):
+    """
+    Fallback con GPT-3.5: consulta todos los bloques de 40 universidades en paralelo
+    (como máximo QS_CHUNK_CONCURRENCY a la vez) y se queda con la primera coincidencia segura;
+    las consultas pendientes se cancelan en cuanto llega. Devuelve (resultado o None, definitivo).
+    """
+    chunks = list(chunk_list(qs_list, 40))
+    if not chunks:
+        return None, True
+    
+    complete = True
+    candidates = []
+    executor = ThreadPoolExecutor(max_workers=min(QS_CHUNK_CONCURRENCY, len(chunks)))
+    try:
+        futures = {
+            executor.submit(contextvars.copy_context().run, chat_completion, build_qs_chunk_request(univ_name_cv, chunk)): i
+            for i, chunk in enumerate(chunks)
+        }
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                answer = evaluate_qs_chunk_answer(univ_name_cv, chunks[i], future.result())
+            except Exception as e:
+                log(f"GPT QS match error: {e}")
+                complete = False
+                continue
+            if answer is None:
+                continue
+            confident, data = answer
+            if confident:
+                return data, True
+            candidates.append((i, data))
+    finally:
+        # Cancelar los bloques que aún no se han enviado (las peticiones en curso se descartan)
+        executor.shutdown(wait=False, cancel_futures=True)
+    
+    if candidates:
+        return pick_best_qs_candidate(univ_name_cv, candidates), complete
+    return None, complete
+
+def resolve_qs_chunk_answers(univ_name_cv, chunks, answers):
+    """
+    Como resolve_qs_chunks, pero con las respuestas ya recibidas de cada bloque (None si la
+    petición falló), p. ej. desde la Batch API. Devuelve (resultado o None, definitivo).
+    """
+    complete = True
+    candidates = []
+    for i, (chunk, raw) in enumerate(zip(chunks, answers)):
+        if raw is None:
+            complete = False
+            continue
         try:
-            response = openai.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=200,
-                temperature=0
-            )
-            raw = response.choices[0].message.content
-            data = json.loads(raw[raw.find('{'):raw.rfind('}')+1])
-            if data.get("Universidad doctorado", "").strip().lower() != "no encontrado":
-                return data
+            answer = evaluate_qs_chunk_answer(univ_name_cv, chunk, raw)
         except Exception as e:
             log(f"GPT QS match error: {e}")
+            complete = False
             continue
+        if answer is None:
+            continue
+        confident, data = answer
+        if confident:
+            return data, True
+        candidates.append((i, data))
+    
+    if candidates:
+        return pick_best_qs_candidate(univ_name_cv, candidates), complete
+    return None, complete
+
+async def resolve_qs_chunks_async(univ_name_cv, qs_list):
+    """Versión asíncrona de resolve_qs_chunks; las peticiones en curso se cancelan de verdad"""
+    chunks = list(chunk_list(qs_list, 40))
+    if not chunks:
+        return None, True
+    
+    semaphore = asyncio.Semaphore(QS_CHUNK_CONCURRENCY)
+    
+    async def query_chunk(i, chunk):
+        async with semaphore:
+            try:
+                raw = await chat_completion_async(build_qs_chunk_request(univ_name_cv, chunk))
+                return i, evaluate_qs_chunk_answer(univ_name_cv, chunk, raw), None
+            except Exception as e:
+                return i, None, e
+    
+    complete = True
+    candidates = []
+    tasks = [asyncio.ensure_future(query_chunk(i, chunk)) for i, chunk in enumerate(chunks)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            i, answer, error = await next_done
+            if error is not None:
+                log(f"GPT QS match error: {error}")
+                complete = False
+                continue
+            if answer is None:
+                continue
+            confident, data = answer
+            if confident:
+                return data, True
+            candidates.append((i, data))
+    finally:
+        for task in tasks:
+            task.cancel()
+    
+    if candidates:
+        return pick_best_qs_candidate(univ_name_cv, candidates), complete
+    return None, complete
+
+def resolve_university_qs(univ_name_cv, qs_list):
+    """
+    Resuelve la universidad contra la lista QS (alias, similitud y GPT).
+    Devuelve (resultado, definitivo): definitivo es False si alguna llamada a GPT falló,
+    en cuyo caso un "No encontrado" no debe guardarse en la caché.
+    """
+    # Métodos 1 y 2: alias y similitud de texto
+    local_match = match_university_qs_local(univ_name_cv, qs_list)
+    if local_match:
+        return local_match, True
+    
+    complete = True
+    count_stat("qs_gpt_lookups")
+    # Método 3: Usar GPT para razonar sobre la universidad
+    try:
+        candidate_rows = qs_prompt_rows(univ_name_cv, qs_list)
+        result = parse_qs_response(univ_name_cv, chat_completion(build_qs_request(univ_name_cv, candidate_rows)))
+        if result:
+            remember_qs_match(univ_name_cv, qs_list, result)
+            return result, True
+    except Exception as e:
+        log(f"Error en GPT para encontrar universidad: {e}")
+        complete = False
+    
+    # Si GPT-4o falla, intentar con GPT-3.5 y chunks más pequeños como fallback
+    result, chunks_complete = resolve_qs_chunks(univ_name_cv, qs_list)
+    if result:
+        # Una respuesta dudosa con bloques fallidos se usa, pero no se recuerda ni se guarda
+        if chunks_complete:
+            remember_qs_match(univ_name_cv, qs_list, result)
+        return result, chunks_complete
+    complete = complete and chunks_complete
     
-    return {"Universidad doctorado": "No encontrado", "QS Rank": "No encontrado"}
+    return {"Universidad doctorado": "No encontrado", "QS Rank": "No encontrado"}, complete
+
+async def resolve_university_qs_async(univ_name_cv, qs_list):
+    """Versión asíncrona de resolve_university_qs"""
+    # Métodos 1 y 2: alias y similitud de texto
+    local_match = match_university_qs_local(univ_name_cv, qs_list)
+    if local_match:
+        return local_match, True
+    
+    complete = True
+    count_stat("qs_gpt_lookups")
+    # Método 3: Usar GPT para razonar sobre la universidad
+    try:
+        candidate_rows = await qs_prompt_rows_async(univ_name_cv, qs_list)
+        raw = await chat_completion_async(build_qs_request(univ_name_cv, candidate_rows))
+        result = parse_qs_response(univ_name_cv, raw)
+        if result:
+            remember_qs_match(univ_name_cv, qs_list, result)
+            return result, True
+    except Exception as e:
+        log(f"Error en GPT para encontrar universidad: {e}")
+        complete = False
+    
+    # Si GPT-4o falla, intentar con GPT-3.5 y chunks más pequeños como fallback
+    result, chunks_complete = await resolve_qs_chunks_async(univ_name_cv, qs_list)
+    if result:
+        # Una respuesta dudosa con bloques fallidos se usa, pero no se recuerda ni se guarda
+        if chunks_complete:
+            remember_qs_match(univ_name_cv, qs_list, result)
+        return result, chunks_complete
+    complete = complete and chunks_complete
+    
+    return {"Universidad doctorado": "No encontrado", "QS Rank": "No encontrado"}, complete
+
+def match_university_qs(univ_name_cv, qs_list):
+    if not univ_name_cv or univ_name_cv.strip().lower() == 'no encontrado':
+        return {"Universidad doctorado": "No encontrado", "QS Rank": "No encontrado"}
+    
+    # Consultar primero la caché de resoluciones de ejecuciones anteriores
+    cached = qs_cache_get(univ_name_cv, qs_list)
+    if cached is not None:
+        return cached
+    
+    result, complete = resolve_university_qs(univ_name_cv, qs_list)
+    qs_cache_set(univ_name_cv, qs_list, result, complete)
+    return result
+
+async def match_university_qs_async(univ_name_cv, qs_list):
+    """Versión asíncrona de match_university_qs"""
+    if not univ_name_cv or univ_name_cv.strip().lower() == 'no encontrado':
+        return {"Universidad doctorado": "No encontrado", "QS Rank": "No encontrado"}
+    
+    # Consultar primero la caché de resoluciones de ejecuciones anteriores
+    cached = qs_cache_get(univ_name_cv, qs_list)
+    if cached is not None:
+        return cached
+    
+    result, complete = await resolve_university_qs_async(univ_name_cv, qs_list)
+    qs_cache_set(univ_name_cv, qs_list, result, complete)
+    return result
 
 def chunk_list(lst, n):
     for i in range(0, len(lst), n):
         yield lst[i:i + n]
 
+# === Listado paginado de carpetas de Drive y manifiesto local ===
+DRIVE_FILE_FIELDS = "id, name, mimeType, md5Checksum, modifiedTime, size"
+_drive_manifest_lock = threading.Lock()
+
+def list_drive_files(service, query, fields=DRIVE_FILE_FIELDS):
+    """Lista todos los archivos que cumplen la consulta siguiendo nextPageToken (páginas de 1000)"""
+    files = []
+    page_token = None
+    while True:
+        results = service.files().list(
+            q=query, fields=f"nextPageToken, files({fields})", pageSize=1000, pageToken=page_token
+        ).execute()
+        files.extend(results.get('files', []))
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return files
+
+def list_cv_files_in_folder(service, folder_id):
+    """Todos los PDF y DOCX (no eliminados) de una carpeta de Drive"""
+    mime_query = " or ".join(f"mimeType='{mime_type}'" for mime_type in CV_MIME_TYPES)
+    return list_drive_files(service, f"'{folder_id}' in parents and ({mime_query}) and trashed=false")
+
+def empty_drive_manifest():
+    return {"version": DRIVE_MANIFEST_VERSION, "page_token": None, "folders": {}}
+
+def load_drive_manifest():
+    """Lee el manifiesto de Drive; si no existe, está dañado o es de otra versión, devuelve uno vacío"""
+    if not os.path.exists(DRIVE_MANIFEST_PATH):
+        return empty_drive_manifest()
+    try:
+        with open(DRIVE_MANIFEST_PATH, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except Exception as e:
+        log(f"No se pudo leer el manifiesto de Drive {DRIVE_MANIFEST_PATH}: {e}")
+        return empty_drive_manifest()
+    if manifest.get("version") != DRIVE_MANIFEST_VERSION:
+        log(f"Manifiesto de Drive con versión distinta de {DRIVE_MANIFEST_VERSION}; se vuelven a listar las carpetas")
+        return empty_drive_manifest()
+    return manifest
+
+def save_drive_manifest(manifest):
+    """Escribe el manifiesto de Drive de forma atómica (archivo temporal + reemplazo)"""
+    directory = os.path.dirname(os.path.abspath(DRIVE_MANIFEST_PATH))
+    fd, tmp_path = tempfile.mkstemp(prefix=".drive_manifest_", suffix=".json", dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, DRIVE_MANIFEST_PATH)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def clear_drive_manifest():
+    """Borra el manifiesto para que la próxima consulta vuelva a listar las carpetas completas"""
+    with _drive_manifest_lock:
+        if os.path.exists(DRIVE_MANIFEST_PATH):
+            os.remove(DRIVE_MANIFEST_PATH)
+    log(f"Manifiesto de Drive borrado ({DRIVE_MANIFEST_PATH})")
+
+def drive_manifest_entry(file):
+    return {key: file.get(key) for key in ("name", "mimeType", "md5Checksum", "modifiedTime", "size")}
+
+def fetch_drive_changes(service, page_token):
+    """Lee el feed de cambios de Drive desde page_token. Devuelve (cambios, token para la próxima lectura)"""
+    changes = []
+    next_start_token = page_token
+    while page_token:
+        results = service.changes().list(
+            pageToken=page_token, pageSize=1000, includeRemoved=True, spaces='drive',
+            fields=f"nextPageToken, newStartPageToken, changes(fileId, removed, file({DRIVE_FILE_FIELDS}, parents, trashed))"
+        ).execute()
+        changes.extend(results.get('changes', []))
+        page_token = results.get('nextPageToken')
+        if 'newStartPageToken' in results:
+            next_start_token = results['newStartPageToken']
+    return changes, next_start_token
+
+def apply_drive_changes(manifest, changes):
+    """
+    Aplica al manifiesto los cambios leídos del feed de Drive: altas, cambios de nombre o
+    contenido, movimientos entre carpetas y eliminaciones. Devuelve True si alguna carpeta cambió.
+    """
+    modified = False
+    for change in changes:
+        file = change.get('file') or {}
+        parents = set(file.get('parents') or ())
+        is_cv = not change.get('removed') and not file.get('trashed') and file.get('mimeType') in CV_MIME_TYPES
+        for folder_id, files in manifest["folders"].items():
+            if is_cv and folder_id in parents:
+                entry = drive_manifest_entry(file)
+                if files.get(change['fileId']) != entry:
+                    files[change['fileId']] = entry
+                    modified = True
+            elif files.pop(change['fileId'], None) is not None:
+                modified = True
+    return modified
+
+def get_drive_folder_files(folder_id, creds_path):
+    """
+    Archivos CV de una carpeta de Drive, del más reciente al más antiguo. La primera vez se lista
+    la carpeta completa y se guarda en el manifiesto; después solo se consulta el feed de cambios.
+    """
+    service = get_drive_service(creds_path)
+    if not DRIVE_MANIFEST_ENABLED:
+        files = list_cv_files_in_folder(service, folder_id)
+        return sorted(files, key=lambda f: f.get('modifiedTime') or "", reverse=True)
+    
+    # Las consultas a Drive se hacen fuera del lock y su resultado se combina después con el
+    # manifiesto vigente; solo se escribe si algo cambió
+    while True:
+        with _drive_manifest_lock:
+            snapshot = load_drive_manifest()
+        page_token = snapshot["page_token"]
+        changes, next_token = [], page_token
+        if page_token:
+            try:
+                changes, next_token = fetch_drive_changes(service, page_token)
+            except Exception as e:
+                log(f"No se pudo leer el feed de cambios de Drive ({e}); se vuelven a listar las carpetas")
+                page_token = None
+        if not page_token:
+            # El token se pide antes de listar para no perder los cambios que ocurran mientras tanto
+            next_token = service.changes().getStartPageToken().execute()['startPageToken']
+        listing = None
+        if not page_token or folder_id not in snapshot["folders"]:
+            listing = list_cv_files_in_folder(service, folder_id)
+        
+        with _drive_manifest_lock:
+            manifest = load_drive_manifest()
+            modified = False
+            if manifest["page_token"] == snapshot["page_token"]:
+                if page_token:
+                    modified = apply_drive_changes(manifest, changes)
+                    count_stat("drive_changes", len(changes))
+                    log(f"Manifiesto de Drive actualizado con {len(changes)} cambios")
+                else:
+                    manifest = empty_drive_manifest()
+                modified = modified or manifest["page_token"] != next_token
+                manifest["page_token"] = next_token
+            # Si no, otro hilo o proceso ya avanzó el manifiesto con cambios más recientes que los leídos aquí
+            
+            if folder_id not in manifest["folders"]:
+                if listing is None:
+                    # El manifiesto se vació mientras tanto: se vuelve a empezar
+                    continue
+                manifest["folders"][folder_id] = {file['id']: drive_manifest_entry(file) for file in listing}
+                modified = True
+                count_stat("drive_full_listings")
+                log(f"Carpeta de Drive {folder_id} listada completa ({len(listing)} archivos)")
+            
+            if modified:
+                save_drive_manifest(manifest)
+            files = [dict(entry, id=file_id) for file_id, entry in manifest["folders"][folder_id].items()]
+        return sorted(files, key=lambda f: f.get('modifiedTime') or "", reverse=True)
+
+class DriveFolderIndex:
+    """
+    Vista de los CVs de una carpeta de Drive indexada por md5Checksum y por nombre, construida
+    a partir del manifiesto y actualizada con cada subida. Las comprobaciones de existencia son
+    búsquedas en un diccionario y un CV con el mismo contenido que otro ya subido (aunque tenga
+    otro nombre) no se vuelve a subir. El índice se da por bueno (se rehace con el feed de cambios
+    pasados DRIVE_INDEX_MAX_AGE segundos); un archivo que resulta no existir al reutilizarlo se
+    quita con forget_drive_file.
+    """
+    
+    def __init__(self, folder_id, creds_path):
+        self.folder_id = folder_id
+        self.by_md5 = {}
+        self.by_name = {}
+        self.content_locks = {}
+        self.lock = threading.Lock()
+        # La lista viene del más reciente al más antiguo: ante duplicados gana el más reciente
+        for file in reversed(get_drive_folder_files(folder_id, creds_path)):
+            self.add(file['id'], file['name'], file.get('md5Checksum'))
+        self.built = time.monotonic()
+    
+    def add(self, file_id, name, md5=None):
+        with self.lock:
+            self.by_name[name] = file_id
+            if md5:
+                self.by_md5[md5] = file_id
+    
+    def forget(self, file_id):
+        """Quita del índice un archivo que ya no está en la carpeta"""
+        with self.lock:
+            for table in (self.by_md5, self.by_name):
+                for key in [key for key, value in table.items() if value == file_id]:
+                    del table[key]
+    
+    @contextlib.contextmanager
+    def content_lock(self, md5):
+        """
+        Lock por contenido para que dos subidas del mismo archivo no se hagan a la vez; se
+        elimina cuando ya no lo usa ninguna subida
+        """
+        with self.lock:
+            entry = self.content_locks.setdefault(md5, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self.lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self.content_locks[md5]
+    
+    def find(self, name=None, md5=None):
+        """ID del archivo con ese contenido (md5) o, si no hay ninguno, con ese nombre; None si no existe"""
+        with self.lock:
+            if md5 and md5 in self.by_md5:
+                return self.by_md5[md5]
+            return self.by_name.get(name)
+
+_drive_folder_indexes = {}
+_drive_folder_index_builds = {}
+_drive_folder_indexes_lock = threading.Lock()
+
+def get_drive_folder_index(folder_id, creds_path):
+    """
+    DriveFolderIndex de la carpeta (se reconstruye desde el manifiesto pasados DRIVE_INDEX_MAX_AGE
+    segundos). El índice se construye fuera del lock global, con un lock por carpeta, para que
+    listar una carpeta no bloquee a las demás.
+    """
+    key = (folder_id, creds_path)
+    
+    def fresh_index():
+        index = _drive_folder_indexes.get(key)
+        if index is not None and time.monotonic() - index.built <= DRIVE_INDEX_MAX_AGE:
+            return index
+        return None
+    
+    with _drive_folder_indexes_lock:
+        index = fresh_index()
+        if index is not None:
+            return index
+        build_lock = _drive_folder_index_builds.setdefault(key, threading.Lock())
+    with build_lock:
+        # Otro hilo pudo construirlo mientras se esperaba el lock de la carpeta
+        with _drive_folder_indexes_lock:
+            index = fresh_index()
+        if index is None:
+            index = DriveFolderIndex(folder_id, creds_path)
+            with _drive_folder_indexes_lock:
+                _drive_folder_indexes[key] = index
+        return index
+
+def forget_drive_file(file_id):
+    """Quita de los índices de carpetas un archivo que ya no existe en Drive"""
+    with _drive_folder_indexes_lock:
+        indexes = list(_drive_folder_indexes.values())
+    for index in indexes:
+        index.forget(file_id)
+    count_stat("drive_index_stale")
+
+def file_md5(path):
+    """md5 del contenido de un archivo local (el mismo valor que md5Checksum en Drive)"""
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def drive_query_literal(value):
+    """Cadena entre comillas simples para una consulta q de Drive (escapa las comillas y las barras)"""
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
 # === NUEVA PARTE: subir archivos a Google Drive y hacer públicos ===
-def check_file_exists_in_drive(filename, drive_folder_id, creds_path):
-    """Verifica si un archivo ya existe en Google Drive y devuelve su ID si existe"""
-    scopes = ['https://www.googleapis.com/auth/drive']
-    creds = Credentials.from_service_account_file(creds_path, scopes=scopes)
-    service = build('drive', 'v3', credentials=creds)
+def check_file_exists_in_drive(filename, drive_folder_id, creds_path, md5=None):
+    """
+    Verifica si un archivo ya existe en Google Drive (con el mismo contenido, si se da su md5,
+    o con el mismo nombre) y devuelve su ID si existe
+    """
+    # Los CVs se buscan en el índice de la carpeta, sin consultar a Drive
+    if filename.lower().endswith(('.pdf', '.docx')):
+        return get_drive_folder_index(drive_folder_id, creds_path).find(filename, md5)
+    
+    service = get_drive_service(creds_path)
     
     # Buscar el archivo por nombre en la carpeta específica
-    query = f"name='{filename}' and '{drive_folder_id}' in parents and trashed=false"
+    query = f"name={drive_query_literal(filename)} and '{drive_folder_id}' in parents and trashed=false"
     results = service.files().list(q=query, fields="files(id, name)").execute()
     files = results.get('files', [])
     
@@ -532,42 +3125,68 @@ def check_file_exists_in_drive(filename, drive_folder_id, creds_path):
     return None
 
 def upload_file_to_drive(filepath, filename, drive_folder_id, creds_path):
-    """Sube archivo a Google Drive y devuelve la URL pública. Si el archivo ya existe, devuelve su URL."""
-    # Verificar si el archivo ya existe en Drive
-    existing_file_id = check_file_exists_in_drive(filename, drive_folder_id, creds_path)
-    
-    if existing_file_id:
-        # Si el archivo ya existe, devolver su URL
-        url = f"https://drive.google.com/file/d/{existing_file_id}/view?usp=sharing"
-        log(f"El archivo {filename} ya existe en Drive, usando URL existente")
-        return url
-    
-    # Si no existe, subir el archivo
-    scopes = ['https://www.googleapis.com/auth/drive']
-    creds = Credentials.from_service_account_file(creds_path, scopes=scopes)
-    service = build('drive', 'v3', credentials=creds)
-    file_metadata = {
-        'name': filename,
-        'parents': [drive_folder_id]
-    }
-    media = MediaFileUpload(filepath, resumable=True)
-    uploaded = service.files().create(body=file_metadata, media_body=media, fields='id').execute()
-    file_id = uploaded.get('id')
-    # Hacer el archivo público (cualquiera con el link puede ver)
-    service.permissions().create(fileId=file_id, body={'role': 'reader', 'type': 'anyone'}).execute()
+    """
+    Sube archivo a Google Drive y devuelve la URL pública. Si el archivo (o uno con el mismo
+    contenido) ya existe, devuelve su URL.
+    """
+    md5 = file_md5(filepath)
+    is_cv = filename.lower().endswith(('.pdf', '.docx'))
+    # Dos subidas simultáneas del mismo contenido: la segunda espera y reutiliza la primera
+    content_lock = get_drive_folder_index(drive_folder_id, creds_path).content_lock(md5) if is_cv else contextlib.nullcontext()
+    with content_lock:
+        # Verificar si el archivo ya existe en Drive
+        existing_file_id = check_file_exists_in_drive(filename, drive_folder_id, creds_path, md5)
+        
+        if existing_file_id:
+            # Si el archivo ya existe, devolver su URL. Dentro de drive_batching el permiso público se
+            # vuelve a dar en el siguiente batch: si el archivo ya no existe, el permiso falla y el CV
+            # queda sin procesar (ver confirm_public_links)
+            batcher = _drive_batcher.get()
+            grants = _public_link_grants.get()
+            if batcher is not None and grants is not None:
+                grants.append((existing_file_id, batcher.make_public(existing_file_id, filename)))
+            url = f"https://drive.google.com/file/d/{existing_file_id}/view?usp=sharing"
+            log(f"El archivo {filename} ya existe en Drive, usando URL existente")
+            return url
+        
+        # Si no existe, subir el archivo
+        service = get_drive_service(creds_path)
+        file_metadata = {
+            'name': filename,
+            'parents': [drive_folder_id]
+        }
+        media = MediaFileUpload(filepath, resumable=True)
+        uploaded = service.files().create(body=file_metadata, media_body=media, fields='id, md5Checksum').execute()
+        file_id = uploaded.get('id')
+        if is_cv:
+            get_drive_folder_index(drive_folder_id, creds_path).add(file_id, filename, uploaded.get('md5Checksum') or md5)
+    
+    # Hacer el archivo público (cualquiera con el link puede ver); dentro de drive_batching va en el
+    # siguiente batch y el resultado queda en los permisos pendientes del CV (ver public_link_grants)
+    batcher = _drive_batcher.get()
+    if batcher is not None:
+        grant = batcher.make_public(file_id, filename)
+        grants = _public_link_grants.get()
+        if grants is not None:
+            grants.append((file_id, grant))
+    else:
+        make_file_public(file_id, creds_path)
     # Obtener link directo
     url = f"https://drive.google.com/file/d/{file_id}/view?usp=sharing"
     log(f"Archivo {filename} subido a Drive con éxito")
     return url
 
+def make_file_public(file_id, creds_path):
+    """Da permiso de lectura a cualquiera con el link"""
+    service = get_drive_service(creds_path)
+    service.permissions().create(fileId=file_id, body={'role': 'reader', 'type': 'anyone'}).execute()
+
 def create_folder_in_drive(folder_name, parent_folder_id, creds_path):
     """Crea una carpeta en Google Drive y devuelve su ID"""
-    scopes = ['https://www.googleapis.com/auth/drive']
-    creds = Credentials.from_service_account_file(creds_path, scopes=scopes)
-    service = build('drive', 'v3', credentials=creds)
+    service = get_drive_service(creds_path)
     
     # Verificar si la carpeta ya existe
-    query = f"name='{folder_name}' and '{parent_folder_id}' in parents and mimeType='application/vnd.google-apps.folder' and trashed=false"
+    query = f"name={drive_query_literal(folder_name)} and '{parent_folder_id}' in parents and mimeType='application/vnd.google-apps.folder' and trashed=false"
     results = service.files().list(q=query, fields="files(id, name)").execute()
     folders = results.get('files', [])
     
@@ -586,9 +3205,7 @@ def create_folder_in_drive(folder_name, parent_folder_id, creds_path):
 
 def move_file_in_drive(file_id, destination_folder_id, creds_path):
     """Mueve un archivo de una carpeta a otra en Google Drive"""
-    scopes = ['https://www.googleapis.com/auth/drive']
-    creds = Credentials.from_service_account_file(creds_path, scopes=scopes)
-    service = build('drive', 'v3', credentials=creds)
+    service = get_drive_service(creds_path)
     
     # Obtener las carpetas actuales del archivo
     file = service.files().get(fileId=file_id, fields='parents').execute()
@@ -604,35 +3221,178 @@ def move_file_in_drive(file_id, destination_folder_id, creds_path):
     
     return file
 
+# === Operaciones de Drive agrupadas en peticiones batch ===
+def is_retryable_drive_error(error):
+    """True si el error de Drive es temporal: límite de cuota (403/429) o error del servidor"""
+    status = getattr(getattr(error, "resp", None), "status", None)
+    if status in (429, 500, 502, 503, 504):
+        return True
+    return status == 403 and "ratelimitexceeded" in str(error).lower()
+
+class DriveBatcher:
+    """
+    Acumula operaciones de Drive que no necesitan respuesta inmediata (movimientos a la carpeta
+    de procesados, permisos públicos) y las envía por el endpoint batch de Drive, hasta
+    DRIVE_BATCH_SIZE por petición HTTP. Se envían al llenarse un batch y al llamar a flush().
+    Cada operación devuelve un Future con la respuesta, o con el error si falló.
+    """
+    
+    def __init__(self, creds_path, batch_size=DRIVE_BATCH_SIZE):
+        self.creds_path = creds_path
+        self.batch_size = batch_size
+        self.pending = []
+        self.lock = threading.Lock()
+    
+    def add(self, description, make_request):
+        """
+        Encola una operación y devuelve su Future; make_request(service) construye la petición y
+        description se usa en los logs
+        """
+        future = Future()
+        with self.lock:
+            self.pending.append((description, make_request, future))
+            if len(self.pending) < self.batch_size:
+                return future
+            operations, self.pending = self.pending, []
+        self.execute(operations)
+        return future
+    
+    def move(self, file_id, destination_folder_id, source_folder_id, description=None):
+        """Mueve el archivo de source_folder_id a destination_folder_id (sin consultar antes sus carpetas)"""
+        return self.add(description or file_id, lambda service: service.files().update(
+            fileId=file_id, addParents=destination_folder_id, removeParents=source_folder_id, fields='id'
+        ))
+    
+    def make_public(self, file_id, description=None):
+        """Permiso de lectura para cualquiera con el link"""
+        return self.add(description or file_id, lambda service: service.permissions().create(
+            fileId=file_id, body={'role': 'reader', 'type': 'anyone'}, fields='id'
+        ))
+    
+    def flush(self):
+        with self.lock:
+            operations, self.pending = self.pending, []
+        if operations:
+            self.execute(operations)
+    
+    def discard(self):
+        """Descarta las operaciones pendientes sin enviarlas (sus Futures quedan cancelados)"""
+        with self.lock:
+            operations, self.pending = self.pending, []
+        for _, _, future in operations:
+            future.cancel()
+        if operations:
+            log(f"Descartadas {len(operations)} operaciones de Drive pendientes")
+    
+    def execute(self, operations):
+        """Envía las operaciones en un batch y reintenta (con backoff) las que fallan por errores temporales"""
+        service = get_drive_service(self.creds_path)
+        total = len(operations)
+        for attempt in range(DRIVE_BATCH_MAX_RETRIES + 1):
+            failed = []
+            last_error = None
+            
+            def callback(request_id, response, exception):
+                nonlocal last_error
+                description, _, future = operations[int(request_id)]
+                if future.done():
+                    return
+                if exception is None:
+                    count_stat("drive_batch_operations")
+                    future.set_result(response)
+                elif is_retryable_drive_error(exception) and attempt < DRIVE_BATCH_MAX_RETRIES:
+                    failed.append(operations[int(request_id)])
+                    last_error = exception
+                else:
+                    count_stat("drive_batch_errors")
+                    log(f"Error en la operación de Drive ({description}): {exception}")
+                    future.set_exception(exception)
+            
+            batch = service.new_batch_http_request(callback=callback)
+            for i, (_, make_request, _) in enumerate(operations):
+                batch.add(make_request(service), request_id=str(i))
+            try:
+                batch.execute()
+                count_stat("drive_batch_requests")
+            except Exception as e:
+                # Las operaciones cuya respuesta ya llegó antes del error no se vuelven a enviar
+                unsent = [operation for operation in operations if not operation[2].done()]
+                if attempt >= DRIVE_BATCH_MAX_RETRIES:
+                    count_stat("drive_batch_errors", len(unsent))
+                    log(f"Error al enviar un batch de {len(unsent)} operaciones de Drive: {e}")
+                    for _, _, future in unsent:
+                        future.set_exception(e)
+                    return
+                failed, last_error = unsent, e
+            if not failed:
+                log(f"Batch de Drive enviado: {total} operaciones")
+                return
+            log(f"Reintentando {len(failed)} operaciones de Drive ({last_error})")
+            operations = failed
+            time.sleep(retry_delay(last_error, attempt))
+
+_drive_batcher = contextvars.ContextVar("drive_batcher", default=None)
+
+@contextlib.contextmanager
+def drive_batching(creds_path):
+    """
+    Agrupa en batches los movimientos y permisos de Drive hechos dentro del bloque; al salir se
+    envía el resto. Si el bloque termina con un error, lo pendiente se descarta sin enviarse.
+    """
+    batcher = DriveBatcher(creds_path)
+    token = _drive_batcher.set(batcher)
+    try:
+        yield batcher
+    except BaseException:
+        batcher.discard()
+        raise
+    else:
+        batcher.flush()
+    finally:
+        _drive_batcher.reset(token)
+
+_public_link_grants = contextvars.ContextVar("public_link_grants", default=None)
+
+@contextlib.contextmanager
+def public_link_grants():
+    """Recoge (ID del archivo, Future) de los permisos públicos encolados en drive_batching dentro del bloque"""
+    grants = []
+    token = _public_link_grants.set(grants)
+    try:
+        yield grants
+    finally:
+        _public_link_grants.reset(token)
+
+def confirm_public_links(grants, creds_path):
+    """
+    Comprueba los permisos públicos de public_link_grants (ya enviados) y reintenta directamente
+    los que fallaron. Devuelve False si algún archivo sigue sin ser público.
+    """
+    for file_id, grant in grants:
+        if not grant.cancelled() and grant.exception() is None:
+            continue
+        try:
+            make_file_public(file_id, creds_path)
+        except Exception as e:
+            log(f"Error al hacer público el archivo {file_id} en Google Drive: {e}")
+            if getattr(getattr(e, "resp", None), "status", None) == 404:
+                # El índice lo daba por existente: la próxima subida no lo reutilizará
+                forget_drive_file(file_id)
+            return False
+    return True
+
 def get_processed_files_from_drive(processed_folder_id, creds_path):
     """Obtiene la lista de archivos en la carpeta de procesados en Google Drive"""
-    scopes = ['https://www.googleapis.com/auth/drive']
-    creds = Credentials.from_service_account_file(creds_path, scopes=scopes)
-    service = build('drive', 'v3', credentials=creds)
-    
     # Listar archivos en la carpeta de procesados
-    query = f"'{processed_folder_id}' in parents and (mimeType='application/pdf' or mimeType='application/vnd.openxmlformats-officedocument.wordprocessingml.document') and trashed=false"
-    results = service.files().list(q=query, fields="files(id, name)", pageSize=1000).execute()
-    files = results.get('files', [])
+    files = get_drive_folder_files(processed_folder_id, creds_path)
     
     # Obtener solo los nombres de los archivos
     processed_files = [file['name'] for file in files]
     return processed_files
 
-def download_files_from_drive(drive_folder_id, processed_folder_id, local_folder, creds_path, already_processed_files):
-    """Descarga solo los archivos PDF y DOCX no procesados de una carpeta de Google Drive a una carpeta local"""
-    if not os.path.exists(local_folder):
-        os.makedirs(local_folder, exist_ok=True)
-        
-    scopes = ['https://www.googleapis.com/auth/drive']
-    creds = Credentials.from_service_account_file(creds_path, scopes=scopes)
-    service = build('drive', 'v3', credentials=creds)
-    
-    # Listar archivos en la carpeta de Drive
-    query = f"'{drive_folder_id}' in parents and (mimeType='application/pdf' or mimeType='application/vnd.openxmlformats-officedocument.wordprocessingml.document') and trashed=false"
-    results = service.files().list(q=query, fields="files(id, name, mimeType)").execute()
-    files = results.get('files', [])
-    
+def list_new_drive_cvs(drive_folder_id, creds_path, already_processed_files):
+    """CVs (PDF y DOCX) de la carpeta de Drive que aún no se han procesado, uno por nombre de archivo"""
+    files = get_drive_folder_files(drive_folder_id, creds_path)
     if not files:
         log(f"No se encontraron archivos PDF o DOCX en la carpeta de Drive {drive_folder_id}")
         return []
@@ -640,70 +3400,193 @@ def download_files_from_drive(drive_folder_id, processed_folder_id, local_folder
     # Eliminar duplicados por nombre de archivo
     unique_files = {}
     for file in files:
-        # Si hay archivos con el mismo nombre, quedarse con el más reciente (asumiendo que está primero en la lista)
+        # Si hay archivos con el mismo nombre, quedarse con el más reciente (la lista viene ordenada por fecha)
         if file['name'] not in unique_files:
             unique_files[file['name']] = file
     
-    files = list(unique_files.values())
-    
     # Filtrar archivos ya procesados
-    files_to_download = []
-    for file in files:
-        if file['name'] not in already_processed_files:
-            files_to_download.append(file)
-    
+    already_processed_files = set(already_processed_files)
+    files_to_download = [file for file in unique_files.values() if file['name'] not in already_processed_files]
     log(f"Se encontraron {len(files_to_download)} archivos nuevos para descargar de Google Drive")
-    downloaded_files = []
+    return files_to_download
+
+# CV descargado: en memoria (data) o en disco (data es None y el contenido está en path)
+DownloadedCV = namedtuple("DownloadedCV", ["name", "id", "path", "data"])
+
+def download_drive_file(file, local_folder, creds_path, spill_bytes=DOWNLOAD_SPILL_BYTES):
+    """
+    Descarga un archivo de Drive. Si ocupa más de spill_bytes (0 = siempre) se escribe en
+    local_folder; si no, se queda en memoria. Una copia local con contenido no se vuelve a descargar.
+    """
+    local_path = os.path.join(local_folder, file['name'])
+    if os.path.exists(local_path) and os.path.getsize(local_path) > 0:
+        log(f"El archivo {file['name']} ya existe y tiene contenido, omitiendo descarga")
+        return DownloadedCV(file['name'], file['id'], local_path, None)
     
-    for file in files_to_download:
-        file_id = file['id']
-        file_name = file['name']
-        local_path = os.path.join(local_folder, file_name)
-        
-        # Verificar si el archivo ya existe y tiene contenido
-        if os.path.exists(local_path) and os.path.getsize(local_path) > 0:
-            log(f"El archivo {file_name} ya existe y tiene contenido, omitiendo descarga")
-            downloaded_files.append({"path": local_path, "id": file_id})
-            continue
-        
-        try:
-            # Descargar el archivo
-            log(f"Descargando archivo {file_name}...")
-            
-            # Método 1: Usando MediaIoBaseDownload
-            request = service.files().get_media(fileId=file_id)
+    spill = int(file.get('size') or 0) > spill_bytes
+    request = get_drive_service(creds_path).files().get_media(fileId=file['id'])
+    buffer = open(local_path, 'wb') if spill else io.BytesIO()
+    with buffer:
+        downloader = MediaIoBaseDownload(buffer, request)
+        done = False
+        while not done:
+            _, done = downloader.next_chunk()
+        data = None if spill else buffer.getvalue()
+    size = os.path.getsize(local_path) if spill else len(data)
+    
+    if size == 0:
+        log(f"El archivo descargado {file['name']} está vacío, intentando método alternativo...")
+        # Método alternativo: descarga directa usando requests
+        import requests
+        response = requests.get(f"https://drive.google.com/uc?export=download&id={file['id']}")
+        data = response.content
+        size = len(data)
+        if spill:
             with open(local_path, 'wb') as f:
-                downloader = MediaIoBaseDownload(f, request)
-                done = False
-                while not done:
-                    status, done = downloader.next_chunk()
-                    log(f"Descarga {int(status.progress() * 100)}%")
-            
-            # Verificar que el archivo no esté vacío
-            if os.path.getsize(local_path) == 0:
-                log(f"El archivo descargado {file_name} está vacío, intentando método alternativo...")
-                
-                # Método 2: Descarga directa usando requests
-                import requests
-                url = f"https://drive.google.com/uc?export=download&id={file_id}"
-                response = requests.get(url)
-                with open(local_path, 'wb') as f:
-                    f.write(response.content)
-                
-                # Verificar nuevamente
-                if os.path.getsize(local_path) == 0:
-                    log(f"No se pudo descargar el archivo {file_name} correctamente")
-                    continue
-            
-            log(f"Archivo {file_name} descargado correctamente ({os.path.getsize(local_path)} bytes)")
-            downloaded_files.append({"path": local_path, "id": file_id})
-        except Exception as e:
-            log(f"Error al descargar el archivo {file_name}: {e}")
+                f.write(data)
+            data = None
+        if size == 0:
+            raise ValueError(f"No se pudo descargar el archivo {file['name']} correctamente")
+    
+    count_stat("drive_downloads")
+    count_stat("drive_download_bytes", size)
+    log(f"Archivo {file['name']} descargado correctamente ({size} bytes{', en disco' if spill else ''})")
+    return DownloadedCV(file['name'], file['id'], local_path, data)
+
+def download_files_from_drive(drive_folder_id, processed_folder_id, local_folder, creds_path, already_processed_files):
+    """Descarga a la carpeta local, en paralelo, solo los archivos PDF y DOCX no procesados de una carpeta de Google Drive"""
+    if not os.path.exists(local_folder):
+        os.makedirs(local_folder, exist_ok=True)
+    
+    files_to_download = list_new_drive_cvs(drive_folder_id, creds_path, already_processed_files)
+    if not files_to_download:
+        return []
     
+    downloaded_files = []
+    with ThreadPoolExecutor(max_workers=max(1, min(DOWNLOAD_WORKERS, len(files_to_download)))) as executor:
+        futures = {
+            executor.submit(download_drive_file, file, local_folder, creds_path, 0): file
+            for file in files_to_download
+        }
+        for future in as_completed(futures):
+            try:
+                cv = future.result()
+            except Exception as e:
+                log(f"Error al descargar el archivo {futures[future]['name']}: {e}")
+                continue
+            downloaded_files.append({"path": cv.path, "id": cv.id})
     return downloaded_files
 
-def process_cv(cv_path, qs_list, drive_folder_id, creds_path):
+class CVFetcher:
+    """
+    Entrega el contenido de los CVs de una ejecución a los workers. Los CVs de Drive se descargan
+    en paralelo (DOWNLOAD_WORKERS hilos) en el orden en que se van a procesar, como mucho
+    DOWNLOAD_AHEAD por delante de los que ya se han pedido, de modo que la descarga y la
+    extracción se solapan. Los archivos que no vienen de Drive se leen de la carpeta local.
+    """
+    
+    def __init__(self, folder_path, creds_path, drive_files=(), order=(), file_ids=None):
+        self.folder_path = folder_path
+        self.creds_path = creds_path
+        self.drive_files = {file['name']: file for file in drive_files}
+        self.file_ids = dict(file_ids or {})
+        self.file_ids.update({name: file['id'] for name, file in self.drive_files.items()})
+        self.pending = deque(name for name in order if name in self.drive_files)
+        self.futures = {}
+        self.texts = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) if self.drive_files else None
+        with self.lock:
+            self._fill()
+    
+    def _submit(self, fname):
+        self.futures[fname] = self.executor.submit(
+            download_drive_file, self.drive_files[fname], self.folder_path, self.creds_path
+        )
+    
+    def _fill(self):
+        """Lanza descargas en orden hasta tener DOWNLOAD_AHEAD pendientes de recoger"""
+        while self.pending and len(self.futures) < DOWNLOAD_AHEAD:
+            fname = self.pending.popleft()
+            if fname not in self.futures:
+                self._submit(fname)
+    
+    def fetch(self, fname):
+        """DownloadedCV del archivo; espera a su descarga (o la lanza si no estaba prevista)"""
+        with self.lock:
+            future = self.futures.pop(fname, None)
+            if future is None and fname in self.drive_files:
+                if fname in self.pending:
+                    self.pending.remove(fname)
+                self._submit(fname)
+                future = self.futures.pop(fname)
+            self._fill()
+        if future is None:
+            return DownloadedCV(fname, self.file_ids.get(fname), os.path.join(self.folder_path, fname), None)
+        return future.result()
+    
+    def extract_text(self, fname):
+        """Texto del CV (el que dejó keep_text, o descargándolo y extrayéndolo); los bytes se liberan al terminar"""
+        with self.lock:
+            if fname in self.texts:
+                return self.texts.pop(fname)
+        cv = self.fetch(fname)
+        return extract_cv_text(cv.path, cv.data)
+    
+    def keep_text(self, fname, text):
+        """Guarda el texto ya extraído para que el procesamiento del CV no lo vuelva a extraer"""
+        with self.lock:
+            self.texts[fname] = text
+    
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+def extract_cv_text(cv_path, data=None):
+    """
+    Extrae el texto de un CV según su extensión (de memoria si se pasan sus bytes en data), hasta
+    PDF_TEXT_CHAR_BUDGET o DOCX_TEXT_CHAR_BUDGET caracteres; devuelve None si el formato no está soportado
+    """
+    if cv_path.lower().endswith('.pdf'):
+        return extract_text_from_pdf(cv_path, PDF_TEXT_CHAR_BUDGET, data)
+    elif cv_path.lower().endswith('.docx'):
+        return extract_text_from_docx(cv_path, DOCX_TEXT_CHAR_BUDGET, data)
+    log(f"Formato de archivo no soportado: {cv_path}")
+    return None
+
+def build_fallback_cv_data(cv_path, filename):
+    """Crea los datos mínimos de un CV sin texto extraíble a partir del nombre del archivo"""
+    log(f"Advertencia: Archivo con poco o ningún texto extraíble: {cv_path}. Usando nombre de archivo como fallback.")
+    # Crear datos básicos a partir del nombre del archivo
+    name_from_file = os.path.splitext(filename)[0]
+    name_from_file = name_from_file.replace("_", " ").replace("-", " ")
+    
+    # Crear un conjunto mínimo de datos
+    return {
+        "Nombre completo": name_from_file,
+        "Correo electrónico profesional": "No encontrado",
+        "LinkedIn URL": "No encontrado",
+        "Teléfono": "No encontrado",
+        "País de residencia o nacionalidad": "No encontrado",
+        "Universidad doctorado": "No encontrado",
+        "Subject": "No encontrado",
+        "Area": "No encontrado",
+        "QS Rank": "No encontrado"
+    }
+
+def get_cv_drive_url(cv_path, filename, drive_folder_id, creds_path, drive_file_id=None):
+    """Link del CV en Drive: directo si ya se conoce su ID (CVs descargados de Drive); si no, se sube"""
+    if drive_file_id:
+        return f"https://drive.google.com/file/d/{drive_file_id}/view?usp=sharing"
+    return upload_file_to_drive(cv_path, filename, drive_folder_id, creds_path)
+
+def process_cv(cv_path, qs_list, drive_folder_id, creds_path, extraction_mode=None, cv_text=None, drive_file_id=None):
+    """
+    Procesa un CV. cv_text permite pasar el texto ya extraído (p. ej. de un CV descargado en
+    memoria que no está en disco) y drive_file_id evita subir un CV que ya está en Drive.
+    """
     log(f"Procesando archivo: {cv_path}")
+    extraction_mode = extraction_mode or EXTRACTION_MODE
     filename = os.path.basename(cv_path)
     
     # Verificar si es un archivo de prueba (test_cv)
@@ -712,37 +3595,17 @@ def process_cv(cv_path, qs_list, drive_folder_id, creds_path):
         return None
     
     # Extraer texto del CV
-    cv_text = ""
-    if cv_path.lower().endswith('.pdf'):
-        cv_text = extract_text_from_pdf(cv_path)
-    elif cv_path.lower().endswith('.docx'):
-        cv_text = extract_text_from_docx(cv_path)
-    else:
-        log(f"Formato de archivo no soportado: {cv_path}")
+    if cv_text is None:
+        cv_text = extract_cv_text(cv_path)
+    if cv_text is None:
         return None
     
     # Si no se pudo extraer texto, usar el nombre del archivo como fallback
     if not cv_text.strip():
-        log(f"Advertencia: Archivo con poco o ningún texto extraíble: {cv_path}. Usando nombre de archivo como fallback.")
-        # Crear datos básicos a partir del nombre del archivo
-        name_from_file = os.path.splitext(filename)[0]
-        name_from_file = name_from_file.replace("_", " ").replace("-", " ")
-        
-        # Crear un conjunto mínimo de datos
-        data = {
-            "Nombre completo": name_from_file,
-            "Correo electrónico profesional": "No encontrado",
-            "LinkedIn URL": "No encontrado",
-            "Teléfono": "No encontrado",
-            "País de residencia o nacionalidad": "No encontrado",
-            "Universidad doctorado": "No encontrado",
-            "Subject": "No encontrado",
-            "Area": "No encontrado",
-            "QS Rank": "No encontrado"
-        }
+        data = build_fallback_cv_data(cv_path, filename)
         
         # Subir CV a Google Drive y guardar el link
-        drive_url = upload_file_to_drive(cv_path, filename, drive_folder_id, creds_path)
+        drive_url = get_cv_drive_url(cv_path, filename, drive_folder_id, creds_path, drive_file_id)
         data["CV Link"] = drive_url
         data["CV FileName"] = filename
         
@@ -750,7 +3613,10 @@ def process_cv(cv_path, qs_list, drive_folder_id, creds_path):
         return data
     
     # Pasar el nombre del archivo para ayudar con la extracción del nombre
-    data = extract_basic_data_gpt(cv_text, filename)
+    if extraction_mode == "single-pass":
+        data = extract_data_and_area_gpt(cv_text, filename)
+    else:
+        data = extract_basic_data_gpt(cv_text, filename)
     
     # Buscar universidad en QS
     match_qs = match_university_qs(data.get("Universidad doctorado", ""), qs_list)
@@ -762,70 +3628,538 @@ def process_cv(cv_path, qs_list, drive_folder_id, creds_path):
         if not data[k]:
             data[k] = "No encontrado"
     
-    # Determinar el área de conocimiento
-    area = determine_knowledge_area(cv_text, data.get("Subject", ""), data.get("Universidad doctorado", ""))
-    data["Area"] = area
+    # Determinar el área de conocimiento (en modo single-pass ya viene en la respuesta)
+    if extraction_mode != "single-pass":
+        area = determine_knowledge_area(cv_text, data.get("Subject", ""), data.get("Universidad doctorado", ""))
+        data["Area"] = area
     
     # Subir CV a Google Drive y guardar el link
-    drive_url = upload_file_to_drive(cv_path, filename, drive_folder_id, creds_path)
+    drive_url = get_cv_drive_url(cv_path, filename, drive_folder_id, creds_path, drive_file_id)
     data["CV Link"] = drive_url
     data["CV FileName"] = filename
     
     log(f"Resultado para {filename}: {json.dumps(data, ensure_ascii=False)}")
     return data
 
-def process_all_cvs_in_folder(folder_path, qs_list, drive_folder_id, processed_folder_id, creds_path, service_account_file, spreadsheet_id, sheet_name, downloaded_files):
-    results = []
-    processed_files = set()  # Para evitar procesar duplicados
+async def process_cv_async(cv_path, qs_list, drive_folder_id, creds_path, extraction_mode=None, cv_text=None, drive_file_id=None):
+    """
+    Versión asíncrona de process_cv: la extracción de texto y la subida a Drive corren en hilos.
+    Los pasos son los mismos y en el mismo orden que en process_cv, así que las peticiones (y
+    sus claves de caché) coinciden con las del modo con hilos y el modo batch.
+    """
+    log(f"Procesando archivo: {cv_path}")
+    extraction_mode = extraction_mode or EXTRACTION_MODE
+    filename = os.path.basename(cv_path)
     
-    # Obtener lista de archivos PDF y DOCX
-    files = [f for f in os.listdir(folder_path) if f.lower().endswith(('.pdf', '.docx'))]
+    # Verificar si es un archivo de prueba (test_cv)
+    if "test_cv" in filename.lower():
+        log(f"Omitiendo archivo de prueba: {filename}")
+        return None
     
-    # Ordenar archivos para procesar primero los más grandes (suelen tener más información)
-    files.sort(key=lambda f: os.path.getsize(os.path.join(folder_path, f)), reverse=True)
+    # Extraer texto del CV
+    if cv_text is None:
+        cv_text = await asyncio.to_thread(extract_cv_text, cv_path)
+    if cv_text is None:
+        return None
     
-    # Crear un diccionario para mapear nombres de archivo a IDs de Drive
-    file_id_map = {os.path.basename(file["path"]): file["id"] for file in downloaded_files}
+    # Si no se pudo extraer texto, usar el nombre del archivo como fallback
+    if not cv_text.strip():
+        data = build_fallback_cv_data(cv_path, filename)
+        
+        # Subir CV a Google Drive y guardar el link
+        drive_url = await asyncio.to_thread(get_cv_drive_url, cv_path, filename, drive_folder_id, creds_path, drive_file_id)
+        data["CV Link"] = drive_url
+        data["CV FileName"] = filename
+        
+        log(f"Resultado para {filename} (usando fallback): {json.dumps(data, ensure_ascii=False)}")
+        return data
+    
+    # Pasar el nombre del archivo para ayudar con la extracción del nombre
+    if extraction_mode == "single-pass":
+        data = await extract_data_and_area_gpt_async(cv_text, filename)
+    else:
+        data = await extract_basic_data_gpt_async(cv_text, filename)
+    
+    # Buscar universidad en QS
+    match_qs = await match_university_qs_async(data.get("Universidad doctorado", ""), qs_list)
+    data["Universidad doctorado"] = match_qs["Universidad doctorado"]
+    data["QS Rank"] = match_qs["QS Rank"]
+    
+    # Asegurar que no hay valores vacíos
+    for k in data:
+        if not data[k]:
+            data[k] = "No encontrado"
+    
+    # Determinar el área de conocimiento con la universidad QS (en modo single-pass ya viene en la respuesta)
+    if extraction_mode != "single-pass":
+        area = await determine_knowledge_area_async(cv_text, data.get("Subject", ""), data.get("Universidad doctorado", ""))
+        data["Area"] = area
+    
+    # Subir CV a Google Drive y guardar el link
+    drive_url = await asyncio.to_thread(get_cv_drive_url, cv_path, filename, drive_folder_id, creds_path, drive_file_id)
+    data["CV Link"] = drive_url
+    data["CV FileName"] = filename
     
-    for fname in files:
+    log(f"Resultado para {filename}: {json.dumps(data, ensure_ascii=False)}")
+    return data
+
+def plan_cv_groups(files):
+    """Agrupa los archivos por nombre base (sin extensión) conservando el orden original"""
+    groups = {}
+    for idx, fname in enumerate(files):
         # Omitir archivos de prueba
         if "test_cv" in fname.lower():
             log(f"Omitiendo archivo de prueba: {fname}")
             continue
-        
-        # Verificar si ya se procesó un archivo con el mismo nombre base (sin extensión)
         base_name = os.path.splitext(fname)[0].lower()
-        if base_name in processed_files:
-            log(f"Omitiendo archivo duplicado: {fname}")
+        groups.setdefault(base_name, []).append((idx, fname))
+    return list(groups.values())
+
+def order_cv_files(folder_path, drive_files=()):
+    """
+    Archivos PDF y DOCX de la carpeta local y de drive_files en el orden de procesamiento: primero
+    los más grandes (suelen tener más información), con el tamaño de Drive para los que aún no se
+    han descargado. El modo batch usa el mismo orden para elegir el archivo de cada grupo.
+    """
+    sizes = {file['name']: int(file.get('size') or 0) for file in drive_files}
+    if os.path.isdir(folder_path):
+        for f in os.listdir(folder_path):
+            if f.lower().endswith(('.pdf', '.docx')) and f not in sizes:
+                sizes[f] = os.path.getsize(os.path.join(folder_path, f))
+    return sorted(sizes, key=sizes.get, reverse=True)
+
+def finish_processed_cv(fname, cv_path, processed_folder_id, creds_path, file_id_map, source_folder_id=None):
+    """Mueve el CV procesado a la carpeta de procesados en Drive y elimina la copia local"""
+    # Mover el archivo en Google Drive a la carpeta de procesados: dentro de drive_batching,
+    # si se conoce su carpeta de origen, el movimiento va en el siguiente batch
+    batcher = _drive_batcher.get()
+    if fname in file_id_map and batcher is not None and source_folder_id:
+        batcher.move(file_id_map[fname], processed_folder_id, source_folder_id, fname)
+    elif fname in file_id_map:
+        try:
+            file_id = file_id_map[fname]
+            move_file_in_drive(file_id, processed_folder_id, creds_path)
+            log(f"Archivo {fname} movido a la carpeta de procesados en Google Drive")
+        except Exception as e:
+            log(f"Error al mover el archivo {fname} en Google Drive: {e}")
+    
+    # Eliminar el archivo local después de procesarlo (los CVs descargados en memoria no tienen copia)
+    if not os.path.exists(cv_path):
+        return
+    try:
+        os.remove(cv_path)
+        log(f"Archivo local {fname} eliminado")
+    except Exception as e:
+        log(f"Error al eliminar el archivo local {fname}: {e}")
+
+def process_cv_group(group, fetcher, qs_list, drive_folder_id, creds_path, extraction_mode=None, packer=None):
+    """
+    Procesa los archivos de un mismo nombre base en orden hasta que uno produzca datos.
+    Devuelve (índice del archivo procesado, datos, nombre del archivo, permisos públicos
+    pendientes) o None si ninguno produjo datos. El archivo no se mueve ni se borra aquí: lo
+    hace collect_cv_outcome. Con un BasicDataPacker, los CVs cortos pasan por él al extraer su texto.
+    """
+    for pos, (idx, fname) in enumerate(group):
+        log(f"Procesando {fname}...")
+        cv_path = os.path.join(fetcher.folder_path, fname)
+        try:
+            cv_text = packer.extract_text(fetcher, fname) if packer else fetcher.extract_text(fname)
+        except Exception as e:
+            log(f"Error al descargar el archivo {fname}: {e}")
             continue
+        with cv_token_usage(fname), public_link_grants() as grants:
+            data = process_cv(cv_path, qs_list, drive_folder_id, creds_path, extraction_mode,
+                              cv_text, fetcher.file_ids.get(fname))
         
-        log(f"Procesando {fname}...")
-        cv_path = os.path.join(folder_path, fname)
-        data = process_cv(cv_path, qs_list, drive_folder_id, creds_path)
+        if not data:
+            continue
         
-        if data:
-            results.append(data)
-            processed_files.add(base_name)
-            
-            # Mover el archivo en Google Drive a la carpeta de procesados
-            if fname in file_id_map:
-                try:
-                    file_id = file_id_map[fname]
-                    move_file_in_drive(file_id, processed_folder_id, creds_path)
-                    log(f"Archivo {fname} movido a la carpeta de procesados en Google Drive")
-                except Exception as e:
-                    log(f"Error al mover el archivo {fname} en Google Drive: {e}")
-            
-            # Eliminar el archivo local después de procesarlo
+        # El resto de archivos con el mismo nombre base son duplicados
+        for _, dup_name in group[pos + 1:]:
+            log(f"Omitiendo archivo duplicado: {dup_name}")
+        return idx, data, fname, grants
+    return None
+
+async def process_cv_group_async(group, fetcher, qs_list, drive_folder_id, creds_path, semaphore, extraction_mode=None, packer=None):
+    """Versión asíncrona de process_cv_group; el semáforo limita los CVs en vuelo"""
+    async with semaphore:
+        for pos, (idx, fname) in enumerate(group):
+            log(f"Procesando {fname}...")
+            cv_path = os.path.join(fetcher.folder_path, fname)
             try:
-                os.remove(cv_path)
-                log(f"Archivo local {fname} eliminado")
+                if packer:
+                    cv_text = await packer.extract_text_async(fetcher, fname)
+                else:
+                    cv_text = await asyncio.to_thread(fetcher.extract_text, fname)
             except Exception as e:
-                log(f"Error al eliminar el archivo local {fname}: {e}")
+                log(f"Error al descargar el archivo {fname}: {e}")
+                continue
+            with cv_token_usage(fname), public_link_grants() as grants:
+                data = await process_cv_async(cv_path, qs_list, drive_folder_id, creds_path, extraction_mode,
+                                              cv_text, fetcher.file_ids.get(fname))
+            
+            if not data:
+                continue
+            
+            # El resto de archivos con el mismo nombre base son duplicados
+            for _, dup_name in group[pos + 1:]:
+                log(f"Omitiendo archivo duplicado: {dup_name}")
+            return idx, data, fname, grants
+        return None
+
+async def process_cv_groups_async(groups, fetcher, qs_list, drive_folder_id, creds_path, max_workers, extraction_mode=None, packer=None):
+    """
+    Procesa todos los grupos en un solo event loop con como máximo max_workers CVs en vuelo.
+    Devuelve el resultado de cada grupo, o la excepción si el grupo falló.
+    """
+    semaphore = asyncio.Semaphore(max_workers)
+    try:
+        return await asyncio.gather(*[
+            process_cv_group_async(group, fetcher, qs_list, drive_folder_id, creds_path, semaphore, extraction_mode, packer)
+            for group in groups
+        ], return_exceptions=True)
+    finally:
+        await close_async_openai_client()
+
+def outcome_awaits_drive_batch(outcome):
+    """True si el resultado de un grupo tiene permisos públicos que aún no se han enviado a Drive"""
+    return isinstance(outcome, tuple) and any(not grant.done() for _, grant in outcome[3])
+
+def collect_cv_outcome(group, outcome, fetcher, processed_folder_id, creds_path, drive_folder_id):
+    """
+    Recoge el resultado de un grupo. Si el grupo falló, o su CV no se pudo hacer público (el
+    link de la fila sería privado), se registra el error y sus archivos quedan sin procesar
+    (no se mueven ni se borran, así que la siguiente ejecución los vuelve a intentar); si
+    produjo datos, el CV pasa a la carpeta de procesados. Los permisos públicos del resultado
+    ya deben estar enviados (ver outcome_awaits_drive_batch). Devuelve (índice, datos) o None.
+    """
+    if isinstance(outcome, Exception):
+        count_stat("cv_errors")
+        log(f"Error al procesar {', '.join(fname for _, fname in group)}: {outcome}")
+        return None
+    if not outcome:
+        return None
+    idx, data, fname, grants = outcome
+    if not confirm_public_links(grants, creds_path):
+        count_stat("cv_errors")
+        log(f"No se pudo hacer público el CV {fname}: queda sin procesar")
+        return None
+    finish_processed_cv(fname, os.path.join(fetcher.folder_path, fname), processed_folder_id, creds_path,
+                        fetcher.file_ids, drive_folder_id)
+    return idx, data
+
+def process_all_cvs_in_folder(folder_path, qs_list, drive_folder_id, processed_folder_id, creds_path, service_account_file, spreadsheet_id, sheet_name, downloaded_files, max_workers=MAX_WORKERS, mode=PIPELINE_MODE, extraction_mode=None, drive_files=(), cv_texts=None):
+    """
+    Procesa los CVs de la carpeta local y los de drive_files, que se descargan mientras se
+    procesan (sin pasar por disco salvo los más grandes que DOWNLOAD_SPILL_BYTES). cv_texts
+    ({nombre: texto}) son textos ya extraídos (p. ej. por el modo batch) que no se vuelven a extraer.
+    """
+    files = order_cv_files(folder_path, drive_files)
+    
+    # Agrupar por nombre base para evitar procesar duplicados: cada grupo lo procesa
+    # un único worker, así que solo se procesa el primer archivo válido de cada nombre
+    groups = plan_cv_groups(files)
+    
+    # Mapear nombres de archivo a IDs de Drive y empezar las descargas en el orden de procesamiento
+    file_id_map = {os.path.basename(file["path"]): file["id"] for file in downloaded_files}
+    fetcher = CVFetcher(folder_path, creds_path, drive_files, [group[0][1] for group in groups], file_id_map)
+    for fname, cv_text in (cv_texts or {}).items():
+        fetcher.keep_text(fname, cv_text)
+    
+    max_workers = max(1, min(max_workers, len(groups) or 1))
+    # El pool de procesos se crea aquí, en el hilo principal, y no desde los workers
+    get_process_pool()
+    # El procesamiento por lotes cede el paso a las peticiones interactivas de las apps; los
+    # movimientos y permisos de Drive se envían en batches
+    try:
+        with request_priority(PRIORITY_BACKFILL), drive_batching(creds_path) as batcher:
+            # Los datos básicos de los CVs cortos se piden en paquetes a medida que se extraen (quedan en la caché)
+            packer = None
+            if PACK_SHORT_CVS and LLM_CACHE_ENABLED and (extraction_mode or EXTRACTION_MODE) == "two-pass":
+                packer = BasicDataPacker()
+            # Un CV solo se mueve a procesados (y se borra su copia local) una vez recogido su resultado,
+            # y los que esperan a que se envíe su permiso público se recogen después del último batch
+            outcomes = []
+            awaiting_batch = []
+            
+            def collect(group, result):
+                if outcome_awaits_drive_batch(result):
+                    awaiting_batch.append((group, result))
+                else:
+                    outcomes.append(collect_cv_outcome(group, result, fetcher, processed_folder_id, creds_path,
+                                                       drive_folder_id))
+            
+            if mode == "async":
+                log(f"Procesando {len(groups)} CVs en un event loop con hasta {max_workers} CVs en vuelo...")
+                group_results = asyncio.run(process_cv_groups_async(groups, fetcher, qs_list, drive_folder_id,
+                                                                    creds_path, max_workers, extraction_mode, packer))
+                for group, result in zip(groups, group_results):
+                    collect(group, result)
+            else:
+                log(f"Procesando {len(groups)} CVs con {max_workers} workers...")
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    futures = {
+                        executor.submit(contextvars.copy_context().run, process_cv_group, group, fetcher, qs_list,
+                                        drive_folder_id, creds_path, extraction_mode, packer): group
+                        for group in groups
+                    }
+                    for future in as_completed(futures):
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            result = e
+                        collect(futures[future], result)
+            batcher.flush()
+            for group, result in awaiting_batch:
+                outcomes.append(collect_cv_outcome(group, result, fetcher, processed_folder_id, creds_path,
+                                                   drive_folder_id))
+    finally:
+        fetcher.close()
+    
+    # Devolver los resultados en orden determinista (el mismo que el procesamiento secuencial)
+    outcomes = sorted((outcome for outcome in outcomes if outcome), key=lambda outcome: outcome[0])
+    results = [data for _, data in outcomes]
     
     log(f"Procesados {len(results)} CVs nuevos.")
+    log_run_summary()
     return results
 
+# === Modo batch (OpenAI Batch API) para backlogs grandes ===
+def get_batch_openai_client():
+    """Cliente síncrono para la Batch API (OPENAI_BATCH_BASE_URL permite usar un servidor local de pruebas)"""
+    if OPENAI_BATCH_BASE_URL:
+        return openai.OpenAI(api_key=openai.api_key, base_url=OPENAI_BATCH_BASE_URL)
+    return openai.OpenAI(api_key=openai.api_key)
+
+def write_batch_file(requests, phase):
+    """Escribe las peticiones {custom_id: petición} como JSONL en BATCH_WORK_DIR y devuelve la ruta"""
+    os.makedirs(BATCH_WORK_DIR, exist_ok=True)
+    path = os.path.join(BATCH_WORK_DIR, f"batch_{phase}_{time.strftime('%Y%m%d_%H%M%S')}_{len(requests)}.jsonl")
+    with open(path, 'w', encoding='utf-8') as f:
+        for custom_id, request in requests.items():
+            line = {"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": request}
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+    return path
+
+def wait_for_batch(client, batch):
+    """Consulta el estado del batch cada BATCH_POLL_SECONDS segundos hasta que termina"""
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        time.sleep(BATCH_POLL_SECONDS)
+        batch = client.batches.retrieve(batch.id)
+        counts = batch.request_counts
+        progress = f" ({counts.completed + counts.failed}/{counts.total})" if counts else ""
+        log(f"Batch {batch.id}: {batch.status}{progress}")
+    return batch
+
+def read_batch_output(client, batch, requests):
+    """
+    Devuelve {custom_id: texto de la respuesta} de las peticiones que terminaron bien. Los tokens
+    se registran con el modelo pedido (la respuesta trae el nombre con fecha, que no tiene precio)
+    y el sufijo BATCH_USAGE_SUFFIX, para aplicar el descuento de la Batch API.
+    """
+    answers = {}
+    if batch.output_file_id:
+        for line in client.files.content(batch.output_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            response = item.get("response") or {}
+            body = response.get("body") or {}
+            if response.get("status_code") != 200 or not body.get("choices"):
+                continue
+            usage = body.get("usage")
+            request = requests.get(item["custom_id"])
+            if usage and request:
+                record_token_usage(request["model"] + BATCH_USAGE_SUFFIX, SimpleNamespace(**usage))
+            answers[item["custom_id"]] = body["choices"][0]["message"]["content"]
+    if batch.error_file_id:
+        errors = [line for line in client.files.content(batch.error_file_id).text.splitlines() if line.strip()]
+        log(f"Batch {batch.id}: {len(errors)} peticiones con error")
+    return answers
+
+def run_openai_batch(requests, phase):
+    """
+    Envía las peticiones {custom_id: petición} a la Batch API (en lotes de BATCH_MAX_REQUESTS),
+    espera a que terminen y devuelve {custom_id: texto de la respuesta}. Las peticiones que
+    fallan se reenvían en hasta BATCH_RETRY_ROUNDS batches más; las que siguen fallando no
+    aparecen en el resultado y las resuelve después el procesamiento normal.
+    """
+    if not requests:
+        return {}
+    client = get_batch_openai_client()
+    answers = {}
+    pending = dict(requests)
+    for round_number in range(BATCH_RETRY_ROUNDS + 1):
+        if round_number:
+            log(f"Reenviando {len(pending)} peticiones fallidas ({phase}) en un nuevo batch")
+        batches = []
+        for chunk in chunk_list(list(pending.items()), BATCH_MAX_REQUESTS):
+            path = write_batch_file(dict(chunk), phase)
+            with open(path, 'rb') as f:
+                input_file = client.files.create(file=f, purpose="batch")
+            batch = client.batches.create(input_file_id=input_file.id, endpoint="/v1/chat/completions",
+                                          completion_window=BATCH_COMPLETION_WINDOW)
+            log(f"Batch {batch.id} enviado ({phase}): {len(chunk)} peticiones desde {path}")
+            batches.append(batch)
+        
+        for batch in batches:
+            batch = wait_for_batch(client, batch)
+            if batch.status != "completed":
+                log(f"Batch {batch.id} terminó con estado {batch.status}")
+            answers.update(read_batch_output(client, batch, requests))
+        pending = {custom_id: request for custom_id, request in pending.items() if custom_id not in answers}
+        if not pending:
+            break
+    count_stat("batch_requests", len(requests))
+    count_stat("batch_answers", len(answers))
+    return answers
+
+def batch_cv_data(cv_text, filename, qs_list, extraction_mode):
+    """
+    Datos del CV tal como los construye process_cv, solo con lo que ya está en caché (sin llamar
+    a GPT). Devuelve None si falta algo: ese CV lo termina el procesamiento normal.
+    """
+    if extraction_mode == "single-pass":
+        request = build_single_pass_request(cv_text)
+        data = llm_cache_get(llm_cache_key("single-pass", request["model"], cv_text))
+        if data is None:
+            return None
+        data = apply_single_pass_fallbacks(data, cv_text, filename)
+    else:
+        request = build_basic_data_request(cv_text)
+        data = llm_cache_get(llm_cache_key("basic", request["model"], cv_text))
+        if data is None:
+            return None
+        data = apply_basic_data_fallbacks(data, cv_text, filename)
+    if qs_list is not None:
+        univ = data.get("Universidad doctorado", "")
+        if not univ or univ.strip().lower() == "no encontrado":
+            match_qs = {"Universidad doctorado": "No encontrado", "QS Rank": "No encontrado"}
+        else:
+            match_qs = qs_cache_get(univ, qs_list)
+            if match_qs is None:
+                return None
+        data["Universidad doctorado"] = match_qs["Universidad doctorado"]
+        data["QS Rank"] = match_qs["QS Rank"]
+    for k in data:
+        if not data[k]:
+            data[k] = "No encontrado"
+    return data
+
+def prefetch_with_batches(folder_path, qs_list, extraction_mode=None):
+    """
+    Modo backlog: resuelve las llamadas a GPT de todos los CVs pendientes con la Batch API y
+    guarda las respuestas en la caché con las mismas claves que usa process_cv. Después, el
+    procesamiento normal encuentra todo en caché. Fases (cada una depende de la anterior):
+    1. datos básicos (o single-pass), 2. universidades QS sin resolver localmente (con GPT-4o
+    y, para las que no encuentra, 2b. los bloques de la lista QS con GPT-3.5),
+    3. área de conocimiento (solo en modo two-pass).
+    Devuelve los textos extraídos ({nombre: texto}) para que el procesamiento no los vuelva a extraer.
+    Ninguna fase llama a GPT fuera de la Batch API: los CVs con alguna petición fallida se
+    saltan en las fases siguientes y los termina el procesamiento normal. La única petición en
+    línea son los embeddings de la fase 2 (una sola para todas sus universidades, más los de la
+    lista QS si no están guardados en QS_EMBEDDINGS_PATH), que hacen falta para armar los prompts.
+    """
+    extraction_mode = extraction_mode or EXTRACTION_MODE
+    cv_texts = {}
+    for group in plan_cv_groups(order_cv_files(folder_path)):
+        fname = group[0][1]
+        cv_text = extract_cv_text(os.path.join(folder_path, fname))
+        if cv_text and cv_text.strip():
+            cv_texts[fname] = cv_text
+    log(f"Modo batch: {len(cv_texts)} CVs con texto")
+    
+    # Fase 1: datos básicos (o campos + área en modo single-pass)
+    kind = "single-pass" if extraction_mode == "single-pass" else "basic"
+    pending = {}
+    for i, cv_text in enumerate(cv_texts.values()):
+        request = build_single_pass_request(cv_text) if kind == "single-pass" else build_basic_data_request(cv_text)
+        cache_key = llm_cache_key(kind, request["model"], cv_text)
+        if llm_cache_get(cache_key) is None:
+            pending[f"{kind}-{i}"] = (cache_key, request)
+    answers = run_openai_batch({custom_id: request for custom_id, (_, request) in pending.items()}, kind)
+    for custom_id, raw in answers.items():
+        cache_key, request = pending[custom_id]
+        try:
+            data = parse_json_response(raw)
+        except Exception as e:
+            log(f"Respuesta batch no válida ({custom_id}): {e}")
+            continue
+        if kind == "single-pass":
+            data["Area"] = data.get("Area") or ""
+        llm_cache_set(cache_key, kind, request["model"], data)
+    
+    # Fase 2: universidades que no están en caché ni se resuelven con alias, similitud o el motor local
+    pending = {}
+    pending_names = set()
+    pending_univs = []
+    for fname, cv_text in cv_texts.items():
+        data = batch_cv_data(cv_text, fname, None, extraction_mode)
+        if data is None:
+            continue
+        univ = data.get("Universidad doctorado", "")
+        if univ.strip().lower() == "no encontrado" or qs_cache_get(univ, qs_list) is not None:
+            continue
+        local_match = match_university_qs_local(univ, qs_list)
+        if local_match:
+            qs_cache_set(univ, qs_list, local_match)
+            continue
+        univ_key = qs_cache_name(univ)
+        if univ_key not in pending_names:
+            pending_names.add(univ_key)
+            pending_univs.append(univ)
+    # Los candidatos QS de todas las universidades salen de una sola petición de embeddings
+    for univ, candidate_rows in zip(pending_univs, qs_prompt_rows_many(pending_univs, qs_list)):
+        pending[f"qs-{len(pending)}"] = (univ, build_qs_request(univ, candidate_rows))
+    answers = run_openai_batch({custom_id: request for custom_id, (_, request) in pending.items()}, "qs")
+    not_found = []
+    for custom_id, (univ, _) in pending.items():
+        result = None
+        if custom_id in answers:
+            try:
+                result = parse_qs_response(univ, answers[custom_id])
+            except Exception as e:
+                log(f"Respuesta batch no válida ({custom_id}): {e}")
+                continue
+        if result:
+            remember_qs_match(univ, qs_list, result)
+            qs_cache_set(univ, qs_list, result)
+        elif custom_id in answers:
+            not_found.append(univ)
+    
+    # Fase 2b: GPT-4o no las encontró entre los candidatos; bloques de la lista QS como en resolve_qs_chunks
+    chunks = list(chunk_list(qs_list, 40))
+    chunk_requests = {
+        f"qs-chunk-{n}-{i}": build_qs_chunk_request(univ, chunk)
+        for n, univ in enumerate(not_found)
+        for i, chunk in enumerate(chunks)
+    }
+    answers = run_openai_batch(chunk_requests, "qs-chunks")
+    for n, univ in enumerate(not_found):
+        result, complete = resolve_qs_chunk_answers(univ, chunks, [answers.get(f"qs-chunk-{n}-{i}") for i in range(len(chunks))])
+        if result and complete:
+            remember_qs_match(univ, qs_list, result)
+        qs_cache_set(univ, qs_list, result or {"Universidad doctorado": "No encontrado", "QS Rank": "No encontrado"},
+                     complete)
+    
+    # Fase 3: área de conocimiento con el subject y la universidad QS, como en process_cv
+    if extraction_mode != "single-pass":
+        pending = {}
+        for i, (fname, cv_text) in enumerate(cv_texts.items()):
+            data = batch_cv_data(cv_text, fname, qs_list, extraction_mode)
+            if data is None:
+                continue
+            subject, university = data.get("Subject", ""), data.get("Universidad doctorado", "")
+            request = build_area_request(cv_text, subject, university)
+            cache_key = llm_cache_key("area", request["model"], cv_text, subject, university)
+            if llm_cache_get(cache_key) is None:
+                pending[f"area-{i}"] = (cache_key, request, subject)
+        answers = run_openai_batch({custom_id: request for custom_id, (_, request, _) in pending.items()}, "area")
+        for custom_id, raw in answers.items():
+            cache_key, request, subject = pending[custom_id]
+            llm_cache_set(cache_key, "area", request["model"], normalize_knowledge_area(raw.strip(), subject))
+    return cv_texts
+
 def make_hyperlink(nombre, cv_link):
     # En Google Sheets, para que el hipervínculo funcione correctamente como fórmula,
     # necesitamos usar la función HYPERLINK con el signo igual al principio
@@ -833,12 +4167,7 @@ def make_hyperlink(nombre, cv_link):
 
 def get_processed_cvs_from_sheets(service_account_file, spreadsheet_id, sheet_name):
     """Obtiene la lista de CVs ya procesados en Google Sheets"""
-    scope = [
-        'https://spreadsheets.google.com/feeds',
-        'https://www.googleapis.com/auth/drive'
-    ]
-    creds = Credentials.from_service_account_file(service_account_file, scopes=scope)
-    gc = gspread.authorize(creds)
+    gc = get_gspread_client(service_account_file)
     sh = gc.open_by_key(spreadsheet_id)
     worksheet = sh.worksheet(sheet_name)
     
@@ -863,12 +4192,7 @@ def get_processed_cvs_from_sheets(service_account_file, spreadsheet_id, sheet_na
 
 def export_to_sheets(df, service_account_file, spreadsheet_id, sheet_name):
     """Exporta los resultados a Google Sheets, añadiendo filas nuevas sin borrar las existentes"""
-    scope = [
-        'https://spreadsheets.google.com/feeds',
-        'https://www.googleapis.com/auth/drive'
-    ]
-    creds = Credentials.from_service_account_file(service_account_file, scopes=scope)
-    gc = gspread.authorize(creds)
+    gc = get_gspread_client(service_account_file)
     sh = gc.open_by_key(spreadsheet_id)
     
     # Intentar obtener la hoja, si no existe, crearla
@@ -1028,10 +4352,77 @@ def export_to_sheets(df, service_account_file, spreadsheet_id, sheet_name):
         except ValueError:
             log("ADVERTENCIA: No se encontró la columna 'Nombre completo' en la hoja")
 
-def main():
+def estimate_run(cv_paths, qs_list, extraction_mode=None, max_workers=MAX_WORKERS):
+    """
+    Estimación previa sin llamar a la API: tokens de entrada de las peticiones de cada CV
+    (contados con el mismo extracto que se enviaría), tokens de salida como máximo (max_tokens),
+    una consulta QS a GPT-4o por CV en el peor caso, coste y duración aproximada.
+    """
+    extraction_mode = extraction_mode or EXTRACTION_MODE
+    usage = Counter()
+    requests_per_model = Counter()
+    qs_request = build_qs_request("", list(qs_list)[:QS_PROMPT_CANDIDATES])
+    for cv_path in cv_paths:
+        cv_text = extract_cv_text(cv_path)
+        if not cv_text or not cv_text.strip():
+            continue
+        if extraction_mode == "single-pass":
+            requests = [build_single_pass_request(cv_text), qs_request]
+        else:
+            requests = [build_basic_data_request(cv_text), build_area_request(cv_text), qs_request]
+        for request in requests:
+            model = request["model"]
+            usage[(model, "prompt")] += count_tokens(request["messages"][0]["content"], model)
+            usage[(model, "completion")] += request["max_tokens"]
+            requests_per_model[model] += 1
+    
+    seconds = sum(MODEL_AVG_LATENCY_SECONDS.get(model, 3.0) * n for model, n in requests_per_model.items())
+    log(f"Estimación para {len(cv_paths)} CVs (modo {extraction_mode}):")
+    for model, n in sorted(requests_per_model.items()):
+        log(f"  {model}: {n} peticiones, {usage[(model, 'prompt')]} tokens de entrada, "
+            f"hasta {usage[(model, 'completion')]} de salida")
+    log(f"  Coste máximo: {usage_cost(usage):.4f} USD")
+    log(f"  Duración aproximada con {max_workers} CVs en paralelo: {seconds / max(max_workers, 1) / 60:.1f} min")
+    return usage
+
+def parse_args(argv=None):
+    """Opciones de línea de comandos del procesamiento por lotes"""
+    parser = argparse.ArgumentParser(description="Procesa los CVs de Google Drive y exporta los resultados a Google Sheets")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="No leer ni escribir la caché de resultados de GPT ni la de resoluciones QS")
+    parser.add_argument("--clear-cache", action="store_true",
+                        help="Vaciar la caché de resultados de GPT y de resoluciones QS antes de procesar")
+    parser.add_argument("--batch", action="store_true",
+                        help="Resolver las llamadas a GPT de todo el backlog con la Batch API antes de procesar")
+    parser.add_argument("--batch-base-url", default=None,
+                        help="URL base de un servidor compatible con la Batch API (para pruebas)")
+    parser.add_argument("--estimate", action="store_true",
+                        help="Descargar los CVs nuevos y estimar tokens, coste y duración sin llamar a GPT")
+    parser.add_argument("--rescan-drive", action="store_true",
+                        help="Ignorar el manifiesto local y volver a listar completas las carpetas de Drive")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    global LLM_CACHE_ENABLED, OPENAI_BATCH_BASE_URL
+    args = parse_args(argv)
+    if args.batch and args.no_cache:
+        log("El modo batch guarda las respuestas en la caché de GPT; no se puede usar con --no-cache")
+        return
+    if args.batch_base_url:
+        OPENAI_BATCH_BASE_URL = args.batch_base_url
+    if args.clear_cache:
+        clear_llm_cache()
+    if args.rescan_drive:
+        clear_drive_manifest()
+    if args.no_cache:
+        LLM_CACHE_ENABLED = False
+        log("Caché de GPT desactivada para esta ejecución")
+    
     log("Descargando lista QS desde Google Sheets...")
     qs_list = get_qs_list_from_google_sheets(QS_GOOGLE_SHEET_ID, QS_TAB_NAME, SERVICE_ACCOUNT_FILE)
     log(f"Universidades QS cargadas: {len(qs_list)}")
+    # Construir una sola vez el índice de nombres QS que usan todos los CVs
+    qs_list = QSIndex(qs_list)
     
     # Verificar/crear la carpeta de procesados en Google Drive
     processed_folder_id = GOOGLE_DRIVE_PROCESSED_FOLDER_ID
@@ -1048,18 +4439,34 @@ def main():
     already_processed = list(set(sheets_processed + drive_processed))
     log(f"Se encontraron {len(already_processed)} CVs ya procesados")
     
-    # Descargar solo los archivos nuevos de Google Drive a la carpeta local
-    log(f"Descargando archivos nuevos de Google Drive a la carpeta local {FOLDER_CVS}...")
-    downloaded_files = download_files_from_drive(GOOGLE_DRIVE_FOLDER_ID, processed_folder_id, FOLDER_CVS, SERVICE_ACCOUNT_FILE, already_processed)
+    os.makedirs(FOLDER_CVS, exist_ok=True)
+    if args.estimate or args.batch:
+        # Estos modos leen todos los CVs antes de procesar: se descargan primero a la carpeta local
+        log(f"Descargando archivos nuevos de Google Drive a la carpeta local {FOLDER_CVS}...")
+        downloaded_files = download_files_from_drive(GOOGLE_DRIVE_FOLDER_ID, processed_folder_id, FOLDER_CVS, SERVICE_ACCOUNT_FILE, already_processed)
+        new_files = []
+    else:
+        # Los CVs nuevos se descargan en memoria mientras se procesan
+        downloaded_files = []
+        new_files = list_new_drive_cvs(GOOGLE_DRIVE_FOLDER_ID, SERVICE_ACCOUNT_FILE, already_processed)
     
-    if not downloaded_files:
+    if not downloaded_files and not new_files:
         log("No hay nuevos CVs para procesar. Terminando.")
         return
     
+    if args.estimate:
+        estimate_run([file["path"] for file in downloaded_files], qs_list)
+        return
+    
+    cv_texts = None
+    if args.batch:
+        log("Resolviendo las llamadas a GPT con la Batch API...")
+        cv_texts = prefetch_with_batches(FOLDER_CVS, qs_list)
+    
     log("Procesando CVs y subiendo a Google Drive...")
     resultados = process_all_cvs_in_folder(FOLDER_CVS, qs_list, GOOGLE_DRIVE_FOLDER_ID, processed_folder_id, 
                                           SERVICE_ACCOUNT_FILE, SERVICE_ACCOUNT_FILE, SPREADSHEET_ID, SHEET_NAME,
-                                          downloaded_files)
+                                          downloaded_files, drive_files=new_files, cv_texts=cv_texts)
     
     # Si no hay nuevos CVs para procesar, terminar
     if not resultados:
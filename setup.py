@@ -13,10 +13,10 @@ import subprocess
 import platform
 
 def check_python_version():
-    """Verifica que la versión de Python sea 3.7 o superior"""
+    """Verifica que la versión de Python sea 3.9 o superior"""
     version = sys.version_info
-    if version.major < 3 or (version.major == 3 and version.minor < 7):
-        print("Error: Se requiere Python 3.7 o superior")
+    if version.major < 3 or (version.major == 3 and version.minor < 9):
+        print("Error: Se requiere Python 3.9 o superior")
         print(f"Versión actual: {platform.python_version()}")
         return False
     return True
@@ -63,7 +63,7 @@ def main():
     
     # Verificar versión de Python
     if not check_python_version():
-        print("Por favor, actualiza Python a la versión 3.7 o superior")
+        print("Por favor, actualiza Python a la versión 3.9 o superior")
         return
     
     # Instalar dependencias
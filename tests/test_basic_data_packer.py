@@ -0,0 +1,78 @@
+"""Validación de las respuestas empaquetadas de datos básicos y formación de paquetes"""
+import json
+import threading
+
+import procesar_drive_cvs as cvs
+
+
+def item(number, **overrides):
+    data = {field: "No encontrado" for field in cvs.BASIC_DATA_FIELDS}
+    data["Nombre completo"] = f"Persona {number}"
+    data.update(overrides)
+    return dict(data, CV=number)
+
+
+def test_valid_items_are_kept_by_number():
+    raw = "Aquí está:\n" + json.dumps([item(2), item(1)]) + "\nFin"
+    valid = cvs.parse_packed_basic_data_response(raw, 2)
+    assert sorted(valid) == [1, 2]
+    assert valid[2]["Nombre completo"] == "Persona 2"
+    assert set(valid[1]) == set(cvs.BASIC_DATA_FIELDS)
+
+
+def test_invalid_items_are_dropped():
+    raw = json.dumps([
+        item(1),
+        item(1, **{"Nombre completo": "Repetido"}),  # Número repetido: gana el primero
+        item(3),  # Fuera de rango
+        item("x"),  # Número no válido
+        item(2, **{"Teléfono": 5512345678}),  # Campo que no es texto
+        {k: v for k, v in item(2).items() if k != "Subject"},  # Falta un campo
+        "CV 2",  # No es un objeto
+    ])
+    valid = cvs.parse_packed_basic_data_response(raw, 2)
+    assert list(valid) == [1]
+    assert valid[1]["Nombre completo"] == "Persona 1"
+
+
+def test_non_list_response_has_no_valid_items():
+    assert cvs.parse_packed_basic_data_response('[{"error": "x"}]', 1) == {}
+
+
+def test_only_valid_items_are_cached(monkeypatch):
+    cached = {}
+    monkeypatch.setattr(cvs, "chat_completion", lambda request: json.dumps([item(2), item(5)]))
+    monkeypatch.setattr(cvs, "llm_cache_set", lambda key, kind, model, data: cached.update({key: data}))
+    assert cvs.extract_packed_basic_data([("k1", "CV uno"), ("k2", "CV dos")]) == 1
+    assert list(cached) == ["k2"]
+
+
+class FakeFetcher:
+    def extract_text(self, fname):
+        return f"Persona {fname}\nTeléfono: 55 1234 5678"
+
+
+def test_packer_sends_one_pack_when_no_worker_is_extracting(monkeypatch):
+    packs = []
+    monkeypatch.setattr(cvs, "llm_cache_get", lambda key: None)
+    monkeypatch.setattr(cvs, "extract_packed_basic_data", lambda pack: packs.append(pack))
+    monkeypatch.setattr(cvs, "PACK_MAX_CVS", 10)
+    packer = cvs.BasicDataPacker()
+    barrier = threading.Barrier(3)
+    
+    class SyncedFetcher(FakeFetcher):
+        def extract_text(self, fname):
+            barrier.wait()  # Los tres workers extraen a la vez
+            return super().extract_text(fname)
+    
+    texts = {}
+    workers = [
+        threading.Thread(target=lambda name=name: texts.update({name: packer.extract_text(SyncedFetcher(), name)}))
+        for name in ("a", "b", "c")
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=10)
+    assert sorted(texts) == ["a", "b", "c"]
+    assert len(packs) == 1 and len(packs[0]) == 3
@@ -0,0 +1,87 @@
+"""Paridad del escáner de contactos (scan_contacts) con los fallbacks por regex originales"""
+import re
+
+import pytest
+
+import procesar_drive_cvs as cvs
+
+
+# Copias de los fallbacks anteriores al escáner, como referencia
+def legacy_email(text):
+    match = re.search(r"[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+", text)
+    return match.group(0) if match else "No encontrado"
+
+
+def legacy_phone(text):
+    phone_keywords = [
+        r"(?i)tel[eé]fono\s*(?:m[oó]vil)?[\s:]*(\+?[\d\s\-\(\)\.]{8,})",
+        r"(?i)phone\s*(?:number)?[\s:]*(\+?[\d\s\-\(\)\.]{8,})",
+        r"(?i)contact(?:o)?[\s:]*(\+?[\d\s\-\(\)\.]{8,})",
+        r"(?i)m[oó]vil[\s:]*(\+?[\d\s\-\(\)\.]{8,})",
+        r"(?i)celular[\s:]*(\+?[\d\s\-\(\)\.]{8,})",
+        r"(?i)tel[\s:]*(\+?[\d\s\-\(\)\.]{8,})",
+        r"(?i)phone[\s:]*(\+?[\d\s\-\(\)\.]{8,})",
+    ]
+    for pattern in phone_keywords:
+        match = re.search(pattern, text)
+        if match:
+            phone = cvs.clean_phone(match.group(1))
+            if len(re.sub(r'\D', '', phone)) >= 8:
+                return phone
+    phone_patterns = [
+        r"(?<!\d)(\+\d{1,3}[\s\-]?\d{1,3}[\s\-]?\d{3,}[\s\-]?\d{3,}(?!\d))",
+        r"(?<!\d)(\(\d{2,5}\)[\s\-]?\d{3,}[\s\-]?\d{3,}(?!\d))",
+        r"(?<!\d)(\d{3,}[\s\-]?\d{3,}[\s\-]?\d{3,}(?!\d))",
+    ]
+    for pattern in phone_patterns:
+        match = re.search(pattern, text)
+        if match:
+            phone = cvs.clean_phone(match.group(1))
+            if len(re.sub(r'\D', '', phone)) >= 8:
+                return phone
+    return "No encontrado"
+
+
+def legacy_linkedin(text):
+    match = re.search(r"https?://(www\.)?linkedin\.com/in/[A-Za-z0-9\-_/]+", text)
+    return match.group(0) if match else "No encontrado"
+
+
+SAMPLES = [
+    "Juan Pérez Gómez\nTeléfono: +52 55 1234 5678\njuan.perez@tec.mx\nhttps://linkedin.com/in/juanperez",
+    "MARÍA DÍAZ\nPhone number: (555) 123-4567\nEmail: maria.diaz@unam.mx",
+    "Dr. Carlos Rodríguez\nCelular 55 8765 4321\nhttps://www.linkedin.com/in/carlos-rodriguez/",
+    "Contacto: 33 1111 2222\nExperiencia 2007-2015 en docencia",
+    "Education\nPhD 2010-2014, MSc 2008-2010\nNo contact data here",
+    "Ana López\nMóvil: +34 612 345 678\nana@uni.es",
+    "Investigador\nTel. 81 2345 6789\nPublicaciones 1999-2004",
+    "Resume of Peter Smith\n+1 617 253 1000\npeter.smith@mit.edu",
+    "Oficina (01) 555 1234 y fax 555 987 6543",
+    "",
+]
+
+
+@pytest.mark.parametrize("text", SAMPLES)
+def test_scan_contacts_matches_legacy_fallbacks(text):
+    cvs.scan_contacts.cache_clear()
+    assert cvs.fallback_regex_email(text) == legacy_email(text)
+    assert cvs.fallback_regex_phone(text) == legacy_phone(text)
+    assert cvs.fallback_regex_linkedin(text) == legacy_linkedin(text)
+
+
+def test_year_ranges_are_not_phones():
+    text = "Doctorado 2007-2015\nMaestría 20032005"
+    assert cvs.fallback_regex_phone(text) == "No encontrado"
+    assert legacy_phone(text) == "No encontrado"
+
+
+def test_email_after_keyword_wins():
+    # Cambio intencional: el email marcado con "correo" gana a uno anterior sin palabra clave
+    text = "Editor de revista: revista@editorial.com\nCorreo: ana.perez@tec.mx"
+    assert cvs.fallback_regex_email(text) == "ana.perez@tec.mx"
+
+
+def test_phone_keyword_reliability_beats_position():
+    # "teléfono" es más fiable que "tel" aunque aparezca después
+    text = "Tel 55 0000 1111 (oficina)\nTeléfono: 55 2222 3333"
+    assert cvs.fallback_regex_phone(text) == "5522223333"
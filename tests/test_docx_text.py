@@ -0,0 +1,63 @@
+"""Extracción de texto de DOCX: cabeceras, pies de página, tablas y cuadros de texto"""
+import io
+import zipfile
+
+import docx
+import pytest
+
+import procesar_drive_cvs as cvs
+
+
+@pytest.fixture
+def cv_docx(tmp_path):
+    document = docx.Document()
+    section = document.sections[0]
+    section.header.paragraphs[0].text = "Ana Pérez · ana.perez@example.com"
+    section.footer.paragraphs[0].text = "Tel: +52 55 1234 5678"
+    document.add_paragraph("Experiencia")
+    table = document.add_table(rows=2, cols=2)
+    table.cell(0, 0).text = "Doctorado"
+    table.cell(0, 1).text = "UNAM"
+    table.cell(1, 0).text = "LinkedIn"
+    table.cell(1, 1).add_table(rows=1, cols=1).cell(0, 0).text = "linkedin.com/in/anaperez"
+    document.add_paragraph("Publicaciones")
+    path = tmp_path / "cv.docx"
+    document.save(path)
+    return path
+
+
+def test_header_body_tables_and_footer_in_reading_order(cv_docx):
+    lines = [line for line in cvs.extract_docx_xml_text(str(cv_docx)).splitlines() if line.strip()]
+    assert lines == [
+        "Ana Pérez · ana.perez@example.com",
+        "Experiencia",
+        "Doctorado | UNAM",
+        "LinkedIn | linkedin.com/in/anaperez",
+        "Publicaciones",
+        "Tel: +52 55 1234 5678",
+    ]
+
+
+def test_bytes_and_char_budget(cv_docx):
+    data = cv_docx.read_bytes()
+    text = cvs.extract_text_from_docx(str(cv_docx), data=data)
+    assert text == cvs.extract_docx_xml_text(str(cv_docx))
+    assert cvs.extract_text_from_docx(str(cv_docx), char_budget=20, data=data) == text[:20]
+
+
+def test_text_box_is_read_once_without_fallback(tmp_path):
+    w = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+    mc = "http://schemas.openxmlformats.org/markup-compatibility/2006"
+    body = f"""<w:document xmlns:w="{w}" xmlns:mc="{mc}"><w:body>
+<w:p><w:r><w:t>Antes</w:t></w:r><w:r><mc:AlternateContent>
+<mc:Choice Requires="wps"><w:txbxContent><w:p><w:r><w:t>Cuadro</w:t></w:r></w:p></w:txbxContent></mc:Choice>
+<mc:Fallback><w:txbxContent><w:p><w:r><w:t>Cuadro</w:t></w:r></w:p></w:txbxContent></mc:Fallback>
+</mc:AlternateContent></w:r></w:p>
+<w:p><w:r><w:t>Después</w:t></w:r></w:p>
+</w:body></w:document>"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("word/document.xml", body)
+    text = cvs.extract_docx_xml_text(buffer.getvalue())
+    assert text.count("Cuadro") == 1
+    assert text.index("Cuadro") < text.index("Después")
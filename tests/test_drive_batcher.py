@@ -0,0 +1,132 @@
+"""Reintentos del DriveBatcher con un servicio de Drive falso"""
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+import procesar_drive_cvs as cvs
+
+
+def http_error(status, **headers):
+    return HttpError(httplib2.Response(dict(headers, status=status)), b'{"error": {}}')
+
+
+class FakeDrive:
+    """
+    Servicio falso: cada batch llama a respond(request, intento) por operación, que devuelve la
+    respuesta o lanza el error; si lanza TransportError se corta el batch como un fallo de red
+    """
+    
+    class TransportError(Exception):
+        pass
+    
+    def __init__(self, respond):
+        self.respond = respond
+        self.batches = []
+    
+    def new_batch_http_request(self, callback):
+        drive = self
+        
+        class Batch:
+            def __init__(self):
+                self.requests = []
+            
+            def add(self, request, request_id):
+                self.requests.append((request_id, request))
+            
+            def execute(self):
+                attempt = len(drive.batches)
+                drive.batches.append([request for _, request in self.requests])
+                for request_id, request in self.requests:
+                    try:
+                        response = drive.respond(request, attempt)
+                    except FakeDrive.TransportError:
+                        raise
+                    except Exception as e:
+                        callback(request_id, None, e)
+                    else:
+                        callback(request_id, response, None)
+        
+        return Batch()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(cvs.time, "sleep", delays.append)
+    monkeypatch.setattr(cvs, "log", lambda message: None)
+    return delays
+
+
+def run(monkeypatch, respond, names=("a", "b", "c")):
+    drive = FakeDrive(respond)
+    monkeypatch.setattr(cvs, "get_drive_service", lambda creds_path: drive)
+    batcher = cvs.DriveBatcher("creds.json", batch_size=10)
+    futures = {name: batcher.add(name, lambda service, name=name: name) for name in names}
+    batcher.flush()
+    return drive, futures
+
+
+def test_only_retryable_failures_are_resent(monkeypatch, sleeps):
+    def respond(request, attempt):
+        if request == "b" and attempt == 0:
+            raise http_error(429, **{"retry-after": "7"})
+        if request == "c":
+            raise http_error(404)
+        return {"id": request}
+    
+    drive, futures = run(monkeypatch, respond)
+    assert drive.batches == [["a", "b", "c"], ["b"]]
+    assert futures["a"].result() == {"id": "a"}
+    assert futures["b"].result() == {"id": "b"}
+    assert futures["c"].exception().resp.status == 404
+    assert sleeps == [7.0]  # Retry-After de la respuesta de Drive
+
+
+def test_retries_are_bounded(monkeypatch, sleeps):
+    monkeypatch.setattr(cvs, "DRIVE_BATCH_MAX_RETRIES", 2)
+    
+    def respond(request, attempt):
+        raise http_error(503)
+    
+    drive, futures = run(monkeypatch, respond, names=("a",))
+    assert len(drive.batches) == 3
+    assert futures["a"].exception().resp.status == 503
+    assert len(sleeps) == 2
+
+
+def test_transport_error_resends_only_unanswered_operations(monkeypatch, sleeps):
+    monkeypatch.setattr(cvs, "LLM_RETRY_BASE_DELAY", 0.0)
+    answered = []
+    
+    def respond(request, attempt):
+        if request == "b" and attempt == 0:
+            raise FakeDrive.TransportError("conexión cortada")
+        answered.append(request)
+        return {"id": request}
+    
+    drive, futures = run(monkeypatch, respond)
+    assert drive.batches == [["a", "b", "c"], ["b", "c"]]
+    assert answered == ["a", "b", "c"]
+    assert [futures[name].result() for name in "abc"] == [{"id": "a"}, {"id": "b"}, {"id": "c"}]
+
+
+def test_batch_is_sent_when_full(monkeypatch, sleeps):
+    drive = FakeDrive(lambda request, attempt: {"id": request})
+    monkeypatch.setattr(cvs, "get_drive_service", lambda creds_path: drive)
+    batcher = cvs.DriveBatcher("creds.json", batch_size=2)
+    first = batcher.add("a", lambda service: "a")
+    assert drive.batches == []
+    batcher.add("b", lambda service: "b")
+    assert drive.batches == [["a", "b"]]
+    assert first.result() == {"id": "a"}
+
+
+def test_drive_batching_discards_pending_operations_on_error(monkeypatch, sleeps):
+    drive = FakeDrive(lambda request, attempt: {"id": request})
+    monkeypatch.setattr(cvs, "get_drive_service", lambda creds_path: drive)
+    with pytest.raises(RuntimeError):
+        with cvs.drive_batching("creds.json") as batcher:
+            future = batcher.add("a", lambda service: "a")
+            raise RuntimeError("fallo en el bloque")
+    assert future.cancelled()
+    assert drive.batches == []
@@ -0,0 +1,47 @@
+"""Combinación de las respuestas por bloque de la lista QS (resolve_qs_chunk_answers)"""
+import json
+
+import procesar_drive_cvs as cvs
+
+CHUNKS = [
+    [["1", "Massachusetts Institute of Technology (MIT)"], ["2", "Imperial College London"]],
+    [["55", "Universidad Nacional Autónoma de México (UNAM)"], ["61", "Universidad de Buenos Aires (UBA)"]],
+]
+UNIV = "UNAM"
+
+
+def answer(name, rank="..."):
+    return json.dumps({"Universidad doctorado": name, "QS Rank": rank})
+
+
+def test_literal_match_uses_row_name_and_rank():
+    result = cvs.resolve_qs_chunk_answers(UNIV, CHUNKS, [
+        answer("No encontrado"),
+        answer("universidad nacional autonoma de mexico (unam)", "99"),
+    ])
+    assert result == ({"Universidad doctorado": "Universidad Nacional Autónoma de México (UNAM)", "QS Rank": "55"}, True)
+
+
+def test_literal_match_is_definitive_even_if_another_chunk_failed():
+    result, complete = cvs.resolve_qs_chunk_answers(UNIV, CHUNKS, [
+        None,
+        answer("Universidad Nacional Autónoma de México (UNAM)"),
+    ])
+    assert result["QS Rank"] == "55" and complete
+
+
+def test_no_match_in_any_chunk():
+    assert cvs.resolve_qs_chunk_answers(UNIV, CHUNKS, [answer("No encontrado"), answer("")]) == (None, True)
+
+
+def test_failed_chunk_without_match_is_not_definitive():
+    assert cvs.resolve_qs_chunk_answers(UNIV, CHUNKS, [None, answer("No encontrado")]) == (None, False)
+
+
+def test_most_similar_candidate_wins_and_keeps_completeness():
+    answers = [answer("Instituto Tecnológico", "1"), answer("UNAM Mexico", "55")]
+    assert cvs.resolve_qs_chunk_answers(UNIV, CHUNKS, answers) == (
+        {"Universidad doctorado": "UNAM Mexico", "QS Rank": "55"}, True
+    )
+    result, complete = cvs.resolve_qs_chunk_answers(UNIV, CHUNKS + [[]], answers + [None])
+    assert result["Universidad doctorado"] == "UNAM Mexico" and not complete
@@ -0,0 +1,70 @@
+"""Motor local de coincidencia de universidades (QSIndex.token_match)"""
+import pytest
+
+import procesar_drive_cvs as cvs
+
+QS = [
+    ["1", "Massachusetts Institute of Technology (MIT)"],
+    ["2", "University of Oxford"],
+    ["3", "University of Cambridge"],
+    ["4", "Universidad de Buenos Aires (UBA)"],
+    ["5", "Universidad Nacional Autónoma de México (UNAM)"],
+    ["6", "Universidad de Chile"],
+    ["7", "Pontificia Universidad Católica de Chile (UC)"],
+    ["8", "Technical University of Munich"],
+    ["9", "Universidad Politécnica de Madrid (UPM)"],
+    ["10", "Universidad Complutense de Madrid"],
+    ["11", "Universidad Autónoma de Madrid"],
+    ["12", "Universitat de Barcelona"],
+    ["13", "Stanford University"],
+]
+
+
+@pytest.fixture(scope="module")
+def qs_index():
+    return cvs.QSIndex(QS)
+
+
+def matched_name(qs_index, name, **kwargs):
+    i = qs_index.token_match(name, **kwargs)
+    return None if i is None else qs_index.rows[i][1]
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("Universidad de Oxford", "University of Oxford"),
+    ("Oxford University", "University of Oxford"),
+    ("Universidad Tecnica de Munich", "Technical University of Munich"),
+    ("Universidad de Barcelona", "Universitat de Barcelona"),
+    ("Universidad de Stanford", "Stanford University"),
+    ("Instituto Tecnologico de Massachusetts", "Massachusetts Institute of Technology (MIT)"),
+])
+def test_translated_names_match(qs_index, name, expected):
+    assert matched_name(qs_index, name) == expected
+
+
+@pytest.mark.parametrize("acronym, expected", [
+    ("MIT", "Massachusetts Institute of Technology (MIT)"),
+    ("UPM", "Universidad Politécnica de Madrid (UPM)"),
+    ("UNAM", "Universidad Nacional Autónoma de México (UNAM)"),
+])
+def test_unique_acronyms_match(qs_index, acronym, expected):
+    assert matched_name(qs_index, acronym) == expected
+
+
+@pytest.mark.parametrize("name", [
+    "Universidad de Madrid",  # Tres universidades de Madrid: ninguna aventaja a las demás
+    "Universidad Catolica",
+    "Harvard University",  # No está en la lista
+])
+def test_ambiguous_or_unknown_names_are_rejected(qs_index, name):
+    assert matched_name(qs_index, name) is None
+
+
+def test_shared_acronym_is_not_used():
+    qs_index = cvs.QSIndex(QS + [["14", "University of California (UC)"]])
+    assert matched_name(qs_index, "UC") is None
+
+
+def test_margin_rejects_close_runner_up(qs_index):
+    assert matched_name(qs_index, "Chile") == "Universidad de Chile"
+    assert matched_name(qs_index, "Chile", min_margin=0.99) is None